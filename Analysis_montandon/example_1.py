@@ -3,18 +3,22 @@ This script retrieves all disaster event items from the Montandon STAC API's 'us
 fetching results across all pages using standard STAC pagination.
 
 Features:
-- Tracks and prints the number of events per page and cumulative total, using len(data["features"]).
+- Tracks and prints the number of events per page and cumulative total, streaming pages through
+  montandon.paginator so only one page is held in memory at a time.
 - Requests only selected keys ('id', 'assets', 'properties') in each event's output.
 
 Requires:
     - requests (pip install requests)
 """
 
-import requests
+import os
+import sys
 
-# Define base API URL and endpoint for USGS events
-base_url = "https://montandon-eoapi-stage.ifrc.org/stac"
-endpoint = "/collections/usgs-events/items"
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.paginator import PageFetchError, iter_pages
+
+# Collection to page through
+collection_id = "usgs-events"
 
 # Set your query parameters (adjust values as needed)
 params = {
@@ -25,34 +29,14 @@ params = {
     "fields": "id,assets,properties"  # Only request specific keys per event
 }
 
-all_items = []  # Will hold all returned items
-next_url = base_url + endpoint
-page_num = 1  # Track pagination
-
-while next_url:
-    response = requests.get(next_url, params=params)
-    if not response.ok:
-        print(f"Request failed (Page {page_num}):", response.status_code, response.text)
-        break
-
-    data = response.json()
-    page_count = len(data["features"])
-    all_items.extend(data["features"])
-
-    print(f"Page {page_num}: Discovered {page_count} events, Cumulative total: {len(all_items)}")
-
-    # Find pagination 'next' link
-    next_link = None
-    for link in data.get("links", []):
-        if link.get("rel") == "next":
-            next_link = link.get("href")
-            break
-
-    if next_link:
-        next_url = next_link
-        params = {}
-        page_num += 1
-    else:
-        next_url = None
-
-print(f"\nFetched {len(all_items)} events across all pages.")
+total_items = 0  # Only the running count is kept; each page is released after use
+
+try:
+    for page in iter_pages(collection_id, **params):
+        page_count = len(page.features)
+        total_items += page_count
+        print(f"Page {page.number}: Discovered {page_count} events, Cumulative total: {total_items}")
+except PageFetchError as ex:
+    print(f"Request failed (Page {ex.page}):", ex.status, ex.cause)
+
+print(f"\nFetched {total_items} events across all pages.")
@@ -1,19 +1,45 @@
 ## counts events by collection and country in the Montandon STAC API
+## Run with --resume to carry on from the checkpoint of an interrupted run.
 from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import asyncio
 import csv
-import time
-import random
 import json
 import os
-import requests
-event_collections = [
-    "ifrcevent-events", "pdc-events", "desinventar-events", "emdat-events",
-    "gdacs-events", "gfd-events", "glide-events", "ibtracs-events",
-    "idmc-gidd-events", "idmc-idu-events", "reference-events"
-]
-BASE_URL = "https://montandon-eoapi-stage.ifrc.org/stac/collections"
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.aggregate import DEFAULT_PERIOD, CodeCounts
+from montandon.catalog import get_catalog, load_catalog
+from montandon.checkpoint import DONE, CrawlCheckpoint
+from montandon.counting import count_collection_codes
+from montandon.dedup import EventTable, cluster_events
+from montandon.engine import FetchEngine, run_all
+from montandon.paginator import PageFetchError
+from montandon.ratelimit import shared_limiter
+from montandon.slicing import iter_sliced_pages, plan_windows, temporal_extent
+
 ERROR_FILE = "event_count_errors.json"
+CHECKPOINT_FILE = "event_count_checkpoint.json"  # Crawl state saved while paging, used by --resume
+MAX_CONCURRENCY = 16  # Requests in flight at once, shared by all collections
+# Starting requests/second; adapts to server health and is shared with other scripts running at
+# the same time. None sends as fast as MAX_CONCURRENCY allows.
+RATE_LIMIT = 8
+SLICES_PER_COLLECTION = 8  # Datetime windows paged in parallel within each collection
+# Page decoder that keeps only the requested fields ("auto" prefers ijson for lowest memory, "orjson"
+# for speed at the cost of decoding whole pages, "json"); None decodes pages in full
+PAGE_PARSER = "auto"
+# ISO3 codes to count with server-side counts (one small request per collection/code cell).
+# Leave empty to crawl every item and count all country codes found.
+COUNTRY_CODES = []
+# Directory of a local replica (python -m montandon.replica sync); when set, counts come from
+# the Parquet files instead of the API.
+REPLICA_DIR = None
+# Also group the events that several collections report into one cluster per real-world event
+# (montandon.dedup) and write CLUSTERS_FILE, counting each of them once per country. Needs the
+# crawl or the replica; COUNTRY_CODES counts have no items to cluster.
+DEDUPLICATE = False
+CLUSTERS_FILE = "event_clusters_by_country.csv"
 
 def write_error_entry(error_entry):
     """Append a single error as a JSON string to the error file."""
@@ -21,89 +47,186 @@ def write_error_entry(error_entry):
     with open(ERROR_FILE, "a", encoding="utf-8") as ef:
         ef.write(json.dumps(error_entry, ensure_ascii=False) + "\n")
 
-def fetch_country_counts(collection_id, page_limit=100, max_retries=10):
-    country_counter = Counter()
-    url = f"{BASE_URL}/{collection_id}/items?limit={page_limit}&fields=id,properties"
+async def fetch_country_counts(engine, collection_id, windows, page_limit=100, max_retries=None, checkpoint=None,
+                               events=None):
+    """
+    Counts country codes over all time slices of a collection. With a
+    checkpoint, progress is saved as pages come in and a saved scan over the
+    same windows is resumed from its last good pages. With an ``EventTable``
+    as ``events``, the items are also added to it for clustering.
+
+    Returns ``(collection_id, counts, complete)``; when a page fails after
+    the retry policy gives up, the counts so far are returned with
+    ``complete`` False.
+    """
+    counts = CodeCounts()
     total_fetched = 0
     page_count = 0
-    print(f"Started processing: {collection_id}")
-    # Random initial sleep to stagger thread starts
-    time.sleep(random.uniform(0.1, 0.8))
-    while url:
-        page_count += 1
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, timeout=60)
-                if response.status_code == 500:
-                    error_entry = {
-                        "collection": collection_id,
-                        "page": page_count,
-                        "reason": "500",
-                        "url": url
-                    }
-                    print(f"!! Server error 500 on {collection_id} (page {page_count}), writing error and giving up.")
-                    write_error_entry(error_entry)
-                    return collection_id, Counter()
-                elif response.status_code != 200:
-                    print(f"Error fetching {collection_id} (page {page_count}), attempt {attempt + 1}: HTTP {response.status_code}")
-                    raise Exception(f"HTTP {response.status_code}")
-                data = response.json()
-                features = data.get("features", [])
-                total_fetched += len(features)
-                for feature in features:
-                    codes = feature.get("properties", {}).get("monty:country_codes", [])
-                    country_counter.update(codes)
-                print(f"  {collection_id} - Page {page_count}: Fetched {len(features)} (cumulative: {total_fetched})")
-                next_url = next((l.get("href") for l in data.get("links", []) if l.get("rel") == "next"), None)
-                url = next_url
-                break  # Success, break out of retry loop
-            except Exception as ex:
-                wait_time = 2 ** attempt + random.uniform(0, 0.2)
-                print(f"  Error on {collection_id} page {page_count}, attempt {attempt + 1} -- {ex}. Retrying in {wait_time:.2f}s.")
-                time.sleep(wait_time)
-                if attempt == max_retries - 1:
-                    error_entry = {
-                        "collection": collection_id,
-                        "page": page_count,
-                        "reason": f"Failed after {max_retries} attempts: {str(ex)}",
-                        "url": url
-                    }
-                    print(f"  Giving up on {collection_id} (page {page_count}) after {max_retries} attempts, error written.")
-                    write_error_entry(error_entry)
-                    url = None  # Quit this collection
+    resume = {}
+    if checkpoint:
+        checkpoint.start(collection_id, windows)
+        resume = checkpoint.resume_links(collection_id)
+        counts.add_counts(collection_id, DEFAULT_PERIOD, checkpoint.aggregate(collection_id) or {})
+        page_count = checkpoint.entry(collection_id)["pages"]
+        total_fetched = checkpoint.entry(collection_id)["items"]
+    if resume:
+        print(f"Resuming: {collection_id} after {page_count} pages ({total_fetched} events)")
+    else:
+        print(f"Started processing: {collection_id} ({len(windows)} time slices)")
+    try:
+        pages = iter_sliced_pages(
+            engine, collection_id, windows, limit=page_limit,
+            fields="id,bbox,properties" if events is not None else "id,properties",
+            max_retries=max_retries, resume=resume
+        )
+        async for page in pages:
+            page_count += 1
+            total_fetched += len(page.features)
+            counts.add_page(page.features, collection_id, "monty:country_codes")
+            if events is not None:
+                events.add_items(page.features, collection_id)
+            if checkpoint:
+                checkpoint.record_page(collection_id, page, counts.get(collection_id))
+            print(f"  {collection_id} - Page {page_count}: Fetched {len(page.features)} (cumulative: {total_fetched})")
+    except PageFetchError as ex:
+        if checkpoint:
+            checkpoint.fail(collection_id, ex)
+        error_entry = {
+            "collection": collection_id,
+            "page": ex.page,
+            "status": ex.status,
+            "reason": f"Failed after retries: {str(ex.cause)}",
+            "url": ex.url
+        }
+        print(f"  Giving up on {collection_id} (page {ex.page}), error written; its counts are incomplete.")
+        write_error_entry(error_entry)
+        return collection_id, Counter(counts.get(collection_id)), False
+    if checkpoint:
+        checkpoint.finish(collection_id, counts.get(collection_id))
     print(f"Finished processing: {collection_id} (total events: {total_fetched})")
-    return collection_id, country_counter
-
-def main():
-    results = {}  # collection -> Counter
+    return collection_id, Counter(counts.get(collection_id)), True
 
-    # Clear any existing error file before running
-    if os.path.exists(ERROR_FILE):
-        os.remove(ERROR_FILE)
+async def count_known_codes(engine, collection_id):
+    """Counts COUNTRY_CODES in one collection from numberMatched, streaming only if the server can't count."""
+    print(f"Started counting: {collection_id} ({len(COUNTRY_CODES)} country codes)")
+    counts = await count_collection_codes(engine, collection_id, COUNTRY_CODES, "monty:country_codes")
+    print(f"Finished counting: {collection_id}")
+    return collection_id, Counter({iso3: count for iso3, count in counts.items() if count}), True
 
-    print("=== Starting event count by country for all collections ===\n")
-    with ThreadPoolExecutor(max_workers=len(event_collections)) as executor:
-        future_to_collection = {
-            executor.submit(fetch_country_counts, coll, 100, 10): coll
-            for coll in event_collections
-        }
-        for future in as_completed(future_to_collection):
-            coll = future_to_collection[future]
-            try:
-                coll_id, country_counter = future.result()
-                results[coll_id] = dict(country_counter)
-            except Exception as exc:
+async def count_all_collections(event_collections, checkpoint=None, events=None):
+    """
+    Runs every collection on one event loop, bounded by MAX_CONCURRENCY requests.
+    Collections the checkpoint has as done are taken from it without any requests
+    (and are not added to ``events``).
+    Returns the counts per collection and the set of collections whose counts are incomplete.
+    """
+    results = {}  # collection -> Counter
+    incomplete = set()
+    limiter = shared_limiter(rate=RATE_LIMIT) if RATE_LIMIT else None
+    async with FetchEngine(max_concurrency=MAX_CONCURRENCY, per_host=MAX_CONCURRENCY, timeout=60,
+                           parser=PAGE_PARSER, rate_limiter=limiter) as engine:
+        tasks = {}
+        if COUNTRY_CODES:
+            for coll in event_collections:
+                tasks[coll] = count_known_codes(engine, coll)
+        else:
+            pending = [coll for coll in event_collections
+                       if not (checkpoint and checkpoint.status(coll) == DONE)]
+            for coll in event_collections:
+                if coll not in pending:
+                    print(f"Already done: {coll} (from {CHECKPOINT_FILE})")
+                    results[coll] = dict(checkpoint.aggregate(coll) or {})
+            catalog = await load_catalog(engine)
+            for coll in pending:
+                # Resume over the windows of the saved scan, otherwise split the collection along
+                # its temporal extent so its pages are fetched in parallel
+                windows = checkpoint and checkpoint.windows(coll)
+                if not windows:
+                    windows = plan_windows(*temporal_extent(catalog.get(coll)), SLICES_PER_COLLECTION)
+                tasks[coll] = fetch_country_counts(engine, coll, windows, 100, None, checkpoint, events)
+        async for coll, result, exc in run_all(tasks):
+            if exc is not None:
                 error_entry = {
                     "collection": coll,
                     "reason": str(exc)
                 }
                 print(f"{coll} generated an exception: {exc}, writing error.")
                 write_error_entry(error_entry)
+                if checkpoint and checkpoint.entry(coll):
+                    checkpoint.fail(coll, exc)
+                results[coll] = {}
+                incomplete.add(coll)
+                continue
+            coll_id, country_counter, complete = result
+            results[coll_id] = dict(country_counter)
+            if not complete:
+                incomplete.add(coll_id)
+    return results, incomplete
+
+def count_from_replica(event_collections, events=None):
+    """Counts country codes per collection from the local Parquet replica (adding the rows to ``events``)."""
+    from montandon.replica import read_replica
+
+    columns = ["monty:country_codes"]
+    if events is not None:
+        columns += ["monty:hazard_codes", "monty:corr_id", "datetime", "start_datetime", "end_datetime", "bbox"]
+    df = read_replica(event_collections, columns=columns, root=REPLICA_DIR)
+    if events is not None:
+        events.add_frame(df)
+    counts = CodeCounts()
+    counts.add_columns(df["collection"], None, df["monty:country_codes"])
+    return {coll_id: counts.get(coll_id) for coll_id in counts.collection_ids()}
+
+def write_clusters(events, results):
+    """Clusters the collected events and writes CLUSTERS_FILE: distinct events per country."""
+    clusters = cluster_events(events)
+    multi_source = sum(len(cluster.collections) > 1 for cluster in clusters)
+    print(f"\n{len(events)} events from {len({key[0] for key in events.keys})} collections are "
+          f"{len(clusters)} distinct events ({multi_source} reported by more than one collection)")
+    skipped = sorted(set(results) - {key[0] for key in events.keys})
+    if skipped:
+        print(f"Not clustered (no items fetched in this run): {skipped}")
+    per_country = {}
+    for cluster in clusters:
+        for iso3 in cluster.country_codes:
+            counts = per_country.setdefault(iso3, [0, 0])
+            counts[0] += 1
+            counts[1] += len(cluster.members)
+    with open(CLUSTERS_FILE, "w", newline='', encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        # reports is the number of collection items behind the distinct events
+        writer.writerow(["iso3_country", "event_count", "reports"])
+        for iso3, (count, reports) in sorted(per_country.items()):
+            writer.writerow([iso3, count, reports])
+    print(f"Clusters saved to {CLUSTERS_FILE}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Count events by collection and country.")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"continue from {CHECKPOINT_FILE} instead of starting from scratch")
+    args = parser.parse_args()
+
+    checkpoint = CrawlCheckpoint(CHECKPOINT_FILE)
+    if not args.resume:
+        checkpoint.clear()
+        # Clear any existing error file before running; a resumed run keeps appending to it
+        if os.path.exists(ERROR_FILE):
+            os.remove(ERROR_FILE)
+
+    # Every collection with the "event" role, from the cached /collections catalog
+    event_collections = get_catalog().ids(role="event")
+
+    print("=== Starting event count by country for all collections ===\n")
+    events = EventTable() if DEDUPLICATE and (REPLICA_DIR or not COUNTRY_CODES) else None
+    if REPLICA_DIR:
+        results, incomplete = count_from_replica(event_collections, events), set()
+    else:
+        results, incomplete = asyncio.run(count_all_collections(event_collections, checkpoint, events))
 
     print("\n=== All collections processed. Results below. ===")
     for coll_id, counter in results.items():
         total = sum(counter.values())
-        print(f"\nCollection: {coll_id}")
+        print(f"\nCollection: {coll_id}" + (" (INCOMPLETE, see errors)" if coll_id in incomplete else ""))
         print(f"Total events: {total}")
         print("Country counts:")
         for iso3, count in counter.items():
@@ -112,16 +235,24 @@ def main():
     # Save results to CSV
     with open("event_counts_by_country.csv", "w", newline='', encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["collection", "iso3_country", "event_count"])
+        # complete is "no" for collections that failed part-way, so partial totals are not mistaken for final ones
+        writer.writerow(["collection", "iso3_country", "event_count", "complete"])
         for coll_id, counter in results.items():
+            complete = "no" if coll_id in incomplete else "yes"
             for iso3, count in counter.items():
-                writer.writerow([coll_id, iso3, count])
+                writer.writerow([coll_id, iso3, count, complete])
     print("Results saved to event_counts_by_country.csv")
 
+    if events is not None:
+        write_clusters(events, results)
+
     if os.path.exists(ERROR_FILE):
         print(f"Errors were encountered and immediately written to {ERROR_FILE}")
     else:
         print("No errors encountered.")
+    unfinished = [coll for coll in event_collections if checkpoint.status(coll) not in (None, DONE)]
+    if unfinished:
+        print(f"Unfinished collections {unfinished}; run again with --resume to continue them.")
 
 if __name__ == "__main__":
     main()
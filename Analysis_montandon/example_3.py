@@ -1,81 +1,99 @@
 # Get total events in usgs-events and county of events by country  
 
-import requests
 from collections import Counter
+import asyncio
 import csv
-import time
-import random
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.aggregate import CodeCounts
+from montandon.catalog import load_catalog
+from montandon.counting import count_collection_codes
+from montandon.engine import FetchEngine
+from montandon.paginator import PageFetchError
+from montandon.slicing import iter_sliced_pages, plan_windows, temporal_extent
 
 # We are focusing only on the usgs-events collection
 COLLECTION_ID = "usgs-events"
-BASE_URL = "https://montandon-eoapi-stage.ifrc.org/stac/collections"
 ERROR_FILE = "event_count_errors_usgs.json"
 OUTPUT_FILE = "event_counts_by_country_usgs.csv"
+TIME_SLICES = 8  # Datetime windows of the collection paged in parallel
+# Page decoder that keeps only the requested fields, skipping geometries the server may send anyway
+# ("auto" prefers ijson for lowest memory, "orjson" for speed at the cost of decoding whole pages,
+# "json"); None decodes pages in full
+PAGE_PARSER = "auto"
+# ISO3 codes to count from server-reported totals (one small request per code).
+# Leave empty to page through every item and count all country codes found.
+COUNTRY_CODES = []
 
 def write_error_entry(error_entry):
     """Append a single error as a JSON string to the error file."""
     with open(ERROR_FILE, "a", encoding="utf-8") as ef:
         ef.write(json.dumps(error_entry, ensure_ascii=False) + "\n")
 
-def fetch_country_counts(collection_id, page_limit=250, max_retries=5):
+async def fetch_country_counts(engine, collection_id, windows, page_limit=250, max_retries=None):
     """
-    Fetches all items from a collection, paginating through the results,
-    and counts the occurrences of each country code.
+    Fetches all items from a collection, paginating through the given datetime
+    windows in parallel, and counts the occurrences of each country code.
+    Returns ``(counts, complete)``; ``complete`` is False when a page failed
+    after all retries and the counts cover only the pages fetched before.
     """
-    country_counter = Counter()
-    # Only request the fields we actually need to reduce response size
-    url = f"{BASE_URL}/{collection_id}/items?limit={page_limit}&fields=properties.monty:country_codes"
-    
-    page_count = 0
+    counts = CodeCounts()
     total_fetched = 0
-    
-    print(f"Started processing: {collection_id}")
+    page_count = 0
+    complete = True
+
+    print(f"Started processing: {collection_id} ({len(windows)} time slices)")
 
-    # Use a session for connection pooling, which is more efficient
-    with requests.Session() as session:
-        while url:
+    try:
+        # Only request the fields we actually need to reduce response size
+        pages = iter_sliced_pages(
+            engine, collection_id, windows, limit=page_limit,
+            fields="properties.monty:country_codes", max_retries=max_retries
+        )
+        async for page in pages:
             page_count += 1
-            for attempt in range(max_retries):
-                try:
-                    response = session.get(url, timeout=90)
-                    response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-                    
-                    data = response.json()
-                    features = data.get("features", [])
-                    total_fetched += len(features)
-                    
-                    # Update the counter with country codes from the current page
-                    for feature in features:
-                        codes = feature.get("properties", {}).get("monty:country_codes", [])
-                        country_counter.update(codes)
-                        
-                    print(f"  {collection_id} - Page {page_count}: Fetched {len(features)} items (Total: {total_fetched})")
-                    
-                    # Find the URL for the next page
-                    url = next((link.get("href") for link in data.get("links", []) if link.get("rel") == "next"), None)
-                    
-                    # Successfully processed page, break the retry loop
-                    break
-                
-                except requests.exceptions.RequestException as ex:
-                    wait_time = 2 ** attempt
-                    print(f"  Error on {collection_id} page {page_count}, attempt {attempt + 1}: {ex}. Retrying in {wait_time}s.")
-                    time.sleep(wait_time)
-                    if attempt == max_retries - 1:
-                        error_entry = {
-                            "collection": collection_id,
-                            "page": page_count,
-                            "reason": f"Failed after {max_retries} attempts: {str(ex)}",
-                            "url": url
-                        }
-                        print(f"  Giving up on {collection_id} page {page_count}. Error logged.")
-                        write_error_entry(error_entry)
-                        url = None  # Stop processing this collection
-    
+            total_fetched += len(page.features)
+
+            # Count the country codes of the whole page in one vectorized step
+            counts.add_page(page.features, collection_id, "monty:country_codes")
+
+            print(f"  {collection_id} - Page {page_count}: Fetched {len(page.features)} items (Total: {total_fetched})")
+    except PageFetchError as ex:
+        error_entry = {
+            "collection": collection_id,
+            "page": ex.page,
+            "status": ex.status,
+            "reason": f"Failed after retries: {str(ex.cause)}",
+            "url": ex.url
+        }
+        print(f"  Giving up on {collection_id} page {ex.page}. Error logged; the counts below are INCOMPLETE.")
+        write_error_entry(error_entry)
+        complete = False
+
     print(f"Finished processing: {collection_id} (total events processed: {total_fetched})")
-    return country_counter
+    return Counter(counts.get(collection_id)), complete
+
+async def count_collection(collection_id):
+    """
+    Counts country codes in one collection: from server-reported totals when
+    COUNTRY_CODES is set, otherwise by paging its time slices concurrently.
+    Returns ``(counts, complete)`` like ``fetch_country_counts``.
+    """
+    async with FetchEngine(max_concurrency=TIME_SLICES, per_host=TIME_SLICES, timeout=90,
+                           parser=PAGE_PARSER) as engine:
+        if COUNTRY_CODES:
+            try:
+                counts = await count_collection_codes(engine, collection_id, COUNTRY_CODES, "monty:country_codes")
+            except PageFetchError as ex:
+                write_error_entry({"collection": collection_id, "reason": str(ex.cause), "url": ex.url})
+                return Counter(), False
+            return Counter({country: count for country, count in counts.items() if count}), True
+        catalog = await load_catalog(engine)
+        windows = plan_windows(*temporal_extent(catalog.get(collection_id)), TIME_SLICES)
+        return await fetch_country_counts(engine, collection_id, windows)
 
 def main():
     # Clear any existing error file before running
@@ -84,16 +102,19 @@ def main():
 
     print(f"=== Starting event count by country for {COLLECTION_ID} ===\n")
     
-    country_counts = fetch_country_counts(COLLECTION_ID)
+    country_counts, complete = asyncio.run(count_collection(COLLECTION_ID))
 
     # Save to CSV
     if country_counts:
         with open(OUTPUT_FILE, "w", newline='', encoding="utf-8") as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(["country_code", "event_count"])
+            # complete is "no" when the run failed part-way, so partial counts are not mistaken for totals
+            writer.writerow(["country_code", "event_count", "complete"])
             for country, count in country_counts.most_common():
-                writer.writerow([country, count])
-        print(f"\nResults saved to {OUTPUT_FILE}")
+                writer.writerow([country, count, "yes" if complete else "no"])
+        print(f"\nResults saved to {OUTPUT_FILE}" + ("" if complete else " (INCOMPLETE, see errors)"))
+    elif not complete:
+        print(f"\nCounting failed before any data was processed; see {ERROR_FILE}.")
     else:
         print("\nNo data was processed.")
 
@@ -1,180 +1,141 @@
 ### code to find the oldest event in every collection 
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
-import time
-import random
+import asyncio
 import csv
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.cache import PageCache
+from montandon.catalog import get_catalog
+from montandon.engine import FetchEngine, run_all
+from montandon.extremes import find_extreme
+from montandon.paginator import PageFetchError
 
-event_collections = [
-    "ifrcevent-events", "pdc-events", "desinventar-events", "emdat-events",
-    "gdacs-events", "gfd-events", "glide-events", "ibtracs-events",
-    "idmc-gidd-events", "idmc-idu-events", "reference-events", "usgs-events"
-]
-BASE_URL = "https://montandon-eoapi-stage.ifrc.org/stac/collections"
 ERROR_FILE = "oldest_events_errors.json"
+MAX_CONCURRENCY = 12  # Requests in flight at once, shared by all collections
+USE_CACHE = True  # Serve repeat runs from the on-disk page cache
+# Which datetimes count as valid is set per collection in montandon.validation.DATETIME_RULES
+# Directory of a local replica (python -m montandon.replica sync); when set, the oldest
+# events are picked from the Parquet files instead of the API.
+REPLICA_DIR = None
 
 def write_error_entry(error_entry):
     with open(ERROR_FILE, "a", encoding="utf-8") as ef:
         ef.write(json.dumps(error_entry, ensure_ascii=False) + "\n")
 
-def is_valid_datetime(dt_str, collection_id=None):
-    """
-    Validates if a datetime string represents a realistic date.
-    Returns True if the date is valid and reasonable, False otherwise.
-    Different validation rules for different collections.
+async def fetch_oldest_event(engine, collection_id, max_retries=None):
     """
-    if not dt_str:
-        return False
-    
-    # For desinventar-events: year > 1100 and day != 1
-    if collection_id == "desinventar-events":
-        try:
-            # Parse the datetime
-            dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-            
-            # Check if the year is reasonable (above 1100 and up to current year + 1)
-            current_year = datetime.now().year
-            if dt.year <= 1100 or dt.year > current_year + 1:
-                return False
-            
-            # Check if month is valid (1-12)
-            if dt.month < 1 or dt.month > 12:
-                return False
-            
-            # Check if day is valid for the given month/year
-            import calendar
-            max_days = calendar.monthrange(dt.year, dt.month)[1]
-            if dt.day < 1 or dt.day > max_days:
-                return False
-            
-            # Additional constraint: day should not be 01
-            if dt.day == 1:
-                return False
-            
-            return True
-            
-        except (ValueError, Exception):
-            return False
-    
-    # For all other collections: just basic validation (year > 100)
-    else:
-        try:
-            dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
-            current_year = datetime.now().year
-            # Basic check: year should be reasonable (above 100)
-            if dt.year <= 100 or dt.year > current_year + 1:
-                return False
-            return True
-        except (ValueError, Exception):
-            return False
-
-def fetch_oldest_event(collection_id, page_limit=10, max_retries=5):
+    Finds the oldest event of a collection with a valid datetime using
+    limit=1 probes (see ``montandon.extremes``) instead of walking pages.
+    Returns ``(collection_id, event or None, error or None)``; transient
+    failures are retried under the engine's shared retry policy first.
     """
-    Fetches the oldest event from a collection with a valid datetime.
-    """
-    # Use `sortby` to ask the API to return items in ascending chronological order.
-    url = f"{BASE_URL}/{collection_id}/items?limit={page_limit}&sortby=%2Bdatetime"
-    
     print(f"Searching for the oldest valid event in: {collection_id}")
 
-    page_count = 0
-    while url:
-        page_count += 1
-        print(f"  -> Fetching page {page_count} for {collection_id}...")
-        
-        try:
-            # Use a session for connection pooling and better performance
-            with requests.Session() as session:
-                response = session.get(url, timeout=60)
-                response.raise_for_status()  # Raises an HTTPError for bad responses
-
-            data = response.json()
-            features = data.get("features", [])
-
-            if not features and page_count == 1:
-                print(f"  -> No events found for {collection_id}")
-                return collection_id, None
-
-            # Iterate through the sorted features to find the first valid one
-            for feature in features:
-                props = feature.get("properties", {})
-                dt_str = props.get("datetime")
-                
-                # Check if the datetime is valid and reasonable
-                if not is_valid_datetime(dt_str, collection_id):
-                    print(f"  -> Skipping event {feature.get('id')} with invalid date: {dt_str}")
-                    continue
-
-                # The first valid event is the one we want
-                oldest_event = {
-                    "collection": collection_id,
-                    "event_id": feature.get("id"),
-                    "datetime": dt_str,
-                    "title": props.get("title", ""),
-                    "description": props.get("description", "")
-                }
-                print(f"  -> Success for {collection_id}: Found oldest valid event from {dt_str}")
-                return collection_id, oldest_event
-
-            # If we've gone through the whole page and all were invalid, get the next page URL
-            url = next((l.get("href") for l in data.get("links", []) if l.get("rel") == "next"), None)
-
-        except requests.exceptions.HTTPError as ex:
-            if ex.response.status_code == 500:
-                print(f"!! 500 Server Error on {collection_id}. Giving up.")
-                write_error_entry({"collection": collection_id, "reason": "500 Server Error", "url": url})
-                return collection_id, None # Give up on this collection
-            
-            # For other HTTP errors, we can just stop processing this collection
-            print(f"  HTTP Error on {collection_id} (HTTP {ex.response.status_code}). Stopping search for this collection.")
-            write_error_entry({"collection": collection_id, "reason": f"HTTP {ex.response.status_code}", "url": url})
-            return collection_id, None
-
-        except Exception as ex:
-            # General exception, retry logic might be useful here for network issues
-            print(f"  An unexpected error occurred on {collection_id}: {ex}. Stopping search.")
-            write_error_entry({"collection": collection_id, "reason": str(ex), "url": url})
-            return collection_id, None
-
-    # If the loop finishes, it means no valid events were found
-    print(f"  -> No valid events found for {collection_id} after checking all pages.")
-    return collection_id, None
-
-def main():
+    try:
+        feature, requests = await find_extreme(engine, collection_id, oldest=True, max_retries=max_retries)
+        if feature is not None:
+            props = feature.get("properties", {})
+            dt_str = props.get("datetime")
+            oldest_event = {
+                "collection": collection_id,
+                "event_id": feature.get("id"),
+                "datetime": dt_str,
+                "title": props.get("title", ""),
+                "description": props.get("description", "")
+            }
+            print(f"  -> Success for {collection_id}: Found oldest valid event from {dt_str} ({requests} requests)")
+            return collection_id, oldest_event, None
+
+    except PageFetchError as ex:
+        if ex.status is not None:
+            # Retries are used up (or the status is not worth retrying); stop processing this collection
+            reason = f"HTTP {ex.status}"
+            print(f"  HTTP Error on {collection_id} (HTTP {ex.status}). Stopping search for this collection.")
+        else:
+            # Network or decode errors that persisted through every retry, or an open circuit
+            reason = str(ex.cause)
+            print(f"  An unexpected error occurred on {collection_id}: {ex.cause}. Stopping search.")
+        write_error_entry({"collection": collection_id, "reason": reason, "url": ex.url})
+        return collection_id, None, reason
+
+    print(f"  -> No valid events found for {collection_id} ({requests} requests).")
+    return collection_id, None, None
+
+async def find_all_oldest_events(event_collections):
+    """Searches every collection concurrently on one event loop."""
     results = {}   # collection -> event dict
+    errors = {}    # collection -> reason it failed
+    cache = PageCache() if USE_CACHE else None
+    async with FetchEngine(max_concurrency=MAX_CONCURRENCY, per_host=MAX_CONCURRENCY, timeout=60, cache=cache) as engine:
+        tasks = {coll: fetch_oldest_event(engine, coll) for coll in event_collections}
+        async for coll, result, exc in run_all(tasks):
+            if exc is not None:
+                error_entry = {"collection": coll, "reason": str(exc)}
+                print(f"{coll} generated an exception: {exc}, writing error.")
+                write_error_entry(error_entry)
+                errors[coll] = str(exc)
+                continue
+            coll_id, oldest_event, error = result
+            results[coll_id] = oldest_event
+            if error:
+                errors[coll_id] = error
+    if cache:
+        print(f"Page cache: {cache.stats()}")
+    return results, errors
+
+def find_oldest_from_replica(event_collections):
+    """Picks the oldest valid event of each collection from the local Parquet replica."""
+    from montandon.replica import read_replica
+    from montandon.validation import parse_datetime_column, valid_datetime_mask
+
+    df = read_replica(event_collections, columns=["datetime", "title", "properties"], root=REPLICA_DIR)
+    results = {}
+    for coll_id, group in df.groupby("collection"):
+        # Whole columns are validated and parsed in NumPy rather than row by row
+        valid_rows = valid_datetime_mask(group["datetime"], coll_id).nonzero()[0]
+        if not len(valid_rows):
+            continue
+        times = parse_datetime_column(group["datetime"].to_numpy()[valid_rows])
+        row = group.iloc[valid_rows[times.argmin()]]
+        props = json.loads(row["properties"] or "{}")
+        results[coll_id] = {
+            "collection": coll_id,
+            "event_id": row["id"],
+            "datetime": row["datetime"],
+            "title": row["title"] or "",
+            "description": props.get("description", "")
+        }
+    return results, {}
 
+def main():
     # Clear previous error file
     if os.path.exists(ERROR_FILE):
         os.remove(ERROR_FILE)
 
+    # Every collection with the "event" role, from the cached /collections catalog
+    event_collections = get_catalog().ids(role="event")
+
     print("=== Starting oldest event search for all collections ===\n")
-    with ThreadPoolExecutor(max_workers=len(event_collections)) as executor:
-        future_to_collection = {
-            executor.submit(fetch_oldest_event, coll): coll
-            for coll in event_collections
-        }
-        for future in as_completed(future_to_collection):
-            coll = future_to_collection[future]
-            try:
-                coll_id, oldest_event = future.result()
-                results[coll_id] = oldest_event
-            except Exception as exc:
-                error_entry = {"collection": coll, "reason": str(exc)}
-                print(f"{coll} generated an exception: {exc}, writing error.")
-                write_error_entry(error_entry)
+    if REPLICA_DIR:
+        results, errors = find_oldest_from_replica(event_collections)
+    else:
+        results, errors = asyncio.run(find_all_oldest_events(event_collections))
 
-    # Save to CSV
+    # Save to CSV; the status column tells a failed search apart from a collection without valid events
     with open("oldest_events_by_collection.csv", "w", newline='', encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["collection", "event_id", "datetime", "title", "description"])
-        for coll_id, event in results.items():
+        writer.writerow(["collection", "event_id", "datetime", "title", "description", "status"])
+        for coll_id in event_collections:
+            event = results.get(coll_id)
             if event:
-                writer.writerow([coll_id, event["event_id"], event["datetime"], event["title"], event["description"]])
+                writer.writerow([coll_id, event["event_id"], event["datetime"], event["title"], event["description"],
+                                 "found"])
+            elif coll_id in errors:
+                writer.writerow([coll_id, "", "", "", "", f"failed: {errors[coll_id]}"])
             else:
-                writer.writerow([coll_id, "", "", "", ""])
+                writer.writerow([coll_id, "", "", "", "", "not found"])
 
     print("Results saved to oldest_events_by_collection.csv")
     if os.path.exists(ERROR_FILE):
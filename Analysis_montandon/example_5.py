@@ -1,45 +1,54 @@
-import requests
+import os
+import sys
+import asyncio
 import pandas as pd
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 from datetime import datetime
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.aggregate import CodeCounts
+from montandon.binning import refine_bins
+from montandon.catalog import load_catalog
+from montandon.counting import count_collection_codes
+from montandon.cache import PageCache
+from montandon.engine import FetchEngine, run_all
+from montandon.paginator import PageFetchError
+from montandon.pruning import CODE_SUMMARIES, QueryPruner
+from montandon.ratelimit import shared_limiter
+from montandon.slicing import item_datetime, parse_datetime
+
 # --- Configuration ---
-BASE_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
 OUTPUT_FILE = "hazard_counts_by_year_and_type.xlsx" # Changed to .xlsx
 START_YEAR = 1800
 INTERVAL_YEARS = 50
-MAX_WORKERS = 10 # Number of parallel requests
+MAX_WORKERS = 10 # Number of requests in flight at once; all bins are scheduled as async tasks
+# Starting requests/second; adapts to server health and is shared with other scripts running at
+# the same time. None sends as fast as MAX_WORKERS allows.
+RATE_LIMIT = 8
+USE_CACHE = True # Serve repeat runs from the on-disk page cache (closed historical bins never expire)
+ADAPTIVE_BINS = True # Split dense bins (by probed item count) into balanced sub-bins and skip empty ones
+TARGET_BIN_SIZE = 2500 # Approximate number of items per task when ADAPTIVE_BINS is on
+# Hazard codes to count from server-reported totals (one small request per collection/period/code).
+# Leave empty to page through every item and count all hazard codes found.
+HAZARD_CODES = []
+# Trust the catalog's monty:hazard_codes summaries to skip collections and codes they do not list.
+# Summaries are often stale or samples, so this can silently zero real counts; off by default.
+PRUNE_BY_SUMMARIES = False
+# Directory of a local replica (python -m montandon.replica sync); when set, counts come from
+# the Parquet files instead of the API.
+REPLICA_DIR = None
 
-def get_hazard_collections(session):
-    """Retrieves a list of all collection IDs that have '-events' in their name."""
-    print("Fetching list of all collections...")
-    url = f"{BASE_URL}/collections"
+async def get_hazard_collections(engine):
+    """Returns the cached /collections catalog and the ids of all event collections in it."""
+    print("Loading the collection catalog...")
     try:
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Filter for collections that have hazard codes in their summaries
-        hazard_collections = []
-        for collection in data.get("collections", []):
-            coll_id = collection.get("id", "unknown")
-            summaries = collection.get("summaries", {})
-            hazard_codes = summaries.get("monty:hazard_codes")
-            
-            print(f"  Checking collection '{coll_id}'")
-            if "-events" in coll_id:
-                hazard_collections.append(coll_id)
-                print(f"    ✓ Has '-events' in name - Added")
-            else:
-                print(f"    ✗ No '-events' in name")
-        
-        print(f"\nFound {len(hazard_collections)} collections with hazard data: {hazard_collections}\n")
-        return hazard_collections
-    except requests.exceptions.RequestException as e:
-        print(f"FATAL: Could not fetch the list of collections. {e}")
-        return []
+        catalog = await load_catalog(engine)
+    except PageFetchError as e:
+        print(f"FATAL: Could not fetch the list of collections. {e.cause}")
+        return None, []
+    hazard_collections = catalog.ids(role="event")
+    print(f"\nFound {len(hazard_collections)} collections with hazard data: {hazard_collections}\n")
+    return catalog, hazard_collections
 
 def generate_time_bins(start_year, interval):
     """Generates 50-year time bins from the start year to today."""
@@ -65,129 +74,195 @@ def generate_time_bins(start_year, interval):
         current_year += interval
     return bins
 
-def fetch_counts_for_bin(session, collection_id, time_bin):
+async def fetch_counts_for_bin(engine, collection_id, time_bin):
     """
     Fetches all items for a specific collection and time bin, and counts
-    the occurrences of each hazard code.
+    the occurrences of each hazard code into a CodeCounts of its own.
+    A page that still fails after the engine's retries raises PageFetchError,
+    so the bin is reported as failed instead of counting as zero.
     """
     bin_label = time_bin['label']
     datetime_range = f"{time_bin['start_datetime']}/{time_bin['end_datetime']}"
+    # Refined sub-bins only count items starting inside them (see montandon.binning)
+    count_from = parse_datetime(time_bin.get('count_from'))
     
-    print(f"  -> Starting: {collection_id} for period {bin_label}")
-    
-    hazard_counter = Counter()
-    url = (
-        f"{BASE_URL}/collections/{collection_id}/items"
-        f"?limit=250&datetime={datetime_range}&fields=properties.monty:hazard_codes"
-    )
+    print(f"  -> Starting: {collection_id} for period {bin_label} ({datetime_range})")
     
+    counts = CodeCounts()
     items_fetched = 0
-    while url:
-        try:
-            response = session.get(url, timeout=90)
-            response.raise_for_status()
-            data = response.json()
-            
-            features = data.get("features", [])
-            if not features and items_fetched == 0:
-                # No items found in this bin for this collection, exit early
-                print(f"  -> Completed: {collection_id} for {bin_label} (0 items)")
-                return collection_id, bin_label, Counter()
-
-            items_fetched += len(features)
-
-            for feature in features:
-                codes = feature.get("properties", {}).get("monty:hazard_codes", [])
-                hazard_counter.update(codes)
-            
-            url = next((link.get("href") for link in data.get("links", []) if link.get("rel") == "next"), None)
-
-        except requests.exceptions.RequestException as e:
-            print(f"  -> ERROR on {collection_id} for {bin_label}: {e}")
-            # Return an empty counter on error to avoid partial results
-            return collection_id, bin_label, Counter()
+    pages = engine.iter_pages(
+        collection_id, limit=250, datetime=datetime_range,
+        fields="properties.monty:hazard_codes,properties.datetime,properties.start_datetime"
+    )
+    async for page in pages:
+        if not page.features and items_fetched == 0:
+            # No items found in this bin for this collection, exit early
+            print(f"  -> Completed: {collection_id} for {bin_label} (0 items)")
+            return counts
+
+        items_fetched += len(page.features)
+
+        features = page.features
+        if count_from is not None:
+            features = [f for f in features
+                        if (dt := item_datetime(f)) is None or dt >= count_from]
+        counts.add_page(features, collection_id, "monty:hazard_codes", period=bin_label)
 
     print(f"  -> Completed: {collection_id} for {bin_label} ({items_fetched} items processed)")
-    return collection_id, bin_label, hazard_counter
+    return counts
 
-def main():
+async def count_codes_for_bin(engine, collection_id, time_bin, codes):
+    """Counts the hazard codes in one collection and time bin without downloading the items."""
+    bin_label = time_bin['label']
+    datetime_range = f"{time_bin['start_datetime']}/{time_bin['end_datetime']}"
+    counts = await count_collection_codes(engine, collection_id, codes, "monty:hazard_codes",
+                                          datetime=datetime_range)
+    print(f"  -> Counted: {collection_id} for {bin_label}")
+    result = CodeCounts()
+    result.add_counts(collection_id, bin_label, counts)
+    return result
+
+async def collect_results():
     """
-    Main function to orchestrate fetching counts for all hazard collections
-    across all time bins and saving the results.
+    Schedules every (collection, time bin) task on one event loop. The engine
+    keeps at most MAX_WORKERS requests in flight over a shared connection pool.
+    Returns a CodeCounts indexed by (collection, time period, hazard code)
+    and the list of (collection, time bin) tasks that failed.
     """
-    with requests.Session() as session:
-        hazard_collections = get_hazard_collections(session)
+    all_counts = CodeCounts()
+    failures = []
+    cache = PageCache() if USE_CACHE else None
+    limiter = shared_limiter(rate=RATE_LIMIT) if RATE_LIMIT else None
+    async with FetchEngine(max_concurrency=MAX_WORKERS, per_host=MAX_WORKERS, timeout=90, cache=cache,
+                           rate_limiter=limiter) as engine:
+        catalog, hazard_collections = await get_hazard_collections(engine)
         if not hazard_collections:
-            return
-            
+            return all_counts, failures
+
         time_bins = generate_time_bins(START_YEAR, INTERVAL_YEARS)
         print(f"Generated {len(time_bins)} time bins to process.\n")
 
-        # Create a list of all tasks to run
-        tasks = []
-        for collection_id in hazard_collections:
-            for bin_info in time_bins:
-                tasks.append((collection_id, bin_info))
-
-        all_results = []
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_task = {
-                executor.submit(fetch_counts_for_bin, session, coll_id, t_bin): (coll_id, t_bin['label'])
-                for coll_id, t_bin in tasks
-            }
-
-            for future in as_completed(future_to_task):
-                try:
-                    collection_id, bin_label, counts = future.result()
-                    if counts:
-                        for hazard_code, count in counts.items():
-                            all_results.append({
-                                "collection": collection_id,
-                                "time_period": bin_label,
-                                "hazard_code": hazard_code,
-                                "event_count": count
-                            })
-                except Exception as exc:
-                    task_id = future_to_task[future]
-                    print(f"A task {task_id} generated an exception: {exc}")
-
-    if not all_results:
+        # Drop the bins the catalog proves empty (outside the temporal extent, or with
+        # PRUNE_BY_SUMMARIES none of HAZARD_CODES in the hazard code summary) before any
+        # request, count probes included
+        pruner = QueryPruner(catalog, CODE_SUMMARIES if PRUNE_BY_SUMMARIES else None)
+        query_codes = {"hazard_codes": HAZARD_CODES} if HAZARD_CODES else {}
+        bins_per_collection = {
+            collection_id: [bin_info for bin_info in time_bins
+                            if pruner.check(collection_id, **query_codes,
+                                            datetime=f"{bin_info['start_datetime']}/{bin_info['end_datetime']}")]
+            for collection_id in hazard_collections
+        }
+        print(f"{pruner.report()}\n")
+        codes_per_collection = {collection_id: pruner.matching_codes(collection_id, "hazard_codes", HAZARD_CODES)
+                                for collection_id in hazard_collections}
+
+        if ADAPTIVE_BINS and not HAZARD_CODES:
+            # Probe counts and split dense bins so every task is about TARGET_BIN_SIZE items
+            refined = await asyncio.gather(*(
+                refine_bins(engine, collection_id, bins_per_collection[collection_id], TARGET_BIN_SIZE)
+                for collection_id in hazard_collections
+            ))
+            bins_per_collection = dict(zip(hazard_collections, refined))
+            total = sum(len(bins) for bins in refined)
+            print(f"Adaptive binning produced {total} non-empty tasks "
+                  f"(fixed bins would be {len(time_bins) * len(hazard_collections)}).\n")
+
+        # Create all tasks up front; no worker threads are needed
+        tasks = {}
+        bins_by_task = {}
+        for collection_id, bins in bins_per_collection.items():
+            for bin_info in bins:
+                task_id = (collection_id, bin_info['label'], bin_info['start_datetime'])
+                bins_by_task[task_id] = bin_info
+                if HAZARD_CODES:
+                    tasks[task_id] = count_codes_for_bin(engine, collection_id, bin_info,
+                                                         codes_per_collection[collection_id])
+                else:
+                    tasks[task_id] = fetch_counts_for_bin(engine, collection_id, bin_info)
+
+        async for task_id, result, exc in run_all(tasks):
+            if exc is not None:
+                # Keep failed bins out of the totals but list them, so the workbook shows what is missing
+                collection_id, bin_label, _ = task_id
+                reason = str(exc.cause) if isinstance(exc, PageFetchError) else str(exc)
+                print(f"  -> ERROR on {collection_id} for {bin_label}: {reason}")
+                failures.append({
+                    "collection": collection_id,
+                    "time_period": bin_label,
+                    "start_datetime": bins_by_task[task_id]['start_datetime'],
+                    "end_datetime": bins_by_task[task_id]['end_datetime'],
+                    "error": reason
+                })
+                continue
+            # Sub-bins of one period share its label, so their counts add up in the same cells
+            all_counts.merge(result)
+    if cache:
+        print(f"Page cache: {cache.stats()}")
+    print(f"Retry policy: {engine.retry_policy.stats()}")
+    if limiter:
+        print(f"Request rate settled at {limiter.rate:.1f}/s")
+    return all_counts, failures
+
+def collect_results_from_replica():
+    """
+    Counts hazard codes per collection and time bin from the local Parquet
+    replica. Items are binned by the year of their datetime (or start_datetime).
+    """
+    from montandon.replica import read_replica
+
+    df = read_replica(columns=["monty:hazard_codes", "year"], root=REPLICA_DIR)
+    df = df[df['collection'].str.contains("-events")]
+    year_to_label = {}
+    for time_bin in generate_time_bins(START_YEAR, INTERVAL_YEARS):
+        first_year, last_year = (int(y) for y in time_bin['label'].split("-"))
+        for year in range(first_year, last_year + 1):
+            year_to_label[year] = time_bin['label']
+    # Rows outside every bin get a null period and are skipped by add_columns
+    counts = CodeCounts()
+    counts.add_columns(df['collection'], df['year'].map(year_to_label), df['monty:hazard_codes'])
+    return counts, []
+
+def main():
+    """
+    Main function to orchestrate fetching counts for all hazard collections
+    across all time bins and saving the results.
+    """
+    if REPLICA_DIR:
+        all_counts, failures = collect_results_from_replica()
+    else:
+        all_counts, failures = asyncio.run(collect_results())
+
+    collections = all_counts.collection_ids()
+    if not collections and not failures:
         print("\nNo hazard data was found for any collection in the specified time periods.")
         return
 
-    # Convert the raw results into a DataFrame
-    df_long = pd.DataFrame(all_results)
-    
-    # Get a sorted list of unique time periods to ensure correct column order
-    time_period_order = sorted(df_long['time_period'].unique())
+    # Sorted list of time periods to ensure correct column order
+    time_period_order = sorted(all_counts.period_labels())
 
     print(f"\n\nProcessing complete. Writing data to Excel file: {OUTPUT_FILE}")
 
     # Use ExcelWriter to save multiple sheets to one file
     with pd.ExcelWriter(OUTPUT_FILE, engine='openpyxl') as writer:
-        # Get unique collection names
-        collections = df_long['collection'].unique()
-        
         for collection in collections:
             print(f"  -> Creating sheet for {collection}")
-            # Filter data for the current collection
-            df_collection = df_long[df_long['collection'] == collection]
-            
-            # Pivot the table to get the desired wide format
-            df_pivot = df_collection.pivot_table(
-                index='hazard_code',
-                columns='time_period',
-                values='event_count',
-                fill_value=0  # Use 0 for missing hazard/time period combinations
-            )
-            
-            # Ensure all time periods are present as columns in the correct order
-            df_pivot = df_pivot.reindex(columns=time_period_order, fill_value=0)
-            
+            # The hazard_code x time_period table comes straight from the count array;
+            # periods without items are filled with 0
+            df_pivot = all_counts.pivot(collection, periods=time_period_order)
+            df_pivot.index.name = 'hazard_code'
+
             # Write the pivoted DataFrame to a sheet named after the collection
             df_pivot.to_excel(writer, sheet_name=collection)
 
+        if failures:
+            # Periods listed here are missing some items in the sheets above
+            pd.DataFrame(failures).to_excel(writer, sheet_name="failed_bins", index=False)
+
     print(f"\nSuccessfully created Excel file with {len(collections)} sheets.")
+    if failures:
+        print(f"WARNING: {len(failures)} collection/time bin tasks failed; their counts are missing. "
+              f"See the 'failed_bins' sheet.")
 
 
 if __name__ == "__main__":
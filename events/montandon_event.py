@@ -54,6 +54,12 @@
 from pystac_client import Client
 from datetime import datetime
 import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.catalog import get_catalog
+from montandon.linking import LinkIndex, fetch_related
 
 
 STAC_API_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
@@ -69,6 +75,7 @@ collections_config = {
     "usgs-events": ("2024-06-01", "2024-06-10")
 }
 
+all_events = []
 for collection_id, (start, end) in collections_config.items():
     print(f"Fetching {collection_id}...")
     
@@ -86,4 +93,33 @@ for collection_id, (start, end) in collections_config.items():
         if "event" in item.properties.get("roles", [])
     ]
     
-    print(f"  Found {len(events)} event items")
\ No newline at end of file
+    print(f"  Found {len(events)} event items")
+    all_events.extend(events)
+
+# Join each event to its hazards and impacts. The correlation ids of all events go to one
+# /search over the hazard and impact collections, a batch at a time, instead of one lookup
+# per event; the matches are joined locally by monty:corr_id and related links.
+catalog = get_catalog()
+related_collections = catalog.ids(role="hazard") + catalog.ids(role="impact")
+index = LinkIndex()
+requests_sent, failed = fetch_related(index, all_events, related_collections)
+bundles = index.bundles(all_events)
+print(f"Linked {len(all_events)} events to {len(index) - len(all_events)} related items "
+      f"with {requests_sent} requests")
+if failed:
+    print(f"{len(failed)} batches could not be fetched; the bundles of their events may be incomplete")
+
+summary = [
+    {
+        "collection": b.event.get("collection"),
+        "id": b.event["id"],
+        "corr_id": b.event["properties"].get("monty:corr_id"),
+        "hazards": [f"{h.get('collection')}/{h['id']}" for h in b.hazards],
+        "impacts": [f"{i.get('collection')}/{i['id']}" for i in b.impacts],
+    }
+    for b in bundles
+]
+with open("event_bundles.json", "w", encoding="utf-8") as f:
+    json.dump(summary, f, indent=2)
+with_impacts = sum(1 for b in bundles if b.impacts)
+print(f"{with_impacts} of {len(bundles)} events have impacts; saved event_bundles.json")
\ No newline at end of file
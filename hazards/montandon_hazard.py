@@ -1,18 +1,22 @@
 
 
-import requests
 import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.filters import FilterError, build_filter
+from montandon.hazards import HazardMatcher
+from montandon.maplayers import build_layers, save_map
+from montandon.paginator import PageFetchError, iter_pages
+from montandon.spatial import SpatialIndex
 
 flood_collections = ["glide-hazards", "gdacs-hazards"]
 earthquake_collections = ["usgs-hazards"]
 
-# All Montandon flood hazard codes
-flood_hazard_codes = [
-    "nat-hyd-flo-riv", "nat-hyd-flo-coa", "nat-hyd-flo-flo",
-    "nat-hyd-flo-ice", "nat-cli-glo-glo", "tec-mis-col-col", "nat-hyd-flo-fla"
-]
-# All earthquake hazard codes
-earthquake_hazard_codes = ["nat-geo-ear-gro"]
+# Hazard codes of each category, from the taxonomy in montandon.hazards
+floods_matcher = HazardMatcher("flood")
+earthquakes_matcher = HazardMatcher("earthquake")
 
 # 1 year for floods
 flood_start = "2024-01-01T00:00:00Z"
@@ -21,47 +25,64 @@ flood_end = "2024-12-31T23:59:59Z"
 eq_start = "2024-06-01T00:00:00Z"
 eq_end = "2024-08-07T23:59:59Z"
 
-def fetch_all_hazards(collection, start_date, end_date):
-    hazards = []
-    url = (
-        f"https://montandon-eoapi-stage.ifrc.org/stac/collections/{collection}/items"
-        f"?limit=200&datetime={start_date}/{end_date}"
-    )
+EUROPE_POLYGON = {
+    "type": "Polygon",
+    "coordinates": [[
+        [-31.266, 34.5], [39.869, 34.5],
+        [39.869, 71.185], [-31.266, 71.185],
+        [-31.266, 34.5]
+    ]]
+}
+
+def fetch_all_hazards(collection, start_date, end_date, matcher, send_filter=True):
+    """
+    Yields hazard-role items with one of the matcher's codes, page by page
+    instead of collecting the whole year first. With ``send_filter`` False
+    the codes are only matched locally.
+    """
     #headers = {"Authorization": f"Bearer {token}"}
-    while url:
-        resp = requests.get(url) # headers=headers)
-        if resp.status_code != 200:
-            print(f"Error {resp.status_code} on {collection}: {resp.text}")
-            break
-        data = resp.json()
-        features = data.get("features", [])
-        hazards.extend(
-            [f for f in features if "hazard" in f.get("properties", {}).get("roles", [])]
-        )
-        url = next((l.get("href") for l in data.get("links", []) if l.get("rel") == "next"), None)
-    return hazards
+    # The codes go to the server as an a_overlaps filter, so only the wanted items are
+    # downloaded; if the server cannot run it (locally known, or rejected with a 4xx on the
+    # first page), the whole collection is paged instead and matched here
+    server_filter = None
+    if send_filter:
+        try:
+            compiled = build_filter(matcher.filter(), collection)
+            server_filter = compiled.filter
+            for note in compiled.notes:
+                print(f"  Filter: {note}")
+        except FilterError as ex:
+            print(f"  Filter: {ex}; filtering locally")
+    pages = 0
+    try:
+        for page in iter_pages(collection, limit=200, datetime=f"{start_date}/{end_date}", filter=server_filter):
+            pages += 1
+            for f in page.features:
+                if "hazard" in f.get("properties", {}).get("roles", []) and matcher.matches(f):
+                    yield f
+    except PageFetchError as ex:
+        if server_filter is None or pages or ex.status is None or not 400 <= ex.status < 500:
+            print(f"Error {ex.status} on {collection}: {ex.cause}")
+            return
+        print(f"  Filter rejected by the server (HTTP {ex.status}); filtering locally")
+        yield from fetch_all_hazards(collection, start_date, end_date, matcher, send_filter=False)
 
 # --- Floods: 1 year ---
 all_floods = []
+# Footprints of the floods, indexed as they arrive, for the geo queries below
+flood_index = SpatialIndex()
 for coll in flood_collections:
     print(f"Fetching floods from {coll}...")
-    items = fetch_all_hazards(coll, flood_start, flood_end)
-    floods = [
-        f for f in items
-        if any(code in flood_hazard_codes for code in f.get("properties", {}).get("monty:hazard_codes", []))
-    ]
+    floods = list(fetch_all_hazards(coll, flood_start, flood_end, floods_matcher))
     print(f"  Found {len(floods)} flood hazard items in {coll}")
     all_floods.extend(floods)
+    flood_index.add(floods, collection_id=coll)
 
 # --- Earthquakes: 1 week ---
 all_eqs = []
 for coll in earthquake_collections:
     print(f"Fetching earthquakes from {coll}...")
-    items = fetch_all_hazards(coll, eq_start, eq_end)
-    eqs = [
-        f for f in items
-        if any(code in earthquake_hazard_codes for code in f.get("properties", {}).get("monty:hazard_codes", []))
-    ]
+    eqs = list(fetch_all_hazards(coll, eq_start, eq_end, earthquakes_matcher))
     print(f"  Found {len(eqs)} earthquake hazard items in {coll}")
     all_eqs.extend(eqs)
 
@@ -71,6 +92,10 @@ with open("all_flood_hazards.json", "w", encoding="utf-8") as f:
 with open("all_earthquake_hazards.json", "w", encoding="utf-8") as f:
     json.dump(all_eqs, f, indent=2)
 
+# Year-long flood map: footprints simplified per zoom level and loaded by zoom,
+# instead of every raw coordinate embedded in the HTML
+save_map(build_layers(all_floods, properties=["title", "datetime"]), "flood_map.html", tooltip="title")
+
 # Print all unique country and hazard codes found (for inspection)
 def print_unique(items, label):
     countries = set()
@@ -83,3 +108,7 @@ def print_unique(items, label):
 
 print_unique(all_floods, "Floods")
 print_unique(all_eqs, "Earthquakes")
+
+# Geo queries answered from the index, without another request
+print(f"Floods intersecting Europe: {flood_index.count(EUROPE_POLYGON)}")
+print(f"Floods at Rome (12.5, 41.9): {flood_index.query_point(12.5, 41.9)}")
@@ -0,0 +1,19 @@
+"""
+Shared helpers for fetching data from the Montandon STAC API.
+
+The example scripts in this repository import from here instead of each
+re-implementing pagination and session handling. Scripts living in
+sub-folders add the repository root to ``sys.path`` before importing.
+"""
+
+from montandon.paginator import (
+    STAC_API_URL,
+    Page,
+    PageFetchError,
+    build_params,
+    get_session,
+    items_url,
+    iter_features,
+    iter_pages,
+    next_link,
+)
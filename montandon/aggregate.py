@@ -0,0 +1,210 @@
+"""
+Vectorized code counting for Montandon items.
+
+Counting ``monty:country_codes`` / ``monty:hazard_codes`` one feature at a time
+with ``Counter.update`` and then pivoting a list of dicts in pandas is the CPU
+bottleneck at replica scale. ``CodeCounts`` keeps the counts in a single NumPy
+array indexed by (collection, period, code), with each axis backed by a growing
+categorical vocabulary, and builds the final pivot tables straight from it.
+
+Features:
+- ``add_page``: counts one API page; the list-valued property is flattened once
+  and counted with ``np.unique`` instead of per-item dict updates.
+- ``add_columns``: counts whole columns (e.g. a replica read with pyarrow);
+  list columns are exploded with ``list_parent_indices`` and counted with one
+  ``np.bincount``.
+- ``pivot`` / ``to_frame`` / ``totals`` for reports.
+
+Requires:
+    - numpy (pip install numpy)
+    - pandas (pip install pandas), for ``pivot`` and ``to_frame``
+    - pyarrow (pip install pyarrow), for ``add_columns``
+"""
+
+from itertools import chain
+
+import numpy as np
+
+DEFAULT_PERIOD = "all"
+
+
+class Vocabulary:
+    """Maps category strings to dense integer codes in first-seen order."""
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes(self, uniques):
+        """Vocabulary codes for an iterable of distinct values, as an int64 array."""
+        return np.fromiter((self.code(str(v)) for v in uniques), dtype=np.int64)
+
+
+class CodeCounts:
+    """
+    Counts of codes per (collection, period), stored as a dense int64 array.
+
+    The single event loop used by the async scripts makes it safe to share
+    one instance across all tasks.
+    """
+
+    def __init__(self):
+        self.collections = Vocabulary()
+        self.periods = Vocabulary()
+        self.codes = Vocabulary()
+        self.counts = np.zeros((0, 0, 0), dtype=np.int64)
+
+    def _fit(self):
+        """Grows the count array to match the vocabularies."""
+        shape = (len(self.collections), len(self.periods), len(self.codes))
+        if shape != self.counts.shape:
+            pad = [(0, new - old) for new, old in zip(shape, self.counts.shape)]
+            self.counts = np.pad(self.counts, pad)
+
+    def add_codes(self, collection, period, codes):
+        """Adds a flat sequence of code strings to one (collection, period) cell row."""
+        if len(codes) == 0:
+            return
+        uniques, counts = np.unique(np.asarray(codes, dtype=object).astype(str), return_counts=True)
+        c = self.collections.code(collection)
+        p = self.periods.code(period)
+        k = self.codes.codes(uniques)
+        self._fit()
+        self.counts[c, p, k] += counts
+
+    def add_counts(self, collection, period, counts):
+        """Adds a ``{code: count}`` mapping, e.g. server-reported totals, to one cell row."""
+        counts = {code: n for code, n in counts.items() if n}
+        if not counts:
+            return
+        c = self.collections.code(collection)
+        p = self.periods.code(period)
+        k = self.codes.codes(counts)
+        self._fit()
+        self.counts[c, p, k] += np.fromiter(counts.values(), dtype=np.int64)
+
+    def add_page(self, features, collection, property_name, period=DEFAULT_PERIOD):
+        """Counts the values of a list-valued property over one page of features."""
+        flat = list(chain.from_iterable(
+            (feature.get("properties") or {}).get(property_name) or () for feature in features
+        ))
+        self.add_codes(collection, period, flat)
+
+    def _encode(self, vocabulary, array):
+        """Dictionary-encodes a pyarrow string array into vocabulary codes (-1 for nulls)."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        encoded = pc.dictionary_encode(array)
+        if isinstance(encoded, pa.ChunkedArray):
+            encoded = encoded.combine_chunks()
+        mapping = vocabulary.codes(encoded.dictionary.to_pylist())
+        indices = encoded.indices.to_numpy(zero_copy_only=False)
+        valid = ~np.asarray(pc.is_null(encoded.indices))
+        result = np.full(len(indices), -1, dtype=np.int64)
+        result[valid] = mapping[indices[valid].astype(np.int64)]
+        return result
+
+    def add_columns(self, collections, periods, code_lists):
+        """
+        Counts whole columns at once: one collection id, one period label and
+        one list of codes per row. Accepts pyarrow arrays or anything
+        ``pyarrow.array`` can convert (lists, pandas Series). With ``periods``
+        None every row is counted under ``DEFAULT_PERIOD``.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        code_lists = code_lists if isinstance(code_lists, (pa.Array, pa.ChunkedArray)) else pa.array(code_lists)
+        if isinstance(code_lists, pa.ChunkedArray):
+            code_lists = code_lists.combine_chunks()
+        if len(code_lists) == 0:
+            return
+        row_collection = self._encode(self.collections, pa.array(collections, type=pa.string()))
+        if periods is None:
+            row_period = np.full(len(code_lists), self.periods.code(DEFAULT_PERIOD), dtype=np.int64)
+        else:
+            row_period = self._encode(self.periods, pa.array(periods, type=pa.string()))
+        flat = pc.list_flatten(code_lists)
+        parents = pc.list_parent_indices(code_lists).to_numpy().astype(np.int64)
+        code = self._encode(self.codes, flat)
+        c, p = row_collection[parents], row_period[parents]
+        keep = (c >= 0) & (p >= 0) & (code >= 0)
+        self._fit()
+        shape = self.counts.shape
+        key = np.ravel_multi_index((c[keep], p[keep], code[keep]), shape)
+        self.counts += np.bincount(key, minlength=int(np.prod(shape))).reshape(shape)
+
+    def merge(self, other):
+        """Adds the counts of another ``CodeCounts`` into this one."""
+        c = self.collections.codes(other.collections.values)
+        p = self.periods.codes(other.periods.values)
+        k = self.codes.codes(other.codes.values)
+        self._fit()
+        self.counts[np.ix_(c, p, k)] += other.counts
+
+    def get(self, collection, period=DEFAULT_PERIOD):
+        """Returns ``{code: count}`` of one cell row, leaving out zeros."""
+        c = self.collections.index.get(collection)
+        p = self.periods.index.get(period)
+        if c is None or p is None:
+            return {}
+        row = self.counts[c, p]
+        return {self.codes.values[k]: int(row[k]) for k in np.nonzero(row)[0]}
+
+    def totals(self, collection):
+        """Returns ``{code: count}`` for a collection summed over all periods."""
+        c = self.collections.index.get(collection)
+        if c is None:
+            return {}
+        row = self.counts[c].sum(axis=0)
+        return {self.codes.values[k]: int(row[k]) for k in np.nonzero(row)[0]}
+
+    def pivot(self, collection, periods=None):
+        """
+        Returns a code x period DataFrame for one collection, with codes that
+        never occur in it left out and missing periods filled with 0.
+        """
+        import pandas as pd
+
+        periods = list(periods) if periods is not None else sorted(self.periods.values)
+        c = self.collections.index[collection]
+        columns = [self.periods.index.get(p) for p in periods]
+        matrix = np.zeros((len(self.codes), len(periods)), dtype=np.int64)
+        for j, p in enumerate(columns):
+            if p is not None:
+                matrix[:, j] = self.counts[c, p]
+        used = matrix.any(axis=1)
+        index = pd.Index(np.asarray(self.codes.values, dtype=object)[used], name="code")
+        frame = pd.DataFrame(matrix[used], index=index, columns=pd.Index(periods, name="time_period"))
+        return frame.sort_index()
+
+    def to_frame(self):
+        """Returns all non-zero cells as a long DataFrame (collection, period, code, count)."""
+        import pandas as pd
+
+        c, p, k = np.nonzero(self.counts)
+        return pd.DataFrame({
+            "collection": np.asarray(self.collections.values, dtype=object)[c],
+            "period": np.asarray(self.periods.values, dtype=object)[p],
+            "code": np.asarray(self.codes.values, dtype=object)[k],
+            "count": self.counts[c, p, k],
+        })
+
+    def collection_ids(self):
+        """Collections that have at least one count, in first-seen order."""
+        return [c for i, c in enumerate(self.collections.values) if self.counts[i].any()]
+
+    def period_labels(self):
+        """Periods that have at least one count, in first-seen order."""
+        return [p for i, p in enumerate(self.periods.values) if self.counts[:, i].any()]
@@ -0,0 +1,253 @@
+"""
+Persistent on-disk cache for Montandon API pages.
+
+Reruns of the analysis scripts request the same historical pages over and
+over. This cache stores decoded JSON responses on disk, content-addressed by
+a hash of the normalized request (method, URL with sorted query parameters,
+and JSON body), so a repeat run can be served from local disk.
+
+Features:
+- Closed historical windows (a ``datetime`` range ending more than
+  ``closed_after`` ago) never expire; everything else expires after ``ttl``.
+- Expired entries are revalidated with ``If-None-Match`` / ``If-Modified-Since``
+  when the server sent an ``ETag`` or ``Last-Modified`` header.
+- Total size is capped; the least recently used entries are evicted first.
+- Writes are atomic (temp file + rename), so concurrent scripts can share one
+  cache directory.
+
+Set ``MONTANDON_CACHE_DIR`` to move the cache away from ``~/.cache/montandon``.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_CACHE_DIR = os.environ.get("MONTANDON_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "montandon"))
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GiB
+DEFAULT_TTL = 6 * 3600  # seconds, for windows that can still change
+DEFAULT_CLOSED_AFTER = timedelta(days=365)
+
+CacheEntry = namedtuple("CacheEntry", ["key", "body", "etag", "last_modified", "stored_at", "expires_at"])
+
+
+def normalize_url(url, params=None):
+    """Returns ``url`` with ``params`` merged in and the query sorted, so equal requests compare equal."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query += [(k, str(v)) for k, v in params.items() if v is not None]
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(sorted(query)), ""))
+
+
+def request_key(method, url, params=None, body=None):
+    """Content address of a request: sha256 of the method, normalized URL and canonical JSON body."""
+    text = f"{method.upper()} {normalize_url(url, params)}"
+    if body is not None:
+        text += "\n" + json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def datetime_window_end(url, params=None, body=None):
+    """Returns the upper bound of the request's ``datetime`` range, or None if it is open or missing."""
+    value = (body or {}).get("datetime") or dict(parse_qsl(urlsplit(normalize_url(url, params)).query)).get("datetime")
+    if not value or "/" not in value:
+        return None
+    end = value.split("/", 1)[1]
+    if end in ("", ".."):
+        return None
+    try:
+        return datetime.fromisoformat(end.replace("Z", "+00:00")).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+
+def _is_hex(name, length):
+    return len(name) == length and all(c in "0123456789abcdef" for c in name)
+
+
+class PageCache:
+    """
+    LRU-capped on-disk cache of decoded JSON pages.
+
+    ``get`` returns a ``CacheEntry`` (fresh or stale) or None; callers check
+    ``is_fresh`` and use ``validators`` for a conditional request when stale.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 closed_after=DEFAULT_CLOSED_AFTER):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.closed_after = closed_after
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._index = {}  # key -> [size, last_used]
+        self._total = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _scan(self):
+        """
+        Builds the in-memory size/recency index from the page entries on disk.
+        The directory is shared with other caches (``queryables/``, ``layers/``,
+        ``collections.json``), so only ``<2 hex>/<sha256>.json`` files count.
+        """
+        for sub in os.scandir(self.directory):
+            if not (sub.is_dir() and _is_hex(sub.name, 2)):
+                continue
+            for entry in os.scandir(sub.path):
+                key = entry.name[:-5]
+                if entry.name.endswith(".json") and _is_hex(key, 64) and key.startswith(sub.name):
+                    stat = entry.stat()
+                    self._index[key] = [stat.st_size, stat.st_mtime]
+                    self._total += stat.st_size
+
+    def expiry_for(self, url, params=None, body=None, now=None):
+        """None (never expires) for closed historical windows, otherwise now + ttl."""
+        now = now or time.time()
+        end = datetime_window_end(url, params, body)
+        if end is not None and end < datetime.now(timezone.utc) - self.closed_after:
+            return None
+        return now + self.ttl
+
+    @staticmethod
+    def is_fresh(entry, now=None):
+        return entry.expires_at is None or (now or time.time()) < entry.expires_at
+
+    @staticmethod
+    def validators(entry):
+        """Conditional request headers for revalidating a stale entry."""
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def get(self, method, url, params=None, body=None):
+        key = request_key(method, url, params, body)
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        self._touch(key)
+        entry = CacheEntry(key, stored["body"], stored.get("etag"), stored.get("last_modified"),
+                           stored["stored_at"], stored.get("expires_at"))
+        with self._lock:
+            if self.is_fresh(entry):
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, method, url, params=None, body=None, data=None, headers=None):
+        """Stores a decoded response; ``headers`` supplies ETag/Last-Modified for later revalidation."""
+        headers = headers or {}
+        key = request_key(method, url, params, body)
+        now = time.time()
+        stored = {
+            "url": normalize_url(url, params),
+            "etag": headers.get("ETag") or headers.get("etag"),
+            "last_modified": headers.get("Last-Modified") or headers.get("last-modified"),
+            "stored_at": now,
+            "expires_at": self.expiry_for(url, params, body, now),
+            "body": data,
+        }
+        self._write(key, stored)
+
+    def refresh(self, entry, url, params=None, body=None):
+        """Marks a revalidated (HTTP 304) entry as fresh again and returns its body."""
+        now = time.time()
+        stored = {
+            "url": normalize_url(url, params),
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "stored_at": now,
+            "expires_at": self.expiry_for(url, params, body, now),
+            "body": entry.body,
+        }
+        self._write(entry.key, stored)
+        with self._lock:
+            self.revalidated += 1
+        return entry.body
+
+    def features(self, collections=None):
+        """
+        Every item in the cached pages (of ``collections`` only, when given),
+        keeping the most recently stored copy of each, so filters can be
+        tried on them without a request (``montandon.cql2.items_frame``).
+        """
+        latest = {}
+        for key in list(self._index):
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                continue
+            body = stored.get("body")
+            for feature in body.get("features", []) if isinstance(body, dict) else []:
+                item_key = (feature.get("collection"), feature.get("id"))
+                if collections and item_key[0] not in collections:
+                    continue
+                if item_key not in latest or latest[item_key][0] < stored["stored_at"]:
+                    latest[item_key] = (stored["stored_at"], feature)
+        return [feature for _, feature in latest.values()]
+
+    def _write(self, key, stored):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(stored, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            previous = self._index.get(key)
+            self._total += size - (previous[0] if previous else 0)
+            self._index[key] = [size, time.time()]
+        self._evict()
+
+    def _touch(self, key):
+        now = time.time()
+        try:
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if key in self._index:
+                self._index[key][1] = now
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache fits in ``max_bytes``."""
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            victims = sorted(self._index.items(), key=lambda item: item[1][1])
+            while self._total > self.max_bytes and victims:
+                key, (size, _) = victims.pop(0)
+                del self._index[key]
+                self._total -= size
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated,
+                "entries": len(self._index), "bytes": self._total}
@@ -0,0 +1,197 @@
+"""
+Cached catalog of the Montandon collections.
+
+Collection ids used to be hard-coded in every script, and the copies drifted
+apart. ``Catalog`` is built from ``/collections`` instead. The response is
+fetched at most once per ``ttl`` and kept on disk in the same shape as the
+bundled ``montandon_collections.json`` snapshot, which is only used when the
+API cannot be reached and there is no cached copy either. The snapshot holds
+a few collections only, so a catalog loaded from it is marked ``partial``
+and a warning says so.
+
+Features:
+- ``ids(role=..., source=...)``: collection ids by role (``event``,
+  ``hazard``, ``impact``, ...) and by source (the id prefix, e.g. ``gdacs``).
+- ``info(collection_id)``: a ``CollectionInfo`` with title, roles, source,
+  providers, temporal and spatial extent and summaries, for query planning.
+- ``load_catalog(engine)`` for async code and ``get_catalog()`` for plain
+  scripts share one cache file.
+
+Set ``MONTANDON_CATALOG_FILE`` to move the cache away from
+``~/.cache/montandon/collections.json``.
+
+Requires:
+    - requests (pip install requests)
+    - httpx (pip install httpx), for ``load_catalog``
+"""
+
+from collections import namedtuple
+import json
+import os
+import time
+
+from montandon.cache import DEFAULT_CACHE_DIR
+from montandon.paginator import STAC_API_URL, PageFetchError, iter_pages
+from montandon.slicing import parse_datetime
+
+COLLECTIONS_URL = f"{STAC_API_URL}/collections"
+SNAPSHOT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "montandon_collections.json")
+DEFAULT_CATALOG_FILE = os.environ.get("MONTANDON_CATALOG_FILE", os.path.join(DEFAULT_CACHE_DIR, "collections.json"))
+DEFAULT_TTL = 24 * 3600  # seconds
+
+# What query planning needs to know about a collection. ``start``/``end`` are
+# aware datetimes (None for an open end) and ``bbox`` is the overall
+# ``[west, south, east, north]`` box, or None when the collection has none.
+CollectionInfo = namedtuple("CollectionInfo", ["id", "title", "roles", "source", "providers", "start", "end",
+                                               "bbox", "summaries"])
+
+
+def collection_source(collection_id):
+    """The source part of a collection id: ``idmc-gidd-events`` -> ``idmc-gidd``."""
+    return collection_id.rsplit("-", 1)[0]
+
+
+class Catalog:
+    """The collection documents of the API, keyed by id."""
+
+    def __init__(self, collections, fetched_at=None, partial=False):
+        self.collections = collections
+        self.fetched_at = fetched_at
+        # True when loaded from the bundled snapshot, which lists only some of the collections
+        self.partial = partial
+
+    def __contains__(self, collection_id):
+        return collection_id in self.collections
+
+    def __len__(self):
+        return len(self.collections)
+
+    def get(self, collection_id):
+        """The raw collection document, or an empty dict for unknown ids."""
+        return self.collections.get(collection_id, {})
+
+    def roles(self, collection_id):
+        """
+        The collection's roles. Documents without any fall back to the id
+        suffix, so ``gdacs-events`` has the ``event`` role.
+        """
+        doc = self.get(collection_id)
+        roles = doc.get("roles") or doc.get("summaries", {}).get("roles")
+        return list(roles) if roles else [collection_id.rsplit("-", 1)[-1].rstrip("s")]
+
+    def ids(self, role=None, source=None):
+        """Sorted collection ids, optionally only those with ``role`` and/or from ``source``."""
+        return sorted(cid for cid in self.collections
+                      if (role is None or role in self.roles(cid))
+                      and (source is None or collection_source(cid) == source))
+
+    def sources(self):
+        return sorted({collection_source(cid) for cid in self.collections})
+
+    def info(self, collection_id):
+        """Returns the ``CollectionInfo`` of a collection."""
+        doc = self.get(collection_id)
+        extent = doc.get("extent", {})
+        interval = (extent.get("temporal", {}).get("interval") or [[None, None]])[0]
+        start, end = (list(interval) + [None, None])[:2]
+        bboxes = extent.get("spatial", {}).get("bbox") or [None]
+        return CollectionInfo(
+            id=collection_id,
+            title=doc.get("title", ""),
+            roles=self.roles(collection_id),
+            source=collection_source(collection_id),
+            providers=[p.get("name") for p in doc.get("providers", [])],
+            start=parse_datetime(start),
+            end=parse_datetime(end),
+            bbox=bboxes[0],
+            summaries=doc.get("summaries", {}),
+        )
+
+    def to_json(self):
+        """The catalog in the shape of a ``/collections`` response."""
+        docs = list(self.collections.values())
+        return {"collections": docs, "links": [], "numberMatched": len(docs), "numberReturned": len(docs)}
+
+    def save(self, path):
+        """Writes the catalog atomically (temp file + rename)."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        collections = {doc["id"]: doc for doc in data.get("collections", [])}
+        return cls(collections, fetched_at=os.path.getmtime(path))
+
+
+def read_cached(path=DEFAULT_CATALOG_FILE, ttl=DEFAULT_TTL):
+    """The cached catalog if it is younger than ``ttl`` seconds, else None."""
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            return Catalog.load(path)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _fallback(path, ex):
+    """A stale cached copy or, failing that, the bundled snapshot."""
+    for fallback in (path, SNAPSHOT_FILE):
+        try:
+            catalog = Catalog.load(fallback)
+        except (OSError, ValueError):
+            continue
+        if fallback == SNAPSHOT_FILE:
+            catalog.partial = True
+            print(f"WARNING: could not fetch /collections ({ex.cause}) and there is no cached copy; using the "
+                  f"bundled snapshot {fallback}, which lists only {len(catalog)} collections. Every other "
+                  f"collection is left out of this run.")
+        else:
+            print(f"Could not fetch /collections ({ex.cause}); using {fallback}")
+        return catalog
+    raise ex
+
+
+def _store(docs, path):
+    catalog = Catalog({doc["id"]: doc for doc in docs}, fetched_at=time.time())
+    try:
+        catalog.save(path)
+    except OSError as ex:
+        print(f"Could not cache the collection catalog in {path}: {ex}")
+    return catalog
+
+
+async def load_catalog(engine, path=DEFAULT_CATALOG_FILE, ttl=DEFAULT_TTL, refresh=False, url=COLLECTIONS_URL):
+    """
+    Returns the catalog, from the cache file when it is fresh, otherwise
+    fetched through ``engine`` (following ``/collections`` pagination).
+    """
+    catalog = None if refresh else read_cached(path, ttl)
+    if catalog is not None:
+        return catalog
+    docs = []
+    try:
+        async for page in engine.iter_pages(url=url, limit=None, max_retries=2):
+            docs.extend(page.data.get("collections", []))
+    except PageFetchError as ex:
+        return _fallback(path, ex)
+    return _store(docs, path)
+
+
+def get_catalog(path=DEFAULT_CATALOG_FILE, ttl=DEFAULT_TTL, refresh=False, url=COLLECTIONS_URL, session=None):
+    """Blocking counterpart of ``load_catalog`` using the shared ``requests`` session."""
+    catalog = None if refresh else read_cached(path, ttl)
+    if catalog is not None:
+        return catalog
+    docs = []
+    try:
+        for page in iter_pages(url=url, limit=None, max_retries=2, session=session):
+            docs.extend(page.data.get("collections", []))
+    except PageFetchError as ex:
+        return _fallback(path, ex)
+    return _store(docs, path)
@@ -0,0 +1,139 @@
+"""
+Resumable crawl checkpoints.
+
+A full scan of a large collection takes hours, and one failure used to throw
+away every page fetched so far. ``CrawlCheckpoint`` records, per collection,
+the datetime windows of the scan, the last good ``next`` link of each window,
+the partial aggregate built from the pages consumed so far and a status
+(``running``, ``done`` or ``failed``). A later run can then resume every
+window from its saved link and start from the saved aggregate.
+
+The links and the aggregate are always saved together from the same point
+of the scan, so a resumed run neither misses nor double-counts a page. The
+state file is written atomically every ``save_every`` pages, at least every
+``max_interval`` seconds, and on every status change.
+
+Usage::
+
+    checkpoint = CrawlCheckpoint("crawl_state.json")
+    resume = checkpoint.resume_links(collection_id)
+    async for page in iter_sliced_pages(engine, collection_id, windows, resume=resume):
+        ...  # update the aggregate with the page
+        checkpoint.record_page(collection_id, page, aggregate)
+    checkpoint.finish(collection_id, aggregate)
+"""
+
+from datetime import datetime, timezone
+import json
+import os
+import time
+
+from montandon.slicing import format_datetime, parse_datetime
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlCheckpoint:
+    """Crawl state of several collections, persisted to one JSON file."""
+
+    def __init__(self, path, save_every=5, max_interval=30):
+        self.path = path
+        self.save_every = save_every
+        self.max_interval = max_interval
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self.state = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {"collections": {}}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self):
+        """Writes the state file atomically (temp file + rename)."""
+        self.state["saved_at"] = format_datetime(datetime.now(timezone.utc))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def clear(self):
+        """Forgets all saved progress and removes the state file."""
+        self.state = {"collections": {}}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def entry(self, collection_id):
+        return self.state["collections"].get(collection_id)
+
+    def status(self, collection_id):
+        entry = self.entry(collection_id)
+        return entry["status"] if entry else None
+
+    def aggregate(self, collection_id):
+        """The saved partial (or final) aggregate of a collection, or None."""
+        entry = self.entry(collection_id)
+        return entry["aggregate"] if entry else None
+
+    def windows(self, collection_id):
+        """The datetime windows a collection's scan was started with, or None."""
+        entry = self.entry(collection_id)
+        if not entry:
+            return None
+        return [(parse_datetime(start), parse_datetime(end)) for start, end in entry["windows"]]
+
+    def resume_links(self, collection_id):
+        """
+        Returns ``{window index: next link}`` for the windows that were started,
+        with None for windows that are finished. Windows that are missing start
+        from the beginning.
+        """
+        entry = self.entry(collection_id)
+        if not entry:
+            return {}
+        return {int(index): (None if window["done"] else window["next_url"])
+                for index, window in entry["progress"].items()}
+
+    def start(self, collection_id, windows):
+        """Registers a scan, keeping the progress of an earlier run over the same windows."""
+        entry = self.entry(collection_id)
+        planned = [[format_datetime(s) if s else None, format_datetime(e) if e else None] for s, e in windows]
+        if not entry or entry["windows"] != planned:
+            entry = self.state["collections"][collection_id] = {
+                "windows": planned, "progress": {}, "pages": 0, "items": 0, "aggregate": None,
+            }
+        entry["status"] = RUNNING
+        entry.pop("error", None)
+        self.save()
+
+    def record_page(self, collection_id, page, aggregate):
+        """
+        Records a consumed page of a sliced scan (``page.window`` is its window
+        index) together with the aggregate that already includes it.
+        """
+        entry = self.state["collections"][collection_id]
+        entry["progress"][str(page.window)] = {"next_url": page.next_url, "done": page.next_url is None}
+        entry["pages"] += 1
+        entry["items"] += len(page.features)
+        entry["aggregate"] = aggregate
+        self._unsaved += 1
+        if self._unsaved >= self.save_every or time.monotonic() - self._saved_at >= self.max_interval:
+            self.save()
+
+    def finish(self, collection_id, aggregate):
+        entry = self.state["collections"][collection_id]
+        entry["status"] = DONE
+        entry["aggregate"] = aggregate
+        self.save()
+
+    def fail(self, collection_id, error):
+        """Marks a scan as failed; its last good links are kept for ``resume_links``."""
+        entry = self.state["collections"][collection_id]
+        entry["status"] = FAILED
+        entry["error"] = str(error)
+        self.save()
@@ -0,0 +1,125 @@
+"""
+Server-side counts for the Montandon STAC API.
+
+Most reports only need numbers, not items. These helpers ask the server how
+many items match a query with a single ``limit=1`` request, reading
+``numberMatched`` (or ``context.matched`` from the older context extension),
+and only fall back to streaming the matching items when the server does not
+report counts.
+
+Features:
+- ``probe_count``: one small request, None if the server does not count.
+- ``count_items``: probe first, stream and count ids as a fallback.
+- ``count_matrix``: a (collection x code) matrix with one probe per cell,
+  using CQL2 ``a_contains`` filters on array properties such as
+  ``monty:country_codes`` or ``monty:hazard_codes``.
+
+Requires:
+    - httpx (pip install httpx)
+"""
+
+import asyncio
+from collections import Counter
+
+from montandon.paginator import build_params, items_url
+
+
+def matched_count(data):
+    """Returns the server-reported match count of a search response, or None."""
+    count = data.get("numberMatched")
+    if count is None:
+        count = (data.get("context") or {}).get("matched")
+    return count
+
+
+def contains_filter(property_name, code):
+    """CQL2-JSON filter matching items whose array property contains ``code``."""
+    return {"op": "a_contains", "args": [{"property": property_name}, [code]]}
+
+
+def and_filters(*filters):
+    """Combines CQL2-JSON filters with ``and``, ignoring empty ones."""
+    filters = [f for f in filters if f]
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+    return {"op": "and", "args": filters}
+
+
+async def probe_count(engine, collection_id, datetime=None, bbox=None, filter=None, max_retries=None):
+    """
+    Returns the number of items in ``collection_id`` matching the query, or
+    None when the server does not report counts.
+    """
+    params = build_params(limit=1, fields="id", datetime=datetime, bbox=bbox, filter=filter)
+    data = await engine.get_json(items_url(collection_id), params, max_retries=max_retries,
+                                 label=collection_id)
+    return matched_count(data)
+
+
+async def count_items(engine, collection_id, datetime=None, bbox=None, filter=None, page_limit=250):
+    """
+    Counts the items matching a query. Uses the server-reported count when
+    available, otherwise streams the matching ids and counts them.
+    """
+    count = await probe_count(engine, collection_id, datetime, bbox, filter)
+    if count is not None:
+        return count
+    count = 0
+    async for page in engine.iter_pages(collection_id, limit=page_limit, fields="id",
+                                        datetime=datetime, bbox=bbox, filter=filter):
+        count += len(page.features)
+    return count
+
+
+async def stream_code_counts(engine, collection_id, property_name, codes=None, datetime=None, bbox=None,
+                             page_limit=250):
+    """
+    Counts the values of an array property by streaming a collection, keeping
+    only ``codes`` when given. This is the slow path used when the server
+    does not report match counts.
+    """
+    counter = Counter()
+    wanted = set(codes) if codes else None
+    async for page in engine.iter_pages(collection_id, limit=page_limit, fields=f"properties.{property_name}",
+                                        datetime=datetime, bbox=bbox):
+        for feature in page.features:
+            values = feature.get("properties", {}).get(property_name) or []
+            counter.update(v for v in values if wanted is None or v in wanted)
+    return counter
+
+
+async def count_collection_codes(engine, collection_id, codes, property_name, datetime=None, bbox=None):
+    """
+    Returns ``{code: count}`` for one collection. The first code is probed on
+    its own to find out whether the server reports counts; if it does, the
+    remaining codes are probed concurrently, otherwise the collection is
+    streamed once and all codes are counted locally.
+    """
+    codes = list(codes)
+    if not codes:
+        return {}
+    first = await probe_count(engine, collection_id, datetime, bbox, contains_filter(property_name, codes[0]))
+    if first is None:
+        print(f"  {collection_id}: server does not report counts, streaming items instead")
+        counter = await stream_code_counts(engine, collection_id, property_name, codes, datetime, bbox)
+        return {code: counter.get(code, 0) for code in codes}
+    rest = await asyncio.gather(*(
+        probe_count(engine, collection_id, datetime, bbox, contains_filter(property_name, code))
+        for code in codes[1:]
+    ))
+    return dict(zip(codes, [first] + list(rest)))
+
+
+async def count_matrix(engine, collection_ids, codes, property_name="monty:country_codes", datetime=None,
+                       bbox=None):
+    """
+    Returns ``{collection_id: {code: count}}`` for every collection and code,
+    costing one small request per cell when the server reports counts.
+    """
+    results = await asyncio.gather(*(
+        count_collection_codes(engine, collection_id, codes, property_name, datetime, bbox)
+        for collection_id in collection_ids
+    ))
+    return dict(zip(collection_ids, results))
@@ -0,0 +1,664 @@
+"""
+Client-side evaluation of CQL2-JSON filters.
+
+The filter dicts the scripts send to ``/search`` can also run on local data:
+
+- ``matches(filter, item)`` evaluates a filter against one STAC item (a
+  GeoJSON feature dict), the way the server would. It is used for the parts
+  of a filter the server cannot run (see ``montandon.filters``).
+- ``compile_predicate(filter)`` compiles a filter into a vectorized
+  predicate over a pandas DataFrame of items: the Parquet replica
+  (``montandon.replica.query_replica``) or cached pages (``items_frame``).
+  Comparisons and temporal tests run on whole NumPy columns, array tests on
+  the flattened lists, and spatial tests parse only the geometries whose
+  ``bbox`` can touch the literal. An ``ItemTable`` keeps the decoded
+  columns between filters.
+
+Supported:
+- logical ``and``, ``or``, ``not``; comparisons ``=``, ``<>``, ``<``, ``<=``,
+  ``>``, ``>=``, ``like``, ``between``, ``in``, ``isNull`` and ``casei``;
+- array functions ``a_equals``, ``a_contains``, ``a_containedBy``,
+  ``a_overlaps``;
+- temporal functions ``t_*`` on instants, intervals and ``..`` open ends.
+  The ``datetime`` property of an item with ``start_datetime`` and
+  ``end_datetime`` is that interval;
+- spatial functions ``s_*`` on GeoJSON geometries and ``{"bbox": [...]}``
+  literals, through shapely.
+
+Requires:
+    - shapely (pip install shapely), for the spatial functions only
+    - numpy, pandas (pip install numpy pandas), for ``compile_predicate``
+"""
+
+from datetime import datetime, timezone
+import json
+import operator
+import re
+
+from montandon.slicing import parse_datetime
+
+# Top-level item members; every other property lives in ``properties``
+ITEM_MEMBERS = {"id", "collection", "geometry", "bbox"}
+TEMPORAL_PROPERTIES = {"datetime", "start_datetime", "end_datetime", "created", "updated"}
+
+COMPARISON_OPS = {"=", "<>", "<", "<=", ">", ">="}
+ARRAY_OPS = {"a_equals", "a_contains", "a_containedBy", "a_overlaps"}
+SPATIAL_OPS = {"s_intersects", "s_equals", "s_disjoint", "s_touches", "s_within", "s_overlaps", "s_crosses",
+               "s_contains"}
+TEMPORAL_OPS = {"t_after", "t_before", "t_contains", "t_disjoint", "t_during", "t_equals", "t_finishedBy",
+                "t_finishes", "t_intersects", "t_meets", "t_metBy", "t_overlappedBy", "t_overlaps",
+                "t_startedBy", "t_starts"}
+LOGICAL_OPS = {"and", "or", "not"}
+OTHER_OPS = {"like", "between", "in", "isNull", "casei"}
+SUPPORTED_OPS = COMPARISON_OPS | ARRAY_OPS | SPATIAL_OPS | TEMPORAL_OPS | LOGICAL_OPS | OTHER_OPS
+
+_MIN_TIME = datetime.min.replace(tzinfo=timezone.utc)
+_MAX_TIME = datetime.max.replace(tzinfo=timezone.utc)
+
+# (a_start, a_end, b_start, b_end) -> bool, as defined by the CQL2 standard. Written with
+# ``&``/``|`` so the same table works on scalars and on NumPy arrays.
+_TEMPORAL = {
+    "t_after": lambda as_, ae, bs, be: as_ > be,
+    "t_before": lambda as_, ae, bs, be: ae < bs,
+    "t_contains": lambda as_, ae, bs, be: (as_ < bs) & (ae > be),
+    "t_disjoint": lambda as_, ae, bs, be: (as_ > be) | (ae < bs),
+    "t_during": lambda as_, ae, bs, be: (as_ > bs) & (ae < be),
+    "t_equals": lambda as_, ae, bs, be: (as_ == bs) & (ae == be),
+    "t_finishedBy": lambda as_, ae, bs, be: (as_ < bs) & (ae == be),
+    "t_finishes": lambda as_, ae, bs, be: (as_ > bs) & (ae == be),
+    "t_intersects": lambda as_, ae, bs, be: (as_ <= be) & (bs <= ae),
+    "t_meets": lambda as_, ae, bs, be: ae == bs,
+    "t_metBy": lambda as_, ae, bs, be: as_ == be,
+    "t_overlappedBy": lambda as_, ae, bs, be: (bs < as_) & (as_ < be) & (be < ae),
+    "t_overlaps": lambda as_, ae, bs, be: (as_ < bs) & (bs < ae) & (ae < be),
+    "t_startedBy": lambda as_, ae, bs, be: (as_ == bs) & (ae > be),
+    "t_starts": lambda as_, ae, bs, be: (as_ == bs) & (ae < be),
+}
+
+
+class CQL2Error(ValueError):
+    """Raised for filters that are not valid CQL2-JSON or use an unsupported operator."""
+
+
+def property_names(node):
+    """Every property name referenced in a filter."""
+    if isinstance(node, dict):
+        if "property" in node:
+            return {node["property"]}
+        return set().union(*(property_names(arg) for arg in node.get("args", [])))
+    if isinstance(node, list):
+        return set().union(*(property_names(arg) for arg in node))
+    return set()
+
+
+def operators(node):
+    """Every operator used in a filter."""
+    if isinstance(node, dict):
+        found = {node["op"]} if "op" in node else set()
+        return found.union(*(operators(arg) for arg in node.get("args", [])))
+    if isinstance(node, list):
+        return set().union(*(operators(arg) for arg in node))
+    return set()
+
+
+def get_property(item, name):
+    """The value of property ``name`` of an item (top-level members included)."""
+    if name in ITEM_MEMBERS:
+        return item.get(name)
+    return item.get("properties", {}).get(name)
+
+
+def like_pattern(pattern):
+    """Compiles a CQL2 ``like`` pattern (``%`` and ``_`` wildcards, ``\\`` escapes) to a regex."""
+    parts = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            parts.append(re.escape(char))
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def matches(filter, item):
+    """True if the item passes the CQL2-JSON ``filter`` (None passes everything)."""
+    if filter is None:
+        return True
+    return bool(_evaluate(filter, item))
+
+
+def _evaluate(node, item):
+    if not isinstance(node, dict):
+        if isinstance(node, list):
+            return [_evaluate(arg, item) for arg in node]
+        return node
+    if "property" in node:
+        return get_property(item, node["property"])
+    if "op" not in node:
+        return node  # timestamp, date, interval or bbox literal, or a geometry
+    op, args = node["op"], node.get("args", [])
+    if op == "and":
+        return all(_evaluate(arg, item) for arg in args)
+    if op == "or":
+        return any(_evaluate(arg, item) for arg in args)
+    if op == "not":
+        return not _evaluate(args[0], item)
+    if op in TEMPORAL_OPS:
+        a, b = (_interval(arg, item) for arg in args)
+        if a is None or b is None:
+            return False
+        return _TEMPORAL[op](*a, *b)
+    if op in SPATIAL_OPS:
+        a, b = (_geometry(arg, item) for arg in args)
+        if a is None or b is None:
+            return False
+        return getattr(a, op[2:])(b)
+    values = [_evaluate(arg, item) for arg in args]
+    if op == "isNull":
+        return values[0] is None
+    if op == "casei":
+        return values[0].lower() if isinstance(values[0], str) else values[0]
+    if op in ARRAY_OPS:
+        a, b = values
+        if a is None or b is None:
+            return False
+        if op == "a_equals":
+            return list(a) == list(b)
+        if op == "a_contains":
+            return set(b) <= set(a)
+        if op == "a_containedBy":
+            return set(a) <= set(b)
+        return bool(set(a) & set(b))
+    if op == "in" and _is_property(args[1]):
+        # "value in array property", the reverse of CQL2's "property in list"
+        value, array = values
+        return array is not None and value in array
+    if op == "in":
+        value, candidates = values
+        return value is not None and value in candidates
+    if op == "like":
+        value, pattern = values
+        return isinstance(value, str) and like_pattern(pattern).fullmatch(value) is not None
+    if op == "between":
+        value, low, high = _comparable(args, values)
+        return value is not None and low <= value <= high
+    if op in COMPARISON_OPS:
+        a, b = _comparable(args, values)
+        if a is None or b is None:
+            return False
+        try:
+            if op == "=":
+                return a == b
+            if op == "<>":
+                return a != b
+            if op == "<":
+                return a < b
+            if op == "<=":
+                return a <= b
+            if op == ">":
+                return a > b
+            return a >= b
+        except TypeError:
+            return False
+    raise CQL2Error(f"Unsupported CQL2 operator: {op}")
+
+
+def _is_property(node):
+    return isinstance(node, dict) and "property" in node
+
+
+def _comparable(args, values):
+    """Parses the values of a comparison as datetimes when one side is temporal."""
+    temporal = any(isinstance(arg, dict) and (arg.get("property") in TEMPORAL_PROPERTIES
+                                              or "timestamp" in arg or "date" in arg) for arg in args)
+    if not temporal:
+        return values
+    return [_instant(value) for value in values]
+
+
+def _instant(value):
+    if isinstance(value, dict):
+        value = value.get("timestamp") or value.get("date")
+    if isinstance(value, datetime):
+        return value
+    return parse_datetime(value) if isinstance(value, str) else None
+
+
+def _interval(node, item):
+    """``(start, end)`` of a temporal argument, with open ends as the extreme datetimes."""
+    if isinstance(node, dict) and node.get("property") == "datetime":
+        props = item.get("properties", {})
+        if props.get("start_datetime") or props.get("end_datetime"):
+            start, end = _instant(props.get("start_datetime")), _instant(props.get("end_datetime"))
+            return start or _MIN_TIME, end or _MAX_TIME
+    if isinstance(node, dict) and "interval" in node:
+        start, end = node["interval"]
+        return (_MIN_TIME if start == ".." else _instant(start)), (_MAX_TIME if end == ".." else _instant(end))
+    value = _instant(_evaluate(node, item))
+    return None if value is None else (value, value)
+
+
+def _geometry(node, item):
+    from shapely.geometry import box, shape
+
+    if isinstance(node, dict) and "bbox" in node and "type" not in node:
+        bbox = node["bbox"]
+        return box(*bbox) if len(bbox) == 4 else box(bbox[0], bbox[1], bbox[3], bbox[4])
+    value = _evaluate(node, item)
+    if value is None:
+        return None
+    return value if hasattr(value, "geom_type") else shape(value)
+
+
+# --- Vectorized evaluation over local tables ---
+
+_OPERATORS = {"=": operator.eq, "<>": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt,
+              ">=": operator.ge}
+_CONVERSE = {"s_within": "s_contains", "s_contains": "s_within"}
+
+
+def compile_predicate(filter):
+    """
+    Compiles a CQL2-JSON filter into ``predicate(frame)``, which returns a
+    boolean NumPy mask over the rows of a pandas DataFrame of items. The
+    frame has the layout of the Parquet replica (``montandon.replica``) or of
+    ``items_frame``: properties with their own column are read from it, the
+    rest from the ``properties`` column (JSON text or dicts); ``geometry`` is
+    GeoJSON text or dicts and ``bbox`` a list per row. Literals, patterns
+    and geometries are parsed once here, and each column is decoded once
+    per frame however often the filter uses it.
+    """
+    import numpy as np
+
+    if filter is None:
+        return lambda frame: np.ones(len(frame), dtype=bool)
+    test = _compile(filter)
+
+    def predicate(frame):
+        table = frame if isinstance(frame, ItemTable) else ItemTable(frame)
+        return np.asarray(test(table), dtype=bool)
+    return predicate
+
+
+def filter_frame(frame, filter):
+    """The rows of ``frame`` that pass the CQL2-JSON ``filter``."""
+    return frame[compile_predicate(filter)(frame)]
+
+
+def items_frame(features):
+    """A DataFrame of STAC items (cached pages, API responses) that ``compile_predicate`` runs on."""
+    import pandas as pd
+
+    features = list(features)
+    return pd.DataFrame({
+        "id": [f.get("id") for f in features],
+        "collection": [f.get("collection") for f in features],
+        "datetime": [(f.get("properties") or {}).get("datetime") for f in features],
+        "bbox": [f.get("bbox") for f in features],
+        "geometry": [f.get("geometry") for f in features],
+        "properties": [f.get("properties") or {} for f in features],
+    })
+
+
+def frame_columns(filter):
+    """The replica columns a filter reads, for loading only what it needs."""
+    names = property_names(filter) if filter else set()
+    columns = set(names)
+    if "datetime" in names:
+        columns |= {"start_datetime", "end_datetime"}
+    if "geometry" in names:
+        columns.add("bbox")
+    return columns
+
+
+class ItemTable:
+    """
+    A frame of items with its decoded columns (parsed datetimes, geometries,
+    properties) kept between filters, for trying many filters on the same
+    data. Predicates accept it in place of the frame.
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.size = len(frame)
+        self._decoded = {}
+
+    def __len__(self):
+        return self.size
+
+    def mask(self, filter):
+        """Boolean mask of the rows passing ``filter``."""
+        return compile_predicate(filter)(self)
+
+    def where(self, filter):
+        """The rows of the frame passing ``filter``."""
+        return self.frame[self.mask(filter)]
+
+    def _cached(self, key, build):
+        if key not in self._decoded:
+            self._decoded[key] = build()
+        return self._decoded[key]
+
+    def values(self, name):
+        """Object array of a property, from its column or from ``properties``."""
+        import numpy as np
+
+        def build():
+            if name in self.frame.columns:
+                import pandas as pd
+
+                values = np.array(self.frame[name].to_numpy(dtype=object), dtype=object)  # a writable copy
+                values[pd.isna(values)] = None  # pandas string columns hold NaN for missing values
+                return values
+            values = np.empty(self.size, dtype=object)
+            values[:] = [props.get(name) for props in self.properties()]
+            return values
+        return self._cached(("values", name), build)
+
+    def lists(self, name):
+        """
+        An array property flattened: ``(present, lengths, rows, flat)`` with
+        the rows that hold a list, their lengths, and every element as a
+        pandas Series next to the row it came from.
+        """
+        import numpy as np
+        import pandas as pd
+
+        def build():
+            values = self.values(name)
+            present = np.fromiter((v is not None and not isinstance(v, float) for v in values), dtype=bool,
+                                  count=len(values))
+            lengths = np.zeros(len(values), dtype=np.int64)
+            lengths[present] = [len(v) for v in values[present]]
+            rows = np.repeat(np.arange(len(values)), lengths)
+            flat = pd.Series(np.concatenate([np.asarray(v, dtype=object) for v in values[present]])
+                             if lengths.sum() else [], dtype=object)
+            return present, lengths, rows, flat
+        return self._cached(("lists", name), build)
+
+    def properties(self):
+        def build():
+            if "properties" not in self.frame.columns:
+                return [{}] * self.size
+            return [json.loads(props) if isinstance(props, str) else (props or {})
+                    for props in self.frame["properties"]]
+        return self._cached("properties", build)
+
+    def times(self, name):
+        """A property as ``datetime64[s]`` (NaT where missing or unparseable)."""
+        from montandon.validation import parse_datetime_column
+
+        return self._cached(("times", name), lambda: parse_datetime_column(self.values(name)))
+
+    def interval(self, name):
+        """``(start, end)`` arrays; ``datetime`` is the start/end range of the rows that have one."""
+        import numpy as np
+
+        def build():
+            instant = self.times(name)
+            if name != "datetime":
+                return instant, instant
+            start, end = self.times("start_datetime"), self.times("end_datetime")
+            has_range = ~np.isnat(start) | ~np.isnat(end)
+            start = np.where(has_range, np.where(np.isnat(start), _np_time(_MIN_TIME), start), instant)
+            end = np.where(has_range, np.where(np.isnat(end), _np_time(_MAX_TIME), end), instant)
+            return start, end
+        return self._cached(("interval", name), build)
+
+    def bounds(self):
+        """``(n, 4)`` array of the ``bbox`` column (NaN where missing), or None without one."""
+        import numpy as np
+
+        def build():
+            if "bbox" not in self.frame.columns:
+                return None
+            bounds = np.full((self.size, 4), np.nan)
+            for i, bbox in enumerate(self.frame["bbox"]):
+                if bbox is not None and len(bbox) in (4, 6):
+                    bounds[i] = [bbox[0], bbox[1], bbox[2], bbox[3]] if len(bbox) == 4 else \
+                        [bbox[0], bbox[1], bbox[3], bbox[4]]
+            return bounds
+        return self._cached("bounds", build)
+
+    def geometries(self, rows):
+        """Shapely geometries of the given rows, parsing each row's GeoJSON only once."""
+        import numpy as np
+        import shapely
+
+        geometries, parsed = self._cached("geometries", lambda: (np.empty(self.size, dtype=object),
+                                                                 np.zeros(self.size, dtype=bool)))
+        todo = rows[~parsed[rows]]
+        if len(todo):
+            texts = np.empty(len(todo), dtype=object)
+            texts[:] = [json.dumps(g) if isinstance(g, dict) else g for g in self.values("geometry")[todo]]
+            geometries[todo] = shapely.from_geojson(texts, on_invalid="ignore")
+            parsed[todo] = True
+        return geometries[rows]
+
+
+def _np_time(value):
+    import numpy as np
+
+    if value is None:
+        return np.datetime64("NaT", "s")
+    return np.datetime64(value.astimezone(timezone.utc).replace(tzinfo=None), "s")
+
+
+def _is_temporal(node):
+    return isinstance(node, dict) and (node.get("property") in TEMPORAL_PROPERTIES or "timestamp" in node
+                                       or "date" in node)
+
+
+def _null_mask(values):
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(values, np.ndarray):
+        return np.isnat(values) if values.dtype.kind == "M" else pd.isna(values)
+    return values is None
+
+
+def _compile_value(node, temporal=False):
+    """``get(columns)`` returning a column array or a scalar literal."""
+    if _is_property(node):
+        name = node["property"]
+        return (lambda cols: cols.times(name)) if temporal else (lambda cols: cols.values(name))
+    if isinstance(node, dict) and node.get("op") == "casei":
+        inner = _compile_value(node["args"][0])
+        return lambda cols: _lower(inner(cols))
+    if isinstance(node, dict) and "op" in node:
+        raise CQL2Error(f"Unsupported CQL2 value expression: {node['op']}")
+    if temporal:
+        value = _np_time(_instant(node))
+        return lambda cols: value
+    return lambda cols: node
+
+
+def _lower(values):
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(values, np.ndarray):
+        return np.asarray(pd.Series(values, dtype=object).str.lower().to_numpy(), dtype=object)
+    return values.lower() if isinstance(values, str) else values
+
+
+def _compare(function, a, b):
+    """Elementwise ``function(a, b)``; False wherever a side is null or the types do not compare."""
+    import numpy as np
+
+    size = next((len(v) for v in (a, b) if isinstance(v, np.ndarray)), None)
+    if size is None:
+        try:
+            return a is not None and b is not None and bool(function(a, b))
+        except TypeError:
+            return False
+    valid = ~(np.asarray(_null_mask(a)) | np.asarray(_null_mask(b)))
+    valid = np.broadcast_to(valid, (size,))
+    result = np.zeros(size, dtype=bool)
+    rows = np.flatnonzero(valid)
+    left = a[rows] if isinstance(a, np.ndarray) else a
+    right = b[rows] if isinstance(b, np.ndarray) else b
+    try:
+        result[rows] = function(left, right)
+    except TypeError:
+        # Mixed types in an object column; compare what compares
+        for i, row in enumerate(rows):
+            try:
+                result[row] = bool(function(left[i] if isinstance(left, np.ndarray) else left,
+                                            right[i] if isinstance(right, np.ndarray) else right))
+            except TypeError:
+                pass
+    return result
+
+
+def _compile(node):
+    """``test(columns)`` returning a boolean mask."""
+    import numpy as np
+    import pandas as pd
+
+    if not isinstance(node, dict) or "op" not in node:
+        raise CQL2Error(f"Not a CQL2 predicate: {node!r}")
+    op, args = node["op"], node.get("args", [])
+    if op in ("and", "or"):
+        tests = [_compile(arg) for arg in args]
+        combine = np.logical_and if op == "and" else np.logical_or
+
+        def test(cols):
+            result = np.full(cols.size, op == "and")
+            for sub in tests:
+                result = combine(result, sub(cols))
+            return result
+        return test
+    if op == "not":
+        inner = _compile(args[0])
+        return lambda cols: ~np.asarray(inner(cols), dtype=bool)
+    if op in COMPARISON_OPS:
+        temporal = any(_is_temporal(arg) for arg in args)
+        left, right = (_compile_value(arg, temporal) for arg in args)
+        function = _OPERATORS[op]
+        return lambda cols: _compare(function, left(cols), right(cols))
+    if op == "between":
+        temporal = any(_is_temporal(arg) for arg in args)
+        value, low, high = (_compile_value(arg, temporal) for arg in args)
+        return lambda cols: _compare(operator.ge, value(cols), low(cols)) & \
+            _compare(operator.le, value(cols), high(cols))
+    if op == "isNull":
+        value = _compile_value(args[0])
+        return lambda cols: np.asarray(_null_mask(value(cols)), dtype=bool)
+    if op == "like":
+        value = _compile_value(args[0])
+        pattern = like_pattern(args[1])
+        return lambda cols: pd.Series(value(cols), dtype=object).str.fullmatch(pattern).fillna(False) \
+            .to_numpy(dtype=bool)
+    if op == "in" and _is_property(args[1]):
+        return _compile_array("a_contains", [args[1], [args[0]]])
+    if op == "in":
+        value = _compile_value(args[0])
+        candidates = list(args[1])
+        return lambda cols: pd.Series(value(cols), dtype=object).isin(candidates).to_numpy()
+    if op in ARRAY_OPS:
+        return _compile_array(op, args)
+    if op in TEMPORAL_OPS:
+        left, right = (_compile_interval(arg) for arg in args)
+        function = _TEMPORAL[op]
+
+        def test(cols):
+            (a_start, a_end), (b_start, b_end) = left(cols), right(cols)
+            return np.asarray(function(a_start, a_end, b_start, b_end), dtype=bool)
+        return test
+    if op in SPATIAL_OPS:
+        return _compile_spatial(op, args)
+    raise CQL2Error(f"Unsupported CQL2 operator: {op}")
+
+
+def _compile_interval(node):
+    """``get(columns)`` returning ``(start, end)`` arrays or ``datetime64`` scalars."""
+    if _is_property(node):
+        name = node["property"]
+        return lambda cols: cols.interval(name)
+    if isinstance(node, dict) and "interval" in node:
+        start, end = node["interval"]
+        bounds = (_np_time(_MIN_TIME if start == ".." else _instant(start)),
+                  _np_time(_MAX_TIME if end == ".." else _instant(end)))
+        return lambda cols: bounds
+    instant = _np_time(_instant(node))
+    return lambda cols: (instant, instant)
+
+
+def _compile_array(op, args):
+    """Array functions of an array property against a literal list, on the flattened column."""
+    import numpy as np
+
+    if not (_is_property(args[0]) and isinstance(args[1], list)):
+        raise CQL2Error(f"{op} is only supported as {op}(property, [values])")
+    name = args[0]["property"]
+    wanted = list(dict.fromkeys(args[1]))
+    codes = {value: i for i, value in enumerate(wanted)}
+
+    def test(cols):
+        present, lengths, rows, flat = cols.lists(name)
+        if op == "a_equals":
+            values = cols.values(name)
+            result = np.zeros(cols.size, dtype=bool)
+            result[present] = [list(v) == args[1] for v in values[present]]
+            return result
+        code = flat.map(codes).to_numpy(dtype=float)
+        hit = ~np.isnan(code)
+        hits = np.bincount(rows[hit], minlength=cols.size)
+        if op == "a_overlaps":
+            return hits > 0
+        if op == "a_containedBy":
+            return present & (hits == lengths)
+        # a_contains: every wanted value appears at least once in the row
+        if not wanted:
+            return present
+        pairs = np.unique(rows[hit] * len(wanted) + code[hit].astype(np.int64))
+        return np.bincount(pairs // len(wanted), minlength=cols.size) == len(wanted)
+    return test
+
+
+def _compile_spatial(op, args):
+    """
+    Spatial functions of the geometry against a literal. Rows whose ``bbox``
+    cannot touch the literal's bounds are settled without parsing their
+    geometry; only the remaining candidates are tested exactly.
+    """
+    import numpy as np
+    import shapely
+
+    if _is_property(args[1]) and not _is_property(args[0]):
+        args, op = [args[1], args[0]], _CONVERSE.get(op, op)
+    if not _is_property(args[0]):
+        raise CQL2Error(f"{op} is only supported between a geometry property and a literal")
+    literal = _geometry(args[1], {})
+    shapely.prepare(literal)
+    function = getattr(shapely, "intersects" if op == "s_disjoint" else op[2:])
+    west, south, east, north = literal.bounds
+
+    def test(cols):
+        bounds = cols.bounds()
+        if bounds is None:
+            candidates = np.arange(cols.size)
+        else:
+            # NaN bounds (no bbox) and antimeridian boxes stay candidates
+            outside = (bounds[:, 0] > east) | (bounds[:, 2] < west) | (bounds[:, 1] > north) | (bounds[:, 3] < south)
+            candidates = np.flatnonzero(~outside | (bounds[:, 0] > bounds[:, 2]))
+        geometries = cols.geometries(candidates)
+        result = np.zeros(cols.size, dtype=bool)
+        result[candidates] = function(geometries, literal)
+        if op == "s_disjoint":
+            has_geometry = np.zeros(cols.size, dtype=bool)
+            has_geometry[candidates] = geometries != None  # noqa: E711 (elementwise)
+            if bounds is not None:
+                has_geometry |= ~np.isnan(bounds[:, 0])
+            return has_geometry & ~result
+        return result
+    return test
@@ -0,0 +1,287 @@
+"""
+Cross-source event deduplication.
+
+The same disaster is reported by GDACS, GLIDE, EM-DAT, PDC and others, each
+as an item of its own ``*-events`` collection, so counts that add the
+collections up count it several times. ``EventTable`` keeps a small record
+per event (collection, id, hazard and country codes, time span, bbox centre,
+correlation id) and ``cluster_events`` groups the records that describe the
+same event into ``EventCluster``s.
+
+Two events are taken to be the same event when
+- they carry the same ``monty:corr_id``, or
+- they come from different collections, share a hazard group and a country,
+  their time spans overlap once widened by ``window``, and their bbox
+  centres are within ``max_distance_km`` (events without a bbox pass).
+
+Hazard codes are grouped by their ``montandon.hazards`` category ("flood"),
+or else by their first three parts (``nat-geo-ear``), since sources code the
+same event differently.
+
+Comparing every pair is out of the question for 100k+ events per source, so
+candidate pairs come from blocking: events are bucketed by (hazard group,
+country), each bucket is sorted by start time, and an event is compared only
+with the events after it that start before its end plus ``window`` (a sorted
+neighbourhood, capped at ``max_neighbors``). Matching pairs are merged
+closest first with a union-find that keeps at most one event per collection
+in a cluster, so a busy flood season in one country does not chain into a
+single cluster.
+
+Usage::
+
+    table = EventTable()
+    for page in iter_pages("gdacs-events", datetime="2024-01-01T00:00:00Z/.."):
+        table.add_items(page.features)
+    clusters = cluster_events(table)
+
+Requires:
+    - numpy (pip install numpy)
+"""
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta, timezone
+import math
+
+import numpy as np
+
+from montandon.hazards import HAZARD_CATEGORIES
+from montandon.slicing import parse_datetime
+
+DEFAULT_WINDOW = timedelta(days=7)
+DEFAULT_MAX_DISTANCE_KM = 500.0
+DEFAULT_MAX_NEIGHBORS = 50
+EARTH_RADIUS_KM = 6371.0
+
+_CATEGORY_OF = {code: name for name, codes in HAZARD_CATEGORIES.items() for code in codes}
+
+# ``id`` is the (collection, id) of the canonical event, which is also the first of ``members``;
+# ``start``/``end`` span all members as aware UTC datetimes (None when no member has one)
+EventCluster = namedtuple("EventCluster", ["id", "members", "collections", "hazard_codes", "country_codes",
+                                           "start", "end"])
+
+
+def hazard_group(code):
+    """The blocking group of a hazard code: its category, else its first three parts."""
+    return _CATEGORY_OF.get(code) or "-".join(code.split("-")[:3])
+
+
+def _timestamp(dt):
+    return dt.timestamp() if dt else math.nan
+
+
+def _centre(bbox):
+    if bbox is None or len(bbox) not in (4, 6):
+        return math.nan, math.nan
+    west, south, east, north = (bbox[0], bbox[1], bbox[2], bbox[3]) if len(bbox) == 4 else \
+        (bbox[0], bbox[1], bbox[3], bbox[4])
+    if west > east:  # crosses the antimeridian
+        east += 360.0
+    lon = (west + east) / 2
+    return (lon - 360.0 if lon > 180.0 else lon), (south + north) / 2
+
+
+class EventTable:
+    """One small record per event, in columns; adding an event again keeps both copies."""
+
+    def __init__(self):
+        self.keys = []
+        self.hazard_codes = []
+        self.country_codes = []
+        self.corr_ids = []
+        self.starts = []  # POSIX seconds, NaN when unknown
+        self.ends = []
+        self.lons = []  # bbox centre, NaN without a bbox
+        self.lats = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, collection_id, item_id, hazard_codes=(), country_codes=(), start=None, end=None, bbox=None,
+            corr_id=None):
+        """Adds one event; ``start`` and ``end`` are aware datetimes (``end`` defaults to ``start``)."""
+        lon, lat = _centre(bbox)
+        self.keys.append((collection_id, item_id))
+        self.hazard_codes.append(tuple(hazard_codes or ()))
+        self.country_codes.append(tuple(country_codes or ()))
+        self.corr_ids.append(corr_id or None)
+        self.starts.append(_timestamp(start))
+        self.ends.append(_timestamp(end or start))
+        self.lons.append(lon)
+        self.lats.append(lat)
+
+    def add_items(self, features, collection_id=None):
+        """Adds STAC event items (``id``, ``bbox`` and ``properties`` are read)."""
+        for feature in features:
+            props = feature.get("properties") or {}
+            start = parse_datetime(props.get("start_datetime") or props.get("datetime"))
+            self.add(feature.get("collection") or collection_id, feature.get("id"),
+                     props.get("monty:hazard_codes"), props.get("monty:country_codes"),
+                     start, parse_datetime(props.get("end_datetime")), feature.get("bbox"),
+                     props.get("monty:corr_id"))
+
+    def add_frame(self, df):
+        """Adds rows of the local replica (``montandon.replica.read_replica``)."""
+        from montandon.validation import parse_datetime_column
+
+        starts = parse_datetime_column(df["start_datetime"].fillna(df["datetime"]))
+        ends = parse_datetime_column(df["end_datetime"])
+        ends = np.where(np.isnat(ends), starts, ends)
+        for collection_id, item_id, hazards, countries, bbox, corr_id in zip(
+                df["collection"], df["id"], df["monty:hazard_codes"], df["monty:country_codes"], df["bbox"],
+                df["monty:corr_id"]):
+            # Missing list values come back from Parquet as None
+            lon, lat = _centre(bbox)
+            self.keys.append((collection_id, item_id))
+            self.hazard_codes.append(tuple(hazards) if hazards is not None else ())
+            self.country_codes.append(tuple(countries) if countries is not None else ())
+            self.corr_ids.append(corr_id if isinstance(corr_id, str) and corr_id else None)
+            self.lons.append(lon)
+            self.lats.append(lat)
+        self.starts.extend(_seconds(starts))
+        self.ends.extend(_seconds(ends))
+
+
+def _seconds(values):
+    """``datetime64[s]`` -> POSIX seconds as floats, NaN for NaT."""
+    seconds = values.astype("int64").astype(float)
+    seconds[np.isnat(values)] = math.nan
+    return seconds.tolist()
+
+
+def _distance_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance (haversine); NaN when a centre is unknown."""
+    lon1, lat1, lon2, lat2 = (np.radians(v) for v in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def blocks(table):
+    """Row lists keyed by ``(hazard group, country)``; rows without a start time are left out."""
+    buckets = defaultdict(list)
+    for row, (hazards, countries, start) in enumerate(zip(table.hazard_codes, table.country_codes, table.starts)):
+        if start != start:  # NaN
+            continue
+        for group in {hazard_group(code) for code in hazards} or {None}:
+            for country in set(countries) or {None}:
+                buckets[(group, country)].append(row)
+    return buckets
+
+
+def candidate_pairs(table, window=DEFAULT_WINDOW, max_distance_km=DEFAULT_MAX_DISTANCE_KM,
+                    max_neighbors=DEFAULT_MAX_NEIGHBORS):
+    """
+    ``(rows_a, rows_b, cost)`` arrays of the matching pairs of events from
+    different collections found by blocking and a sorted neighbourhood.
+    ``cost`` (lower is closer) is the gap between the time spans in
+    windows plus the distance in ``max_distance_km``, 1 when unknown.
+    """
+    start = np.asarray(table.starts, dtype=float)
+    end = np.asarray(table.ends, dtype=float)
+    lon = np.asarray(table.lons, dtype=float)
+    lat = np.asarray(table.lats, dtype=float)
+    _, collection = np.unique(np.asarray([key[0] or "" for key in table.keys], dtype=object).astype(str),
+                              return_inverse=True)
+    window_s = window.total_seconds()
+    found_a, found_b, found_cost = [], [], []
+    for rows in blocks(table).values():
+        if len(rows) < 2:
+            continue
+        rows = np.asarray(rows)
+        if (collection[rows] == collection[rows[0]]).all():
+            continue
+        order = rows[np.argsort(start[rows], kind="stable")]
+        sorted_start = start[order]
+        # Every later event starting before this one ends (plus the window) overlaps it in time
+        reach = np.searchsorted(sorted_start, end[order] + window_s, side="right")
+        position = np.arange(len(order))
+        count = np.clip(np.minimum(reach, position + 1 + max_neighbors) - position - 1, 0, None)
+        total = int(count.sum())
+        if not total:
+            continue
+        a = np.repeat(position, count)
+        b = a + 1 + np.arange(total) - np.repeat(np.cumsum(count) - count, count)
+        a, b = order[a], order[b]
+        different = collection[a] != collection[b]
+        a, b = a[different], b[different]
+        distance = _distance_km(lon[a], lat[a], lon[b], lat[b])
+        near = np.isnan(distance) | (distance <= max_distance_km)
+        a, b, distance = a[near], b[near], distance[near]
+        gap = np.maximum(start[b] - end[a], 0.0) / window_s
+        found_a.append(a)
+        found_b.append(b)
+        found_cost.append(gap + np.where(np.isnan(distance), 1.0, distance / max_distance_km))
+    if not found_a:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    return np.concatenate(found_a), np.concatenate(found_b), np.concatenate(found_cost)
+
+
+def cluster_events(table, window=DEFAULT_WINDOW, max_distance_km=DEFAULT_MAX_DISTANCE_KM,
+                   max_neighbors=DEFAULT_MAX_NEIGHBORS, priority=None):
+    """
+    Groups the events of ``table`` into ``EventCluster``s, one per
+    real-world event, sorted by start. The canonical event of a cluster is
+    the member from the collection listed first in ``priority`` (collections
+    not listed come after, by name), then the earliest one.
+    """
+    n = len(table)
+    parent = list(range(n))
+    collection_ids = sorted({key[0] or "" for key in table.keys})
+    bit = {cid: 1 << i for i, cid in enumerate(collection_ids)}
+    # Collections in each root's cluster, as a bitmask
+    held = [bit[key[0] or ""] for key in table.keys]
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    def union(a, b, strict):
+        a, b = find(a), find(b)
+        if a == b or (strict and held[a] & held[b]):
+            return
+        parent[b] = a
+        held[a] |= held[b]
+
+    # Items sharing a correlation id are the same event by definition
+    by_corr_id = defaultdict(list)
+    for row, corr_id in enumerate(table.corr_ids):
+        if corr_id:
+            by_corr_id[corr_id].append(row)
+    for rows in by_corr_id.values():
+        for row in rows[1:]:
+            union(rows[0], row, strict=False)
+
+    rows_a, rows_b, cost = candidate_pairs(table, window, max_distance_km, max_neighbors)
+    for i in np.argsort(cost, kind="stable"):
+        union(int(rows_a[i]), int(rows_b[i]), strict=True)
+
+    groups = defaultdict(list)
+    for row in range(n):
+        groups[find(row)].append(row)
+    rank = {cid: i for i, cid in enumerate(priority or ())}
+
+    def canonical_order(row):
+        start = table.starts[row]
+        cid = table.keys[row][0] or ""
+        return rank.get(cid, len(rank)), cid if cid not in rank else "", math.inf if start != start else start, \
+            table.keys[row][1] or ""
+
+    clusters = []
+    for rows in groups.values():
+        rows.sort(key=canonical_order)
+        starts = [table.starts[r] for r in rows if table.starts[r] == table.starts[r]]
+        ends = [table.ends[r] for r in rows if table.ends[r] == table.ends[r]]
+        members = [table.keys[r] for r in rows]
+        clusters.append(EventCluster(
+            id=members[0],
+            members=members,
+            collections=sorted({key[0] for key in members if key[0]}),
+            hazard_codes=sorted({code for r in rows for code in table.hazard_codes[r]}),
+            country_codes=sorted({code for r in rows for code in table.country_codes[r]}),
+            start=datetime.fromtimestamp(min(starts), timezone.utc) if starts else None,
+            end=datetime.fromtimestamp(max(ends), timezone.utc) if ends else None,
+        ))
+    clusters.sort(key=lambda c: (c.start is None, c.start or datetime.min.replace(tzinfo=timezone.utc), c.id))
+    return clusters
@@ -0,0 +1,180 @@
+"""
+asyncio fetch engine for the Montandon STAC API.
+
+Runs many (collection, time-bin) tasks concurrently on a single event loop
+instead of one OS thread per task. All requests share one ``httpx.AsyncClient``
+so connections (HTTP/2 when ``h2`` is installed) are reused across tasks.
+
+Features:
+- Global limit on requests in flight and a separate limit per host.
+- Async page iteration that mirrors ``montandon.paginator.iter_pages``.
+- Retries, ``Retry-After``, circuit breaking and the retry budget of a shared
+  ``montandon.retry.RetryPolicy``; failures raise ``PageFetchError``.
+- Optional adaptive pacing by a ``montandon.ratelimit.RateLimiter``, which can
+  be shared with other scripts running at the same time.
+- Optional ``montandon.cache.PageCache`` for serving and revalidating pages from disk.
+- Optional field-selective page parsing (``montandon.parsing``) that drops
+  everything outside the requested ``fields``, e.g. geometries the server
+  sent anyway.
+
+Requires:
+    - httpx (pip install httpx)
+    - h2 for HTTP/2 support (pip install "httpx[http2]"), optional
+"""
+
+import asyncio
+import importlib.util
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from montandon.paginator import DEFAULT_PAGE_SIZE, Page, PageFetchError, build_params, items_url, next_link
+from montandon.parsing import PageParser
+from montandon.retry import DEFAULT_POLICY, RequestAttempts, parse_retry_after
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_PER_HOST = 16
+
+
+class FetchEngine:
+    """
+    Shared async HTTP client with bounded concurrency.
+
+    Use as an async context manager::
+
+        async with FetchEngine(max_concurrency=32, per_host=16) as engine:
+            async for page in engine.iter_pages("usgs-events", limit=250):
+                ...
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST, timeout=90,
+                 max_retries=None, http2=True, cache=None, parser=None, retry_policy=None, rate_limiter=None):
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_policy = retry_policy or DEFAULT_POLICY
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        # Parser backend for pages requested with ``fields`` ("auto" = ijson if installed, "ijson", "orjson",
+        # "json"); None decodes in full
+        self.parser = parser
+        # HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.client = None
+        self._global = None
+        self._hosts = {}
+
+    async def __aenter__(self):
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        self.client = httpx.AsyncClient(http2=self.http2, limits=limits, timeout=self.timeout)
+        self._global = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.client = None
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    async def get_json(self, url, params=None, page=1, max_retries=None, no_retry_statuses=(), label="",
+                       parser=None):
+        """
+        GETs ``url`` and decodes the JSON body, holding both a global and a
+        per-host slot while the request is in flight. Slots are released
+        while backing off so sleeping retries do not block other tasks.
+        A ``PageParser`` decodes the body instead of ``response.json()``.
+        """
+        cached = self.cache.get("GET", url, params) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            return cached.body
+        headers = self.cache.validators(cached) if cached else None
+        attempts = RequestAttempts(self.retry_policy, url, page, max_retries or self.max_retries,
+                                   no_retry_statuses, label)
+        for _ in attempts:
+            wait = attempts.circuit_wait()
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            status = None
+            retry_after = None
+            if self.rate_limiter:
+                # Wait for a token before taking a slot, so paced requests do not hold connections
+                await self.rate_limiter.acquire_async()
+            try:
+                async with self._global, self._host_slot(url):
+                    started = time.monotonic()
+                    try:
+                        response = await self.client.get(url, params=params, headers=headers)
+                    except httpx.TransportError:
+                        if self.rate_limiter:
+                            self.rate_limiter.record(None, time.monotonic() - started)
+                        raise
+                status = response.status_code
+                if self.rate_limiter:
+                    self.rate_limiter.record(status, time.monotonic() - started)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if status == 304 and cached:
+                    attempts.succeeded()
+                    return self.cache.refresh(cached, url, params)
+                response.raise_for_status()
+                data = parser.parse(response.content) if parser else response.json()
+            except (httpx.HTTPError, ValueError) as ex:
+                await asyncio.sleep(attempts.failed(ex, status, retry_after))
+                continue
+            attempts.succeeded()
+            if self.cache:
+                self.cache.put("GET", url, params, data=data, headers=response.headers)
+            return data
+
+    async def iter_pages(self, collection_id=None, url=None, limit=DEFAULT_PAGE_SIZE, fields=None, datetime=None,
+                         bbox=None, sortby=None, filter=None, params=None, max_retries=None,
+                         no_retry_statuses=(), resume_url=None):
+        """
+        Async counterpart of ``montandon.paginator.iter_pages``. ``resume_url``
+        continues an earlier scan from a saved ``next`` link, which already
+        carries the query; the other arguments then only select the parser.
+        """
+        if url is None:
+            url = items_url(collection_id)
+        query = build_params(limit, fields, datetime, bbox, sortby, filter, params)
+        parser = PageParser(fields, self.parser) if self.parser and fields else None
+        if resume_url:
+            url, query = resume_url, None
+        number = 0
+        while url:
+            number += 1
+            data = await self.get_json(url, query, number, max_retries, no_retry_statuses, collection_id or "",
+                                       parser)
+            following = next_link(data)
+            yield Page(number, url, data.get("features", []), following, data)
+            url = following
+            query = None
+
+    async def iter_features(self, collection_id=None, **kwargs):
+        """Yields features one by one across all pages."""
+        async for page in self.iter_pages(collection_id, **kwargs):
+            for feature in page.features:
+                yield feature
+
+
+async def run_all(tasks):
+    """
+    Runs a mapping of ``key -> coroutine`` concurrently and yields
+    ``(key, result, error)`` as each one finishes. The engine's semaphores bound
+    the requests in flight, so every task can be scheduled at once.
+    """
+    async def run_one(key, coroutine):
+        try:
+            return key, await coroutine, None
+        except Exception as ex:
+            return key, None, ex
+
+    for next_done in asyncio.as_completed([run_one(key, coro) for key, coro in tasks.items()]):
+        yield await next_done
@@ -0,0 +1,135 @@
+"""
+Oldest/newest valid item of a collection without walking pages.
+
+Some collections carry placeholder dates that sort before every real one:
+``desinventar-events`` stores unknown days as the 1st of the month and has
+records dated before the year 1100. Walking ``sortby=+datetime`` pages until
+a valid date turns up can mean thousands of records. ``find_extreme`` instead
+only ever asks for one item (``limit=1``) at a time:
+
+1. the year range of the collection's ``DatetimeRule`` (``montandon.validation``)
+   goes into the ``datetime`` parameter, so out-of-range years are never returned;
+2. an invalid first item is stepped over a few times with ``DatetimeRule.skip``,
+   which jumps past its whole day; the first valid item reached this way is
+   exact;
+3. if the junk keeps coming, the time axis is galloped with doubling steps
+   until a valid item shows up and then bisected between the junk and that
+   item. This assumes the invalid records are clustered before the valid ones;
+4. the answer is confirmed by one CQL2 query that excludes the rule's invalid
+   days between the first invalid item and the answer, when their number fits
+   in a request, so an earlier valid item hidden between the junk is still found.
+
+Each step is one small request, so a collection costs a handful of requests
+in the common case and a few dozen in the worst, instead of a full scan.
+
+Requires:
+    - httpx (pip install httpx)
+"""
+
+from montandon.counting import and_filters
+from montandon.probe import probe_first
+from montandon.slicing import format_datetime, item_datetime
+from montandon.validation import DAY, SECOND, rule_for, validator
+
+
+def exclude_days_filter(days):
+    """CQL2-JSON filter that leaves out every item dated on one of ``days``."""
+    def outside(day):
+        return {"op": "or", "args": [
+            {"op": "<", "args": [{"property": "datetime"}, format_datetime(day)]},
+            {"op": ">=", "args": [{"property": "datetime"}, format_datetime(day + DAY)]},
+        ]}
+    return and_filters(*[outside(day) for day in days])
+
+
+async def find_extreme(engine, collection_id, rule=None, oldest=True, is_valid=None, max_walk=8,
+                       max_excluded_days=12, filter=None, **query):
+    """
+    Returns ``(item or None, requests)``: the oldest (or newest) item of
+    ``collection_id`` whose ``properties.datetime`` passes ``is_valid`` (a
+    predicate on the datetime string), and how many requests it took. Both
+    default to the collection's entry in ``montandon.validation``. Other query
+    arguments are those of ``montandon.probe.probe_first``.
+    """
+    if rule is None:
+        rule = rule_for(collection_id)
+        is_valid = is_valid or validator(collection_id)
+    is_valid = is_valid or rule.compile()
+    requests = 0
+
+    def valid(item):
+        return is_valid(item.get("properties", {}).get("datetime"))
+
+    def time_of(item):
+        dt = item_datetime(item)
+        return dt.replace(microsecond=0) if dt else None
+
+    def past(item, at):
+        """Where to look after the invalid ``item`` found from ``at``; an undated item skips the day of ``at``."""
+        dt = time_of(item)
+        if dt is None:
+            day = at.replace(hour=0, minute=0, second=0, microsecond=0)
+            return day + DAY if oldest else day - SECOND
+        return rule.skip(dt, oldest)
+
+    def beyond(a, b):
+        """True if ``a`` lies past ``b`` in the search direction."""
+        return a > b if oldest else a < b
+
+    async def probe(near, far, extra_filter=None):
+        """The first item from ``near`` towards ``far`` (both inclusive)."""
+        nonlocal requests
+        requests += 1
+        start, end = (near, far) if oldest else (far, near)
+        return await probe_first(engine, collection_id, sortby="+datetime" if oldest else "-datetime",
+                                 datetime=f"{format_datetime(start)}/{format_datetime(end)}",
+                                 filter=and_filters(filter, extra_filter), **query)
+
+    start, end = rule.bounds()
+    near, far = (start, end) if oldest else (end, start)
+    item = await probe(near, far)
+    if item is None or valid(item):
+        return item, requests
+    # An undated first item gives no position to skip from, so the search goes on from ``near``
+    first_junk = time_of(item) or near
+
+    # Step over invalid days one at a time; exact, and enough when junk is sparse
+    lower = past(item, near)
+    for _ in range(max_walk):
+        item = await probe(lower, far)
+        if item is None or valid(item):
+            return item, requests
+        lower = past(item, lower)
+
+    # Gallop until a valid item (or the end) is reached, then bisect back towards the junk
+    best, upper = None, far
+    step, galloping = DAY if oldest else -DAY, True
+    while not beyond(lower, upper):
+        if galloping:
+            mid = lower + step if abs(step) < abs(upper - lower) else upper
+            step *= 2
+        else:
+            # Bisect on whole days: a bracket narrower than a day is settled by probing from its start
+            mid = lower + (upper - lower) / 2
+            mid = mid.replace(hour=0, minute=0, second=0, microsecond=0) if oldest else \
+                mid.replace(hour=23, minute=59, second=59, microsecond=0)
+            if not beyond(mid, lower):
+                mid = lower
+        item = await probe(mid, upper)
+        if item is None or valid(item):
+            best = item or best
+            upper = mid - SECOND if oldest else mid + SECOND
+            galloping = False
+        else:
+            lower = past(item, mid)
+
+    # Bisection skipped whatever lay between the junk items it saw; let the server check those days
+    if best is not None:
+        best_time = time_of(best)
+        days = rule.invalid_days(first_junk, best_time)
+        if days and len(days) <= max_excluded_days:
+            item = await probe(near, best_time - SECOND if oldest else best_time + SECOND,
+                               exclude_days_filter(days))
+            if item is not None and valid(item):
+                best = item
+    return best, requests
@@ -0,0 +1,344 @@
+"""
+Queryables-aware CQL2-JSON filter compiler.
+
+A mistyped property name or an operator the server does not know used to
+surface only after a crawl had paged for a while, or never: the server
+quietly ran the query as a full scan. ``compile_filter`` checks a filter
+against the collection's ``/queryables`` schema before anything is sent and
+rewrites it into forms the server can use an index for:
+
+- ``=`` on an array property, and the ``in`` form with the value first
+  (``{"op": "in", "args": ["event", {"property": "roles"}]}``), become
+  ``a_contains``; ``in`` on an array property with a list becomes ``a_overlaps``.
+  Only when the server supports the array operator; otherwise the original
+  expression is kept.
+- ``s_intersects`` of the geometry with a rectangle polygon or a bbox literal
+  at the top level becomes the ``bbox`` query parameter.
+- top-level parts using an operator outside the server's ``/conformance``
+  classes are left out of the request and evaluated on each returned item
+  instead (``montandon.cql2``). A temporal test of ``datetime`` against an
+  interval still narrows the request through the ``datetime`` parameter.
+
+Queryables and conformance are fetched once and cached on disk for
+``DEFAULT_TTL`` next to the collection catalog.
+
+Usage::
+
+    compiled = build_filter(cql2_filter, "usgs-events")
+    for page in iter_pages("usgs-events", **compiled.query_args()):
+        items = [item for item in page.features if compiled.matches(item)]
+
+Requires:
+    - requests (pip install requests)
+    - httpx (pip install httpx), for ``prepare_filter``
+"""
+
+from collections import namedtuple
+import difflib
+import json
+import os
+import time
+
+from montandon.cache import DEFAULT_CACHE_DIR
+from montandon.counting import and_filters
+from montandon.cql2 import ITEM_MEMBERS, SUPPORTED_OPS, TEMPORAL_OPS, matches, operators, property_names
+from montandon.paginator import STAC_API_URL, PageFetchError, fetch_page, get_session
+
+QUERYABLES_DIR = os.path.join(DEFAULT_CACHE_DIR, "queryables")
+DEFAULT_TTL = 24 * 3600  # seconds
+
+# Operators each CQL2 conformance class adds on top of and/or/not
+CONFORMANCE_OPS = {
+    "basic-cql2": {"=", "<>", "<", "<=", ">", ">=", "isNull"},
+    "advanced-comparison-operators": {"like", "between", "in"},
+    "case-insensitive-comparison": {"casei"},
+    "basic-spatial-functions": {"s_intersects"},
+    "spatial-functions": {"s_intersects", "s_equals", "s_disjoint", "s_touches", "s_within", "s_overlaps",
+                          "s_crosses", "s_contains"},
+    "temporal-functions": {"t_after", "t_before", "t_contains", "t_disjoint", "t_during", "t_equals",
+                           "t_finishedBy", "t_finishes", "t_intersects", "t_meets", "t_metBy", "t_overlappedBy",
+                           "t_overlaps", "t_startedBy", "t_starts"},
+    "array-functions": {"a_equals", "a_contains", "a_containedBy", "a_overlaps"},
+}
+COMPARISON_OPS = {"=", "<>", "<", "<=", ">", ">="}
+# Temporal tests that only pass items intersecting the literal interval
+NARROWING_TEMPORAL_OPS = TEMPORAL_OPS - {"t_after", "t_before", "t_disjoint"}
+
+
+class CompiledFilter(namedtuple("CompiledFilter", ["filter", "bbox", "datetime", "local", "notes"])):
+    """
+    The filter to send, the ``bbox`` and ``datetime`` parameters taken out of
+    it, the part the server cannot run (checked on each item by ``matches``)
+    and notes on what was changed.
+    """
+
+    def matches(self, item):
+        return matches(self.local, item)
+
+    def query_args(self):
+        """``filter``, ``bbox`` and ``datetime`` keyword arguments for ``iter_pages`` and friends."""
+        return {"filter": self.filter, "bbox": self.bbox, "datetime": self.datetime}
+
+
+class FilterError(ValueError):
+    """Raised for filters that reference unknown properties or compare them with the wrong type."""
+
+
+class Queryables:
+    """The ``/queryables`` JSON schema of a collection (or of the whole API)."""
+
+    def __init__(self, schema, collection_id=None):
+        self.schema = schema
+        self.collection_id = collection_id
+        self.properties = schema.get("properties", {})
+
+    def __contains__(self, name):
+        return name in self.properties or name in ITEM_MEMBERS or name == "datetime"
+
+    def kind(self, name):
+        """``array``, ``number``, ``string``, ``datetime``, ``geometry``, ``boolean`` or None if unknown."""
+        spec = self.properties.get(name, {})
+        if name == "geometry" or "geometry" in spec.get("$ref", "").lower():
+            return "geometry"
+        kind = spec.get("type")
+        if isinstance(kind, list):
+            kind = next((k for k in kind if k != "null"), None)
+        if kind == "string" and spec.get("format") in ("date-time", "date"):
+            return "datetime"
+        if kind == "integer":
+            return "number"
+        return kind
+
+    def suggest(self, name):
+        """The closest known property names to a mistyped one."""
+        return difflib.get_close_matches(name, list(self.properties), n=3)
+
+
+def server_operators(conformance):
+    """
+    The CQL2 operators a server declares in its ``/conformance`` document,
+    or None (everything assumed) when it is unknown.
+    """
+    classes = [uri.rstrip("/").rsplit("/", 1)[-1] for uri in (conformance or {}).get("conformsTo", [])
+               if "/cql2/" in uri]
+    if not classes:
+        return None
+    return {"and", "or", "not"}.union(*(CONFORMANCE_OPS.get(name, set()) for name in classes))
+
+
+def rectangle_bbox(geometry):
+    """``[west, south, east, north]`` if the GeoJSON geometry is an axis-aligned rectangle, else None."""
+    if not isinstance(geometry, dict):
+        return None
+    if "bbox" in geometry and "type" not in geometry:
+        return list(geometry["bbox"])
+    if geometry.get("type") != "Polygon" or len(geometry.get("coordinates", [])) != 1:
+        return None
+    ring = [tuple(point[:2]) for point in geometry["coordinates"][0]]
+    if len(ring) != 5 or ring[0] != ring[-1]:
+        return None
+    xs, ys = {x for x, _ in ring}, {y for _, y in ring}
+    if len(xs) != 2 or len(ys) != 2:
+        return None
+    # Every edge must run along one axis
+    if any(a[0] != b[0] and a[1] != b[1] for a, b in zip(ring, ring[1:])):
+        return None
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def check_filter(filter, queryables):
+    """
+    Raises ``FilterError`` if the filter references a property that is not
+    queryable or compares one with a literal of the wrong type.
+    """
+    for name in property_names(filter):
+        if name not in queryables:
+            hint = queryables.suggest(name)
+            raise FilterError(f"'{name}' is not queryable in {queryables.collection_id or 'the API'}"
+                              + (f"; did you mean {' or '.join(hint)}?" if hint else ""))
+    _check_types(filter, queryables)
+
+
+def _check_types(node, queryables):
+    if not isinstance(node, dict) or "op" not in node:
+        return
+    args = node.get("args", [])
+    if node["op"] in COMPARISON_OPS | {"between"}:
+        props = [arg["property"] for arg in args if isinstance(arg, dict) and "property" in arg]
+        literals = [arg for arg in args if not isinstance(arg, dict)]
+        for name in props:
+            kind = queryables.kind(name)
+            for literal in literals:
+                if kind == "number" and not isinstance(literal, (int, float)) or \
+                        kind in ("string", "datetime") and not isinstance(literal, str) or \
+                        kind == "boolean" and not isinstance(literal, bool):
+                    raise FilterError(f"'{name}' is a {kind} property but is compared with {literal!r}")
+    for arg in args:
+        _check_types(arg, queryables)
+
+
+def rewrite(node, queryables=None, supported_ops=None):
+    """
+    Returns the filter with array membership tests turned into
+    ``a_contains``/``a_overlaps``, where ``supported_ops`` (as in
+    ``compile_filter``) holds those operators.
+    """
+    if not isinstance(node, dict) or "op" not in node:
+        return node
+    op = node["op"]
+    args = [rewrite(arg, queryables, supported_ops) for arg in node.get("args", [])]
+    supported = SUPPORTED_OPS if supported_ops is None else supported_ops
+
+    def is_array(arg):
+        if not (isinstance(arg, dict) and "property" in arg):
+            return False
+        # Without a schema, only the reversed "in" form says the property is an array
+        return queryables is not None and queryables.kind(arg["property"]) == "array"
+
+    if op == "in" and len(args) == 2 and isinstance(args[1], dict) and "property" in args[1] \
+            and not isinstance(args[0], (list, dict)) and "a_contains" in supported:
+        # "value in array property", the reverse of CQL2's "property in list"
+        return {"op": "a_contains", "args": [args[1], [args[0]]]}
+    if op == "in" and len(args) == 2 and is_array(args[0]) and isinstance(args[1], list) \
+            and "a_overlaps" in supported:
+        return {"op": "a_overlaps", "args": args}
+    if op == "=" and len(args) == 2 and is_array(args[0]) and not isinstance(args[1], (list, dict)) \
+            and "a_contains" in supported:
+        return {"op": "a_contains", "args": [args[0], [args[1]]]}
+    return dict(node, args=args)
+
+
+def compile_filter(filter, queryables=None, supported_ops=None):
+    """
+    Checks ``filter`` against ``queryables`` (when given), rewrites it and
+    splits it into what goes to the server and what is checked locally.
+    ``supported_ops`` is the operator set of ``server_operators``; None
+    (conformance unknown) assumes the server runs every operator
+    ``montandon.cql2`` can evaluate (``SUPPORTED_OPS``).
+    """
+    if filter is None:
+        return CompiledFilter(None, None, None, None, [])
+    if queryables is not None:
+        check_filter(filter, queryables)
+    notes = []
+    rewritten = rewrite(filter, queryables, supported_ops)
+    if rewritten != filter:
+        notes.append("array membership tests rewritten to a_contains/a_overlaps")
+    parts = rewritten["args"] if rewritten.get("op") == "and" else [rewritten]
+    server, local, bbox, datetime = [], [], None, None
+    for part in parts:
+        args = part.get("args", [])
+        if bbox is None and part.get("op") == "s_intersects" and len(args) == 2 \
+                and args[0] == {"property": "geometry"} and rectangle_bbox(args[1]):
+            bbox = rectangle_bbox(args[1])
+            notes.append(f"s_intersects with a rectangle sent as bbox={','.join(str(v) for v in bbox)}")
+            continue
+        unsupported = operators(part) - (SUPPORTED_OPS if supported_ops is None else supported_ops)
+        if not unsupported:
+            server.append(part)
+            continue
+        local.append(part)
+        notes.append(f"{', '.join(sorted(unsupported))} not supported by the server; checked locally")
+        if datetime is None and part.get("op") in NARROWING_TEMPORAL_OPS and len(args) == 2 \
+                and args[0] == {"property": "datetime"} and isinstance(args[1], dict) and "interval" in args[1]:
+            # Every item passing the test intersects the interval, so the datetime parameter may narrow the scan
+            datetime = "/".join(args[1]["interval"])
+            notes.append(f"{part['op']} interval also sent as datetime={datetime}")
+    return CompiledFilter(and_filters(*server), bbox, datetime, and_filters(*local), notes)
+
+
+def queryables_url(collection_id=None, base_url=STAC_API_URL):
+    """The ``/queryables`` endpoint of a collection, or of the whole API."""
+    return f"{base_url}/collections/{collection_id}/queryables" if collection_id else f"{base_url}/queryables"
+
+
+def _cache_path(name, directory):
+    return os.path.join(directory, f"{name}.json")
+
+
+def _read_cached(name, directory, ttl, stale=False):
+    path = _cache_path(name, directory)
+    try:
+        if stale or time.time() - os.path.getmtime(path) < ttl:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _store(name, data, directory):
+    """Writes a cached document atomically (temp file + rename)."""
+    path = _cache_path(name, directory)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        print(f"Could not cache {name} in {directory}: {ex}")
+    return data
+
+
+def _fallback(name, directory, ex):
+    data = _read_cached(name, directory, None, stale=True)
+    print(f"Could not fetch {name} ({ex.cause}); "
+          + ("using the cached copy" if data is not None else "filters are sent unchecked"))
+    return data
+
+
+def _documents(collection_id, base_url):
+    """``(cache name, url)`` of the queryables and conformance documents."""
+    return [(f"queryables-{collection_id or 'all'}", queryables_url(collection_id, base_url)),
+            ("conformance", f"{base_url}/conformance")]
+
+
+def get_schema(collection_id=None, directory=QUERYABLES_DIR, ttl=DEFAULT_TTL, base_url=STAC_API_URL, session=None):
+    """
+    Blocking: the ``(Queryables or None, conformance or None)`` of a
+    collection, from the cache when fresh.
+    """
+    docs = []
+    for name, url in _documents(collection_id, base_url):
+        data = _read_cached(name, directory, ttl)
+        if data is None:
+            try:
+                data = _store(name, fetch_page(session or get_session(), url, None, 1, max_retries=2), directory)
+            except PageFetchError as ex:
+                data = _fallback(name, directory, ex)
+        docs.append(data)
+    schema, conformance = docs
+    return (Queryables(schema, collection_id) if schema else None), conformance
+
+
+async def load_schema(engine, collection_id=None, directory=QUERYABLES_DIR, ttl=DEFAULT_TTL, base_url=STAC_API_URL):
+    """Async counterpart of ``get_schema`` fetching through a ``FetchEngine``."""
+    docs = []
+    for name, url in _documents(collection_id, base_url):
+        data = _read_cached(name, directory, ttl)
+        if data is None:
+            try:
+                data = _store(name, await engine.get_json(url, max_retries=2), directory)
+            except PageFetchError as ex:
+                data = _fallback(name, directory, ex)
+        docs.append(data)
+    schema, conformance = docs
+    return (Queryables(schema, collection_id) if schema else None), conformance
+
+
+def get_queryables(collection_id=None, **kwargs):
+    """The cached ``Queryables`` of a collection (or of the API), None if unavailable."""
+    return get_schema(collection_id, **kwargs)[0]
+
+
+def build_filter(filter, collection_id=None, **kwargs):
+    """``compile_filter`` against the cached queryables and conformance of a collection (or of the API)."""
+    queryables, conformance = get_schema(collection_id, **kwargs)
+    return compile_filter(filter, queryables, server_operators(conformance))
+
+
+async def prepare_filter(engine, filter, collection_id=None, **kwargs):
+    """Async ``build_filter``."""
+    queryables, conformance = await load_schema(engine, collection_id, **kwargs)
+    return compile_filter(filter, queryables, server_operators(conformance))
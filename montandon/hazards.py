@@ -0,0 +1,71 @@
+"""
+Hazard taxonomy: category names to Montandon hazard codes.
+
+Scripts used to carry their own lists of flood or earthquake codes, download
+every item of a hazard collection and keep the items sharing a code with the
+list, testing list membership code by code. ``hazard_codes("flood")``
+expands a category name to its code set once, ``hazard_filter`` turns that
+set into a CQL2 ``a_overlaps`` on ``monty:hazard_codes`` so the server only
+returns the wanted items, and ``HazardMatcher`` tests items against the same
+set as a frozenset for whatever filtering is still done locally.
+
+Names accepted by ``hazard_codes``:
+- a category in ``HAZARD_CATEGORIES`` ("flood", "earthquake"),
+- a code prefix ending in ``*`` (e.g. ``"nat-hyd-flo-*"``), expanded against
+  the codes of the categories plus any ``known_codes`` given, such as a
+  collection's ``monty:hazard_codes`` summary,
+- anything else, taken as a hazard code.
+
+Usage::
+
+    matcher = HazardMatcher("flood")
+    for page in iter_pages("gdacs-hazards", filter=matcher.filter(), datetime="2024-01-01T00:00:00Z/.."):
+        floods = [item for item in page.features if matcher.matches(item)]
+"""
+
+HAZARD_CODES_PROPERTY = "monty:hazard_codes"
+
+HAZARD_CATEGORIES = {
+    # All Montandon flood hazard codes
+    "flood": frozenset({
+        "nat-hyd-flo-riv", "nat-hyd-flo-coa", "nat-hyd-flo-flo",
+        "nat-hyd-flo-ice", "nat-cli-glo-glo", "tec-mis-col-col", "nat-hyd-flo-fla",
+    }),
+    # All earthquake hazard codes
+    "earthquake": frozenset({"nat-geo-ear-gro"}),
+}
+
+
+def hazard_codes(*names, known_codes=()):
+    """The frozenset of hazard codes that the categories, prefixes and codes in ``names`` stand for."""
+    known = set(known_codes).union(*HAZARD_CATEGORIES.values())
+    codes = set()
+    for name in names:
+        if name in HAZARD_CATEGORIES:
+            codes |= HAZARD_CATEGORIES[name]
+        elif name.endswith("*"):
+            codes.update(code for code in known if code.startswith(name[:-1]))
+        else:
+            codes.add(name)
+    return frozenset(codes)
+
+
+def hazard_filter(codes):
+    """CQL2-JSON ``a_overlaps`` of ``monty:hazard_codes`` with ``codes``; None when there are none."""
+    if not codes:
+        return None
+    return {"op": "a_overlaps", "args": [{"property": HAZARD_CODES_PROPERTY}, sorted(codes)]}
+
+
+class HazardMatcher:
+    """Tests items for any of the hazard codes ``names`` expand to (see ``hazard_codes``)."""
+
+    def __init__(self, *names, known_codes=()):
+        self.codes = hazard_codes(*names, known_codes=known_codes)
+
+    def matches(self, item):
+        return not self.codes.isdisjoint(item.get("properties", {}).get(HAZARD_CODES_PROPERTY) or ())
+
+    def filter(self):
+        """The ``hazard_filter`` of the codes, to send with the query."""
+        return hazard_filter(self.codes)
@@ -0,0 +1,196 @@
+"""
+Joins events to their hazards and impacts.
+
+The items of one real-world event share a correlation id (``monty:corr_id``)
+across the ``*-events``, ``*-hazards`` and ``*-impacts`` collections, and may
+also point at each other with ``related`` links. Looking the related items
+up event by event costs a request (or a crawl) per event. ``LinkIndex``
+keeps local hash indexes instead:
+
+- ``(collection, id)`` -> item,
+- correlation id -> keys of the items carrying it,
+- key -> keys its ``related`` links point to, and back.
+
+``fetch_related`` fills the index in bulk: the correlation ids of the events
+go into one ``/search`` over all hazard and impact collections as a CQL2
+``in`` filter (an ``or`` of ``=`` on servers without ``in``, checked through
+``montandon.filters.build_filter``), ``batch_size`` ids per request, and
+items named only by ``related`` links are fetched by ``ids``, again in
+batches. A batch that fails is reported and skipped, so whatever was indexed
+can still be bundled. ``bundles`` then returns an ``EventBundle`` (event,
+hazards, impacts) per event.
+
+Usage::
+
+    index = LinkIndex()
+    sent, failed = fetch_related(index, events, catalog.ids(role="hazard") + catalog.ids(role="impact"))
+    for bundle in index.bundles(events):
+        print(bundle.event["id"], len(bundle.hazards), len(bundle.impacts))
+
+Requires:
+    - requests (pip install requests)
+"""
+
+from collections import defaultdict, namedtuple
+from urllib.parse import urlsplit
+
+from montandon.filters import FilterError, build_filter
+from montandon.paginator import PageFetchError
+from montandon.search import iter_search_pages
+
+DEFAULT_BATCH_SIZE = 50  # correlation ids or item ids per request; they go in the query string
+ROLES = ("event", "hazard", "impact")
+
+EventBundle = namedtuple("EventBundle", ["event", "hazards", "impacts"])
+
+
+def item_key(item, collection_id=None):
+    return item.get("collection") or collection_id, item.get("id")
+
+
+def item_role(item):
+    """``event``, ``hazard`` or ``impact`` from the item's roles, else from its collection id."""
+    roles = item.get("properties", {}).get("roles") or []
+    for role in ROLES:
+        if role in roles:
+            return role
+    suffix = (item.get("collection") or "").rsplit("-", 1)[-1].rstrip("s")
+    return suffix if suffix in ROLES else None
+
+
+def link_key(href):
+    """``(collection, id)`` of an ``.../collections/<collection>/items/<id>`` link, else None."""
+    parts = urlsplit(href or "").path.rstrip("/").split("/")
+    if len(parts) >= 4 and parts[-4] == "collections" and parts[-2] == "items":
+        return parts[-3], parts[-1]
+    return None
+
+
+class LinkIndex:
+    """Items keyed by ``(collection, id)``, with join indexes by correlation id and ``related`` link."""
+
+    def __init__(self):
+        self.items = {}
+        self.by_corr_id = defaultdict(set)
+        self.related = defaultdict(set)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def add(self, items, collection_id=None):
+        """Indexes items; an item added again replaces the earlier copy."""
+        for item in items:
+            key = item_key(item, collection_id)
+            self.items[key] = item
+            corr_id = item.get("properties", {}).get("monty:corr_id")
+            if corr_id:
+                self.by_corr_id[corr_id].add(key)
+            for link in item.get("links", []):
+                other = link_key(link.get("href")) if link.get("rel") == "related" else None
+                if other and other != key:
+                    self.related[key].add(other)
+                    self.related[other].add(key)
+
+    def linked(self, key):
+        """Keys of the indexed items sharing the correlation id of ``key`` or linked to it."""
+        item = self.items.get(key)
+        corr_id = item.get("properties", {}).get("monty:corr_id") if item else None
+        keys = (self.by_corr_id.get(corr_id, set()) if corr_id else set()) | self.related.get(key, set())
+        return sorted(k for k in keys if k != key and k in self.items)
+
+    def missing(self):
+        """Keys named by ``related`` links that are not indexed yet."""
+        return sorted({k for keys in self.related.values() for k in keys} - set(self.items))
+
+    def bundle(self, event, collection_id=None):
+        """The ``EventBundle`` of an event item (which is indexed if it was not)."""
+        key = item_key(event, collection_id)
+        if key not in self.items:
+            self.add([event], collection_id)
+        joined = {"hazard": [], "impact": []}
+        for other in self.linked(key):
+            role = item_role(self.items[other])
+            if role in joined:
+                joined[role].append(self.items[other])
+        return EventBundle(event, joined["hazard"], joined["impact"])
+
+    def bundles(self, events, collection_id=None):
+        return [self.bundle(event, collection_id) for event in events]
+
+
+def _batches(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def corr_id_filter(corr_ids):
+    """
+    The ``CompiledFilter`` selecting items with one of ``corr_ids``: an ``in``
+    filter, or an ``or`` of ``=`` tests when the server does not run ``in``.
+    """
+    prop = {"property": "monty:corr_id"}
+    compiled = build_filter({"op": "in", "args": [prop, list(corr_ids)]})
+    if compiled.local is not None:
+        compiled = build_filter({"op": "or", "args": [{"op": "=", "args": [prop, cid]} for cid in corr_ids]})
+    return compiled
+
+
+def _fetch_batch(index, pages, compiled=None, collection_id=None):
+    """Indexes the pages of one request; returns how many were fetched."""
+    sent = 0
+    for page in pages:
+        sent += 1
+        index.add([item for item in page.features if compiled is None or compiled.matches(item)], collection_id)
+    return sent
+
+
+def fetch_related(index, events, collections, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    """
+    Indexes ``events`` and fetches the items of ``collections`` that share
+    their correlation ids, then any items their ``related`` links name that
+    are still missing. Accepts the remaining arguments of
+    ``montandon.search.iter_search_pages``.
+
+    Returns ``(requests sent, failed)``; ``failed`` lists a
+    ``(batch, PageFetchError)`` for each batch that could not be fetched in
+    full. The other batches are indexed regardless.
+    """
+    index.add(events)
+    params = kwargs.pop("params", None) or {}
+    sent = 0
+    failed = []
+    corr_ids = sorted({e.get("properties", {}).get("monty:corr_id") for e in events} - {None, ""})
+    if collections:
+        for batch in _batches(corr_ids, batch_size):
+            try:
+                compiled = corr_id_filter(batch)
+            except FilterError as ex:
+                print(f"Correlation id filter: {ex}; sent unchecked")
+                compiled = None
+            # CompiledFilter is a namedtuple and always truthy; a filter left entirely to local
+            # checks would page the whole collections, so the explicit "in" is sent instead
+            if compiled is not None and compiled.filter is not None:
+                batch_filter = compiled.filter
+            else:
+                batch_filter = {"op": "in", "args": [{"property": "monty:corr_id"}, batch]}
+            try:
+                sent += _fetch_batch(index, iter_search_pages(collections, filter=batch_filter, params=params,
+                                                              **kwargs), compiled)
+            except PageFetchError as ex:
+                print(f"  Could not fetch the items of {len(batch)} correlation ids ({ex}); skipped")
+                failed.append((batch, ex))
+    by_collection = defaultdict(list)
+    for collection, item_id in index.missing():
+        by_collection[collection].append(item_id)
+    for collection, ids in sorted(by_collection.items()):
+        for batch in _batches(ids, batch_size):
+            try:
+                sent += _fetch_batch(index, iter_search_pages([collection], params=dict(params, ids=",".join(batch)),
+                                                              **kwargs), collection_id=collection)
+            except PageFetchError as ex:
+                print(f"  Could not fetch {len(batch)} linked items of {collection} ({ex}); skipped")
+                failed.append((batch, ex))
+    return sent, failed
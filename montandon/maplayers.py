@@ -0,0 +1,265 @@
+"""
+Per-zoom map layers of item footprints.
+
+Passing the raw STAC MultiPolygons to ``folium.GeoJson`` embeds every
+coordinate of every footprint in the HTML at full double precision, so a
+year of floods makes a map of megabytes that the browser parses before it
+draws anything. ``build_layers`` prepares one small GeoJSON layer per zoom
+level instead:
+
+- each geometry is simplified with a tolerance of one screen pixel at that
+  zoom (``preserve_topology=True``, so polygons stay valid and keep their
+  holes),
+- coordinates are snapped to a decimal grid of at most a quarter pixel and
+  written with only the decimals the grid needs,
+- footprints that collapse on the grid are kept as a single point, so small
+  events stay visible when zoomed out.
+
+Simplified geometries are cached on disk per item, keyed by collection and
+id and checked against the item's ``updated`` timestamp, so rebuilding a map
+after a sync only simplifies the items that changed.
+
+``write_layers`` writes the layers as ``z<zoom>.geojson`` and as
+``z<zoom>.js`` (the same data wrapped in a function call, which a browser
+also loads from ``file://``). ``add_zoom_layers`` adds a script to a folium
+map that loads the layer for the current zoom the first time it is needed,
+so the page opens with only the coarsest layer; small maps can embed the
+layers instead.
+
+Usage::
+
+    layers = build_layers(all_floods, properties=["title"])
+    save_map(layers, "flood_map.html", location=[20, 0], zoom_start=2, tooltip="title")
+
+Requires:
+    - shapely (pip install shapely)
+    - folium, for ``add_zoom_layers`` and ``save_map`` (pip install folium)
+"""
+
+import hashlib
+import json
+import math
+import os
+
+import shapely
+
+from montandon.cache import DEFAULT_CACHE_DIR
+
+LAYERS_DIR = os.path.join(DEFAULT_CACHE_DIR, "layers")
+# Each layer is shown from its zoom up to the next one
+DEFAULT_ZOOMS = (2, 4, 6, 8)
+TILE_SIZE = 256  # pixels
+GRID_PIXELS = 0.25  # largest coordinate grid, in pixels of the layer's zoom
+
+
+def pixel_size(zoom):
+    """Degrees of longitude per screen pixel at ``zoom`` (Web Mercator tiles)."""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def grid_decimals(zoom):
+    """Decimals kept in the coordinates of the ``zoom`` layer."""
+    return max(0, math.ceil(-math.log10(pixel_size(zoom) * GRID_PIXELS)))
+
+
+def simplify(geometry, zoom):
+    """A shapely ``geometry`` simplified and quantized for display at ``zoom``."""
+    grid = 10.0 ** -grid_decimals(zoom)
+    shape = shapely.set_precision(shapely.simplify(geometry, pixel_size(zoom), preserve_topology=True), grid)
+    if shape.is_empty:
+        shape = shapely.set_precision(shapely.point_on_surface(geometry), grid)
+    return shape
+
+
+def simplify_geometry(geometry, zooms=DEFAULT_ZOOMS):
+    """``{zoom: GeoJSON geometry}`` for a GeoJSON geometry, None if it is empty or invalid."""
+    shape = shapely.from_geojson(json.dumps(geometry), on_invalid="ignore") if geometry else None
+    if shape is None or shape.is_empty:
+        return None
+    geometries = {}
+    # Finest zoom first; each coarser level simplifies the previous one, which has far fewer vertices
+    for zoom in sorted(zooms, reverse=True):
+        shape = simplify(shape, zoom)
+        geometries[zoom] = json.loads(shapely.to_geojson(shape))
+    return geometries
+
+
+class LayerCache:
+    """Simplified geometries on disk, one JSON file per item."""
+
+    def __init__(self, directory=LAYERS_DIR):
+        self.directory = directory
+
+    def _path(self, key):
+        digest = hashlib.sha256("/".join(str(part) for part in key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, key, updated):
+        """
+        The cached ``{zoom: geometry}`` of ``(collection, id)``, or None if
+        there is none or it was made from another ``updated`` version.
+        """
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                doc = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if doc.get("updated") != updated:
+            return None
+        return {int(zoom): geometry for zoom, geometry in doc["zooms"].items()}
+
+    def put(self, key, updated, zooms):
+        """Writes an entry atomically (temp file + rename)."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"updated": updated, "zooms": zooms}, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            print(f"Could not cache layers of {key[1]} in {self.directory}: {ex}")
+
+
+def build_layers(features, zooms=DEFAULT_ZOOMS, properties=("title",), style=None, cache=None, collection_id=None):
+    """
+    ``{zoom: FeatureCollection}`` of STAC items simplified per zoom. Only
+    the ``properties`` listed are kept; ``style(feature)``, if given, is
+    stored as the ``style`` property that ``add_zoom_layers`` draws with.
+    ``cache`` defaults to a ``LayerCache`` in ``LAYERS_DIR``; pass False to
+    always simplify.
+    """
+    if cache is None:
+        cache = LayerCache()
+    layers = {zoom: [] for zoom in zooms}
+    hits = 0
+    for feature in features:
+        key = (feature.get("collection") or collection_id, feature.get("id"))
+        updated = feature.get("properties", {}).get("updated")
+        geometries = cache.get(key, updated) if cache else None
+        if geometries is not None and all(zoom in geometries for zoom in zooms):
+            hits += 1
+        else:
+            geometries = simplify_geometry(feature.get("geometry"), zooms)
+            if geometries is None:
+                continue
+            if cache:
+                cache.put(key, updated, geometries)
+        props = {name: feature.get("properties", {}).get(name) for name in properties}
+        if style is not None:
+            props["style"] = style(feature)
+        for zoom in zooms:
+            layers[zoom].append({"type": "Feature", "id": key[1], "collection": key[0],
+                                 "geometry": geometries[zoom], "properties": props})
+    if cache:
+        print(f"Map layers: {hits} items from the layer cache, {len(layers[zooms[0]]) - hits} simplified")
+    return {zoom: {"type": "FeatureCollection", "features": layers[zoom]} for zoom in zooms}
+
+
+def write_layers(layers, directory):
+    """
+    Writes ``z<zoom>.geojson`` and ``z<zoom>.js`` for each layer; returns
+    ``{zoom: bytes of the .geojson}``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sizes = {}
+    for zoom, layer in layers.items():
+        text = json.dumps(layer, separators=(",", ":"))
+        for name, content in ((f"z{zoom}.geojson", text), (f"z{zoom}.js", f"montandonLayer({zoom},{text});\n")):
+            path = os.path.join(directory, name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        sizes[zoom] = len(text.encode("utf-8"))
+    return sizes
+
+
+# Leaflet side of add_zoom_layers: load z<zoom>.js on demand and swap layers on zoomend
+_LOADER_JS = """
+(function() {
+    var map = %(map)s;
+    var zooms = %(zooms)s;
+    var base = %(base)s;
+    var embedded = %(embedded)s;
+    var tooltip = %(tooltip)s;
+    var layers = {};
+    var current = null;
+    function pick() {
+        var zoom = zooms[0];
+        zooms.forEach(function(z) { if (z <= map.getZoom()) { zoom = z; } });
+        return zoom;
+    }
+    function show(zoom) {
+        if (zoom !== pick() || layers[zoom] === current) { return; }
+        if (current) { map.removeLayer(current); }
+        current = layers[zoom].addTo(map);
+    }
+    function loaded(zoom, data) {
+        layers[zoom] = L.geoJSON(data, {
+            style: function(feature) { return feature.properties.style || {color: "red", weight: 1}; },
+            pointToLayer: function(feature, latlng) { return L.circleMarker(latlng, {radius: 3}); },
+            onEachFeature: function(feature, layer) {
+                if (tooltip && feature.properties[tooltip] != null) { layer.bindTooltip(String(feature.properties[tooltip])); }
+            }
+        });
+        show(zoom);
+    }
+    window.montandonLayer = loaded;
+    function update() {
+        var zoom = pick();
+        if (layers[zoom] === undefined && embedded) {
+            loaded(zoom, embedded[zoom]);
+        } else if (layers[zoom] === undefined) {
+            layers[zoom] = null;
+            var script = document.createElement("script");
+            script.src = base + "z" + zoom + ".js";
+            document.head.appendChild(script);
+        } else if (layers[zoom] !== null) {
+            show(zoom);
+        }
+    }
+    map.on("zoomend", update);
+    update();
+})();
+"""
+
+
+def add_zoom_layers(m, layers, base_url=None, tooltip=None):
+    """
+    Adds ``layers`` (from ``build_layers``) to the folium map ``m``, showing
+    the one for the current zoom. With a ``base_url``, the layers are loaded
+    from the ``z<zoom>.js`` files ``write_layers`` wrote there (relative to the
+    saved HTML, e.g. ``"flood_map_layers/"``); without one they are embedded
+    in the page, which suits small maps shown inline in a notebook.
+    """
+    import folium
+    from jinja2 import Template
+
+    # A child of the map renders its script after the map's own, once the map variable exists
+    loader = folium.MacroElement()
+    loader._name = "ZoomLayers"
+    embedded = None if base_url else layers
+    loader.code = _LOADER_JS % {"map": m.get_name(), "zooms": json.dumps(sorted(layers)),
+                                "base": json.dumps(base_url), "tooltip": json.dumps(tooltip),
+                                "embedded": json.dumps(embedded, separators=(",", ":"))}
+    loader._template = Template("{% macro script(this, kwargs) %}{{ this.code }}{% endmacro %}")
+    m.add_child(loader)
+    return m
+
+
+def save_map(layers, path, location=(20.0, 0.0), zoom_start=2, tooltip=None):
+    """
+    Writes a folium map to ``path`` that loads ``layers`` per zoom from a
+    ``<name>_layers`` directory next to it.
+    """
+    import folium
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    directory = os.path.join(os.path.dirname(os.path.abspath(path)), f"{stem}_layers")
+    sizes = write_layers(layers, directory)
+    m = folium.Map(location=list(location), zoom_start=zoom_start)
+    add_zoom_layers(m, layers, f"{stem}_layers/", tooltip=tooltip)
+    m.save(path)
+    print(f"Saved {path}; layers " + ", ".join(f"z{zoom} {size / 1024:.0f} KiB" for zoom, size in sorted(sizes.items())))
+    return m
@@ -0,0 +1,178 @@
+"""
+Shared streaming paginator for the Montandon STAC API.
+
+Follows the standard STAC ``rel=next`` links and yields one page at a time, so
+callers only ever hold a single page of features in memory instead of
+collecting the whole collection into a list.
+
+Features:
+- One pooled ``requests.Session`` per thread, reused across every call.
+- Page size, field projection, datetime, bbox, sortby and CQL2 filter parameters.
+- Per-page retries under the shared ``montandon.retry.RetryPolicy``; a failed
+  page raises ``PageFetchError`` carrying the URL and page number for error logs.
+- Optional adaptive pacing by a ``montandon.ratelimit.RateLimiter`` shared
+  across threads and processes.
+- Optional ``montandon.cache.PageCache`` for serving and revalidating pages from disk.
+- Optional field-selective page parsing (``montandon.parsing``) that keeps only
+  the requested ``fields`` of each feature.
+
+Requires:
+    - requests (pip install requests)
+"""
+
+from collections import namedtuple
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from montandon.parsing import PageParser
+from montandon.retry import DEFAULT_POLICY, PageFetchError, RequestAttempts, parse_retry_after
+
+STAC_API_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
+DEFAULT_PAGE_SIZE = 250
+POOL_SIZE = 20
+
+# One page of results: its 1-based number, the URL it came from, the features
+# on it, and the URL of the following page (None on the last page). Sliced
+# scans (``montandon.slicing``) also set the index of the page's window.
+Page = namedtuple("Page", ["number", "url", "features", "next_url", "data", "window"], defaults=(None,))
+
+_local = threading.local()
+
+
+def get_session():
+    """
+    Returns the pooled session for the current thread, creating it on first use.
+    ``requests.Session`` is not thread-safe, so each worker thread gets its own
+    session and keeps reusing its connections for every page it fetches.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+def items_url(collection_id, base_url=STAC_API_URL):
+    """Returns the ``/items`` endpoint of a collection."""
+    return f"{base_url}/collections/{collection_id}/items"
+
+
+def build_params(limit=DEFAULT_PAGE_SIZE, fields=None, datetime=None, bbox=None,
+                 sortby=None, filter=None, extra=None):
+    """
+    Builds STAC item-search query parameters, leaving out anything unset.
+    ``fields`` and ``bbox`` may be given as lists; ``filter`` as a CQL2-JSON dict.
+    """
+    params = {}
+    if limit is not None:
+        params["limit"] = limit
+    if fields:
+        params["fields"] = fields if isinstance(fields, str) else ",".join(fields)
+    if datetime:
+        params["datetime"] = datetime
+    if bbox:
+        params["bbox"] = bbox if isinstance(bbox, str) else ",".join(str(v) for v in bbox)
+    if sortby:
+        params["sortby"] = sortby
+    if filter:
+        params["filter"] = filter if isinstance(filter, str) else json.dumps(filter)
+        params["filter-lang"] = "cql2-json"
+    if extra:
+        params.update(extra)
+    return params
+
+
+def next_link(data):
+    """Returns the href of the ``rel=next`` link in a STAC response, if any."""
+    return next((l.get("href") for l in data.get("links", []) if l.get("rel") == "next"), None)
+
+
+def fetch_page(session, url, params, page, timeout=60, max_retries=None, no_retry_statuses=(), label="",
+               cache=None, parser=None, retry_policy=None, rate_limiter=None):
+    """
+    Fetches and decodes one page, retrying transient failures as the retry
+    policy (default: the shared ``DEFAULT_POLICY``) allows. Statuses listed in
+    ``no_retry_statuses`` fail immediately. With a ``cache``, fresh pages come
+    from disk and stale ones are revalidated. A ``PageParser`` decodes the
+    body instead of ``response.json()``. A ``rate_limiter`` paces the
+    requests and is told how each one went.
+    """
+    cached = cache.get("GET", url, params) if cache else None
+    if cached and cache.is_fresh(cached):
+        return cached.body
+    headers = cache.validators(cached) if cached else None
+    attempts = RequestAttempts(retry_policy or DEFAULT_POLICY, url, page, max_retries, no_retry_statuses, label)
+    for _ in attempts:
+        wait = attempts.circuit_wait()
+        if wait:
+            time.sleep(wait)
+            continue
+        status = None
+        retry_after = None
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            started = time.monotonic()
+            try:
+                response = session.get(url, params=params, timeout=timeout, headers=headers)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if rate_limiter:
+                    rate_limiter.record(None, time.monotonic() - started)
+                raise
+            status = response.status_code
+            if rate_limiter:
+                rate_limiter.record(status, time.monotonic() - started)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if status == 304 and cached:
+                attempts.succeeded()
+                return cache.refresh(cached, url, params)
+            response.raise_for_status()
+            data = parser.parse(response.content) if parser else response.json()
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            time.sleep(attempts.failed(ex, status, retry_after))
+            continue
+        attempts.succeeded()
+        if cache:
+            cache.put("GET", url, params, data=data, headers=response.headers)
+        return data
+
+
+def iter_pages(collection_id=None, url=None, limit=DEFAULT_PAGE_SIZE, fields=None, datetime=None,
+               bbox=None, sortby=None, filter=None, params=None, session=None, timeout=60,
+               max_retries=None, no_retry_statuses=(), cache=None, parser=None, retry_policy=None,
+               rate_limiter=None):
+    """
+    Yields every page of a collection (or of an explicit ``url``) as a ``Page``.
+
+    The query parameters are only sent with the first request; the ``next``
+    links returned by the API already carry them together with the page token.
+    ``parser`` names a ``montandon.parsing`` backend used to drop everything
+    outside ``fields`` while decoding.
+    """
+    if url is None:
+        url = items_url(collection_id)
+    session = session or get_session()
+    query = build_params(limit, fields, datetime, bbox, sortby, filter, params)
+    page_parser = PageParser(fields, parser) if parser and fields else None
+    number = 0
+    while url:
+        number += 1
+        data = fetch_page(session, url, query, number, timeout, max_retries,
+                          no_retry_statuses, collection_id or "", cache, page_parser, retry_policy, rate_limiter)
+        following = next_link(data)
+        yield Page(number, url, data.get("features", []), following, data)
+        url = following
+        query = None
+
+
+def iter_features(collection_id=None, **kwargs):
+    """Yields features one by one across all pages; accepts the same arguments as ``iter_pages``."""
+    for page in iter_pages(collection_id, **kwargs):
+        yield from page.features
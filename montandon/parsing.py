@@ -0,0 +1,184 @@
+"""
+Field-selective JSON page parsing for Montandon item pages.
+
+The server does not always honour the ``fields`` projection, so a page asked
+for ``properties.monty:country_codes`` can still arrive with full MultiPolygon
+geometries and assets. ``PageParser`` decodes a page body but only keeps the
+requested paths of each feature; everything outside ``features`` (links,
+``numberMatched``, ...) is kept as is.
+
+Backends:
+- ``ijson``: streams parse events and never builds lists or dicts for
+  skipped subtrees such as geometry coordinates; lowest peak memory.
+- ``orjson``: decodes the whole page with orjson, then projects it; fastest.
+- ``json``: the standard library decoder, then projects it; always available.
+
+``"auto"`` picks the first installed of ijson, orjson and json: skipping
+geometries without decoding them is the point of the parser, so orjson's
+speed (it still decodes the whole page) is an explicit opt-in.
+
+Requires:
+    - ijson (pip install ijson), optional
+    - orjson (pip install orjson), optional
+"""
+
+import importlib.util
+import json
+
+BACKENDS = ("ijson", "orjson", "json")
+
+# A selection tree: True keeps a whole value, None drops it, and a dict maps
+# object keys to sub-selections ("*" for keys not listed). Arrays are
+# transparent: their selection applies to every element.
+KEEP = True
+ALL_KEYS = "*"
+
+
+def available_backends():
+    """Installed backends in order of preference."""
+    return [name for name in BACKENDS if name == "json" or importlib.util.find_spec(name) is not None]
+
+
+def parse_fields(fields):
+    """
+    Turns a STAC ``fields`` value (``"id,properties.datetime,-geometry"`` or a
+    list) into a per-feature selection tree. Returns KEEP when nothing is
+    selected.
+    """
+    if not fields:
+        return KEEP
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    include = [f.strip() for f in fields if f.strip() and not f.strip().startswith("-")]
+    exclude = [f.strip()[1:] for f in fields if f.strip().startswith("-")]
+    selection = {} if include else {ALL_KEYS: KEEP}
+    for path, value in [(p, KEEP) for p in include] + [(p, None) for p in exclude]:
+        node = selection
+        keys = path.split(".")
+        for key in keys[:-1]:
+            child = node.get(key, node.get(ALL_KEYS))
+            if child is None and value is None:
+                break  # excluding from a value that is not selected anyway
+            if not isinstance(child, dict):
+                child = node[key] = {ALL_KEYS: child} if child is KEEP else {}
+            node = child
+        else:
+            if value is None or not isinstance(node.get(keys[-1]), dict):
+                node[keys[-1]] = value
+    return selection
+
+
+def _child(selection, key):
+    if not isinstance(selection, dict):
+        return selection
+    return selection.get(key, selection.get(ALL_KEYS))
+
+
+def project(value, selection):
+    """Returns the parts of a decoded value that ``selection`` keeps."""
+    if selection is KEEP:
+        return value
+    if isinstance(value, list):
+        return [project(item, selection) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        sub = _child(selection, key)
+        if sub is not None:
+            result[key] = project(item, sub)
+    return result
+
+
+def _page_selection(feature_selection):
+    return {"features": feature_selection, ALL_KEYS: KEEP}
+
+
+def _parse_json(body, selection):
+    return project(json.loads(body), selection)
+
+
+def _parse_orjson(body, selection):
+    import orjson
+
+    return project(orjson.loads(body), selection)
+
+
+def _parse_ijson(body, selection):
+    """
+    Builds the selected parts of the document straight from ijson events.
+    Skipped containers are only tracked by depth, never materialized.
+    """
+    import ijson
+
+    try:
+        return _build_ijson(ijson.basic_parse(body, use_float=True), selection)
+    except ijson.JSONError as ex:
+        # Surface malformed bodies like the other decoders do, so callers retry them
+        raise ValueError(f"Invalid JSON page: {ex}") from ex
+
+
+def _build_ijson(events, selection):
+    root = []
+    # Each frame: [container, selection of its children, pending map key]
+    stack = [[root, selection, None]]
+    skip_depth = 0
+    for event, value in events:
+        if skip_depth:
+            if event in ("start_map", "start_array"):
+                skip_depth += 1
+            elif event in ("end_map", "end_array"):
+                skip_depth -= 1
+            continue
+        frame = stack[-1]
+        if event == "map_key":
+            frame[2] = value
+            continue
+        container, parent_selection, key = frame
+        sub = _child(parent_selection, key) if isinstance(container, dict) else parent_selection
+        if event in ("end_map", "end_array"):
+            stack.pop()
+            continue
+        if sub is None:
+            if event in ("start_map", "start_array"):
+                skip_depth = 1
+            continue
+        if event == "start_map":
+            item = {}
+        elif event == "start_array":
+            item = []
+        else:
+            item = value
+        if isinstance(container, dict):
+            container[key] = item
+        else:
+            container.append(item)
+        if event in ("start_map", "start_array"):
+            # Arrays are transparent: their elements share the array's selection
+            stack.append([item, sub, None])
+    return root[0] if root else None
+
+
+_PARSERS = {"json": _parse_json, "orjson": _parse_orjson, "ijson": _parse_ijson}
+
+
+class PageParser:
+    """
+    Decodes item pages keeping only the requested feature fields::
+
+        parser = PageParser("properties.monty:country_codes", backend="ijson")
+        page = parser.parse(response.content)
+    """
+
+    def __init__(self, fields=None, backend="auto"):
+        if backend == "auto":
+            backend = available_backends()[0]
+        if backend not in _PARSERS:
+            raise ValueError(f"Unknown parser backend {backend!r}; choose from {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.selection = _page_selection(parse_fields(fields))
+        self._parse = _PARSERS[backend]
+
+    def parse(self, body):
+        """Decodes a page body (bytes or str) into a dict with projected features."""
+        return self._parse(body, self.selection)
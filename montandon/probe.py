@@ -0,0 +1,125 @@
+"""
+Parallel first-record probe across collections.
+
+A freshness check only needs the newest (or oldest) item of each collection.
+Asking for it one collection at a time costs one round trip per collection;
+``probe_collections`` sends one ``limit=1`` sorted request per collection, all
+at once on a ``FetchEngine``, and yields each answer as soon as it arrives.
+Only the first page is ever requested, so no ``next`` link is followed, and
+requests still outstanding at the ``deadline`` (or when the caller stops
+iterating) are cancelled rather than left running.
+
+``write_probe_results`` rewrites the output JSON atomically after every
+answer, so the file is usable while the probe is still running.
+
+Usage::
+
+    async with FetchEngine(max_concurrency=32, per_host=32) as engine:
+        async for collection_id, record, error in probe_collections(engine, collections, deadline=20):
+            ...
+
+Requires:
+    - httpx (pip install httpx)
+"""
+
+import asyncio
+import json
+import os
+
+from montandon.paginator import build_params, items_url
+from montandon.parsing import PageParser
+
+FOUND = "found"
+EMPTY = "empty"
+PENDING = "pending"
+TIMED_OUT = "timed out"
+
+
+class ProbeTimeout(Exception):
+    """Set as the error of a collection whose probe was cancelled at the deadline."""
+
+    def __init__(self, collection_id, deadline):
+        super().__init__(f"No answer from {collection_id} within {deadline}s")
+        self.collection_id = collection_id
+        self.deadline = deadline
+
+
+async def probe_first(engine, collection_id, sortby="-datetime", fields=None, datetime=None, bbox=None,
+                      filter=None, params=None, max_retries=None):
+    """
+    Returns the first item of ``collection_id`` in ``sortby`` order (newest by
+    default), or None when nothing matches. Sends a single ``limit=1`` request.
+    """
+    query = build_params(1, fields, datetime, bbox, sortby, filter, params)
+    parser = PageParser(fields, engine.parser) if engine.parser and fields else None
+    data = await engine.get_json(items_url(collection_id), query, 1, max_retries, label=collection_id, parser=parser)
+    features = data.get("features", [])
+    return features[0] if features else None
+
+
+async def probe_collections(engine, collections, deadline=None, **query):
+    """
+    Probes every collection concurrently and yields ``(collection_id, record,
+    error)`` in the order the answers arrive. Accepts the arguments of
+    ``probe_first``. Collections still pending after ``deadline`` seconds are
+    cancelled and yielded with a ``ProbeTimeout`` error.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = {asyncio.ensure_future(probe_first(engine, collection_id, **query)): collection_id
+             for collection_id in collections}
+    stop_at = loop.time() + deadline if deadline is not None else None
+    pending = set(tasks)
+    try:
+        while pending:
+            timeout = max(0.0, stop_at - loop.time()) if stop_at is not None else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                error = task.exception()
+                yield tasks[task], None if error else task.result(), error
+        for task in pending:
+            task.cancel()
+        for task in pending:
+            yield tasks[task], None, ProbeTimeout(tasks[task], deadline)
+    finally:
+        # Also reached when the caller stops iterating early
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def probe_status(record, error):
+    """Short status for the output file: found, empty, timed out or failed: <reason>."""
+    if isinstance(error, ProbeTimeout):
+        return TIMED_OUT
+    if getattr(error, "status", None):
+        return f"failed: HTTP {error.status}"
+    if error is not None:
+        return f"failed: {error}"
+    return FOUND if record is not None else EMPTY
+
+
+def write_probe_results(path, collections, results, skipped=None):
+    """
+    Atomically writes ``[{"collection", "record", "status"}]`` in the order of
+    ``collections``; collections without an answer yet are marked pending.
+    ``results`` maps a collection id to its ``(record, error)`` and
+    ``skipped`` the collections that were never probed to the reason why.
+    """
+    skipped = skipped or {}
+    rows = []
+    for collection_id in collections:
+        if collection_id in skipped:
+            record, status = None, f"skipped: {skipped[collection_id]}"
+        elif collection_id in results:
+            record, error = results[collection_id]
+            status = probe_status(record, error)
+        else:
+            record, status = None, PENDING
+        rows.append({"collection": collection_id, "record": record, "status": status})
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,181 @@
+"""
+Query pruning against the collection catalog.
+
+A query for a collection whose temporal extent starts after the requested
+window, or whose spatial extent misses the requested bbox, cannot return
+anything. ``QueryPruner``
+checks each ``(collection, bbox, datetime, codes)`` task against the cached
+``/collections`` documents (``montandon.catalog``) and drops those before a
+request is sent, counting what it skipped and why.
+
+What is checked:
+- ``extent.temporal.interval`` against the ``datetime`` parameter (``a/b``,
+  ``../b``, ``a/..`` or a single instant), on the start bound only. A closed
+  end is often stale (usgs collections carry a one-instant interval from
+  January 2025 while holding items from months later), so windows after it
+  are still queried.
+- ``extent.spatial.bbox`` against the ``bbox`` parameter. When the extent has
+  more than the overall box, the finer boxes after it are used. Boxes with
+  ``west > east`` cross the antimeridian.
+- ``summaries`` such as ``monty:hazard_codes`` against the requested codes,
+  only when asked for with ``code_summaries`` (e.g. ``CODE_SUMMARIES``).
+  Summaries are often stale or a sample of the values, so trusting them can
+  drop queries that would have matched; this check is off by default.
+
+Collections the catalog does not know, and collections without the extent
+or summary being checked, are always kept.
+"""
+
+from collections import Counter
+
+from montandon.slicing import parse_datetime
+
+# Query argument -> summary meant to list every value the collection holds
+CODE_SUMMARIES = {
+    "hazard_codes": "monty:hazard_codes",
+    "country_codes": "monty:country_codes",
+}
+
+OUTSIDE_TIME = "outside temporal extent"
+OUTSIDE_BBOX = "outside spatial extent"
+NO_CODES = "no matching codes in summaries"
+
+
+def parse_interval(value):
+    """
+    Splits a STAC ``datetime`` parameter into aware ``(start, end)``
+    datetimes, None for an open end.
+    """
+    if not value:
+        return None, None
+    if "/" not in value:
+        dt = parse_datetime(value)
+        return dt, dt
+    start, end = value.split("/", 1)
+    return parse_datetime(start), parse_datetime(end)
+
+
+def parse_bbox(bbox):
+    """``[west, south, east, north]`` from a bbox list or ``"w,s,e,n"`` string (2D or 3D)."""
+    if bbox is None:
+        return None
+    if isinstance(bbox, str):
+        bbox = [float(v) for v in bbox.split(",")]
+    bbox = list(bbox)
+    if len(bbox) == 6:
+        bbox = [bbox[0], bbox[1], bbox[3], bbox[4]]
+    return bbox
+
+
+def polygon_bbox(geometry):
+    """The ``[west, south, east, north]`` bounds of a GeoJSON Polygon or MultiPolygon."""
+    rings = geometry["coordinates"] if geometry["type"] == "Polygon" else \
+        [ring for polygon in geometry["coordinates"] for ring in polygon]
+    xs = [x for ring in rings for x, *_ in ring]
+    ys = [y for ring in rings for _, y, *_ in ring]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _longitude_spans(west, east):
+    # A box crossing the antimeridian covers two spans
+    return [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+
+def bboxes_intersect(a, b):
+    """True if two ``[west, south, east, north]`` boxes share any point."""
+    if a[1] > b[3] or b[1] > a[3]:
+        return False
+    return any(w1 <= e2 and w2 <= e1
+               for w1, e1 in _longitude_spans(a[0], a[2])
+               for w2, e2 in _longitude_spans(b[0], b[2]))
+
+
+class QueryPruner:
+    """
+    Decides, from the catalog alone, which queries cannot match anything.
+    ``checked`` counts the tasks seen and ``skipped`` the reasons tasks were
+    dropped for. Codes are checked against summaries only for the arguments
+    in ``code_summaries`` (none by default).
+    """
+
+    def __init__(self, catalog, code_summaries=None):
+        self.catalog = catalog
+        self.code_summaries = code_summaries or {}
+        self.checked = 0
+        self.skipped = Counter()
+
+    def reason(self, collection_id, bbox=None, datetime=None, **codes):
+        """
+        Why a query of ``collection_id`` cannot return items, or None if it
+        might. ``codes`` are the ``code_summaries`` arguments, e.g.
+        ``hazard_codes=["nat-geo-ear-gro"]``; an item needs only one of them.
+        """
+        if collection_id not in self.catalog:
+            return None
+        doc = self.catalog.get(collection_id)
+        if datetime and not self._overlaps_time(doc, datetime):
+            return OUTSIDE_TIME
+        if bbox is not None and not self._overlaps_bbox(doc, parse_bbox(bbox)):
+            return OUTSIDE_BBOX
+        summaries = doc.get("summaries", {})
+        for argument, wanted in codes.items():
+            held = summaries.get(self.code_summaries.get(argument))
+            if wanted and isinstance(held, list) and not set(wanted) & set(held):
+                return NO_CODES
+        return None
+
+    def check(self, collection_id, bbox=None, datetime=None, **codes):
+        """Counts the task and returns True if it has to be sent."""
+        self.checked += 1
+        reason = self.reason(collection_id, bbox=bbox, datetime=datetime, **codes)
+        if reason is not None:
+            self.skipped[reason] += 1
+        return reason is None
+
+    def prune(self, collection_ids, bbox=None, datetime=None, **codes):
+        """The collections in ``collection_ids`` that a query with these arguments has to be sent to."""
+        return [cid for cid in collection_ids if self.check(cid, bbox=bbox, datetime=datetime, **codes)]
+
+    def matching_codes(self, collection_id, argument, codes):
+        """
+        The ``codes`` the collection's summary for ``argument`` lists, in
+        order; all of them when the argument is not checked, there is no such
+        summary, or it lists none of them (a stale summary must not turn
+        into zero counts).
+        """
+        held = self.catalog.get(collection_id).get("summaries", {}).get(self.code_summaries.get(argument))
+        if not isinstance(held, list):
+            return list(codes)
+        held = set(held)
+        return [code for code in codes if code in held] or list(codes)
+
+    def stats(self):
+        return {"checked": self.checked, "skipped": sum(self.skipped.values()), "reasons": dict(self.skipped)}
+
+    def report(self):
+        """One line saying how many requests were skipped and why."""
+        total = sum(self.skipped.values())
+        reasons = ", ".join(f"{count} {reason}" for reason, count in self.skipped.most_common())
+        return f"Skipped {total} of {self.checked} requests from the catalog" + (f" ({reasons})" if total else "")
+
+    def _overlaps_time(self, doc, datetime):
+        start, end = parse_interval(datetime)
+        intervals = doc.get("extent", {}).get("temporal", {}).get("interval") or []
+        if len(intervals) > 1:
+            intervals = intervals[1:]
+        if not intervals:
+            return True
+        # Only a window ending before the extent starts is ruled out; the extent's end is a hint at most
+        for interval in intervals:
+            extent_start = parse_datetime((list(interval) + [None])[0])
+            if end is None or extent_start is None or extent_start <= end:
+                return True
+        return False
+
+    def _overlaps_bbox(self, doc, bbox):
+        boxes = doc.get("extent", {}).get("spatial", {}).get("bbox") or []
+        if len(boxes) > 1:
+            boxes = boxes[1:]
+        if not boxes:
+            return True
+        return any(bboxes_intersect(parse_bbox(box), bbox) for box in boxes)
@@ -0,0 +1,169 @@
+"""
+Adaptive client-side rate limiting for the Montandon API.
+
+Firing every worker at once makes the stage server answer with bursts of 500s
+and timeouts. ``RateLimiter`` paces requests with a token bucket instead and
+tunes its rate AIMD-style, like TCP congestion control:
+
+- additive increase: each healthy response adds ``increase / rate``, i.e.
+  about ``increase`` requests/second per second of healthy traffic;
+- multiplicative decrease: a 429, a 5xx, a network error or a latency spike
+  (slower than ``spike_factor`` times the running average) multiplies the
+  rate by ``decrease``, at most once per ``cooldown`` seconds so one burst of
+  failures does not collapse it to the minimum.
+
+The bucket holds at most ``burst`` tokens, so requests are spread out rather
+than released together. With a ``state_file`` the bucket and the learned rate
+live in a small JSON file guarded by an OS file lock, so every thread and
+every script process using the same file shares one budget.
+
+Usage::
+
+    limiter = shared_limiter(rate=8)         # one budget for every script calling API_HOST
+    limiter.acquire()                        # or: await limiter.acquire_async()
+    ...                                      # send the request
+    limiter.record(status, latency_seconds)
+"""
+
+import asyncio
+from contextlib import contextmanager
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from montandon.paginator import STAC_API_URL
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+API_HOST = urlsplit(STAC_API_URL).netloc
+DEFAULT_RATE = 8.0  # requests per second to start from
+STALE_AFTER = 600  # seconds after which a shared state file is started afresh
+
+
+def default_state_file(name):
+    """Lock/state file shared by all scripts limiting requests to ``name`` (usually a host)."""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+    return os.path.join(tempfile.gettempdir(), f"montandon-ratelimit-{safe}.json")
+
+
+class RateLimiter:
+    """Token bucket whose rate adapts to how the server is coping."""
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=0.5, max_rate=50.0, burst=1.0, increase=0.5, decrease=0.5,
+                 spike_factor=3.0, cooldown=2.0, state_file=None):
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.cooldown = cooldown
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _fresh_state(self, now):
+        return {"rate": self.initial_rate, "tokens": self.burst, "updated": now, "latency": None, "cut_at": 0.0}
+
+    @contextmanager
+    def _transaction(self):
+        """Yields the shared state under the thread lock (and the file lock), saving it afterwards."""
+        with self._lock:
+            now = time.time()
+            if self.state_file is None:
+                if self._state is None:
+                    self._state = self._fresh_state(now)
+                yield self._state, now
+                return
+            with open(self.state_file, "a+", encoding="utf-8") as f:
+                _lock_file(f)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or "null")
+                    except ValueError:
+                        state = None
+                    if not state or now - state.get("updated", 0) > STALE_AFTER:
+                        state = self._fresh_state(now)
+                    yield state, now
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    _unlock_file(f)
+
+    def reserve(self):
+        """Takes one token and returns how many seconds to wait before sending."""
+        with self._transaction() as (state, now):
+            rate = state["rate"]
+            tokens = min(self.burst, state["tokens"] + (now - state["updated"]) * rate)
+            tokens -= 1
+            state["tokens"] = tokens
+            state["updated"] = now
+            # A negative balance is a queue of reservations; each waits for its own token
+            return max(0.0, -tokens / rate)
+
+    def acquire(self):
+        """Blocks the calling thread until the request may be sent."""
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Waits on the event loop until the request may be sent."""
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def record(self, status, latency=None):
+        """
+        Feeds back the outcome of a request: the HTTP status (None for a
+        network error) and how long it took in seconds.
+        """
+        with self._transaction() as (state, now):
+            average = state["latency"]
+            spike = latency is not None and average is not None and latency > self.spike_factor * average
+            if latency is not None:
+                state["latency"] = latency if average is None else 0.8 * average + 0.2 * latency
+            if status is None or status == 429 or status >= 500 or spike:
+                if now - state["cut_at"] >= self.cooldown:
+                    state["rate"] = max(self.min_rate, state["rate"] * self.decrease)
+                    state["cut_at"] = now
+            else:
+                state["rate"] = min(self.max_rate, state["rate"] + self.increase / state["rate"])
+
+    @property
+    def rate(self):
+        with self._transaction() as (state, _):
+            return state["rate"]
+
+
+def shared_limiter(name=API_HOST, rate=DEFAULT_RATE, **kwargs):
+    """A ``RateLimiter`` shared through ``default_state_file(name)`` with other threads and processes."""
+    return RateLimiter(rate=rate, state_file=default_state_file(name), **kwargs)
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
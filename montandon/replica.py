@@ -0,0 +1,268 @@
+"""
+Local columnar replica of Montandon collections.
+
+Mirrors chosen collections into Parquet files partitioned by collection and
+year, so analyses can run against local files instead of crawling the API:
+
+    <root>/<collection>/year=<YYYY>/part-<sync time>-<n>.parquet
+
+The first sync of a collection pages through it in parallel datetime slices.
+Later syncs only request items newer than the stored high-water mark: the
+maximum ``updated`` timestamp when the collection's items carry one, otherwise
+the maximum ``datetime``. Items that come back again are de-duplicated by id
+on read, keeping the most recently synced copy.
+
+``query_replica`` runs the same CQL2-JSON filters the scripts send to the API
+against these files (see ``montandon.cql2``).
+
+Usage:
+    python -m montandon.replica sync [--root DIR] [--full] [collection ...]
+
+Requires:
+    - pyarrow (pip install pyarrow)
+    - pandas (pip install pandas), for ``read_replica``
+    - numpy and shapely (pip install numpy shapely), for spatial ``query_replica`` filters
+    - httpx (pip install httpx)
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from montandon.catalog import load_catalog
+from montandon.engine import FetchEngine, run_all
+from montandon.slicing import format_datetime, iter_sliced_pages, parse_datetime, plan_windows, temporal_extent
+
+DEFAULT_ROOT = os.environ.get("MONTANDON_REPLICA_DIR", "montandon_replica")
+STATE_FILE = "_sync_state.json"
+BATCH_ROWS = 50000
+SYNC_SLICES = 8
+
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("collection", pa.string()),
+    ("datetime", pa.string()),
+    ("start_datetime", pa.string()),
+    ("end_datetime", pa.string()),
+    ("updated", pa.string()),
+    ("title", pa.string()),
+    ("roles", pa.list_(pa.string())),
+    ("monty:country_codes", pa.list_(pa.string())),
+    ("monty:hazard_codes", pa.list_(pa.string())),
+    ("monty:corr_id", pa.string()),
+    ("bbox", pa.list_(pa.float64())),
+    ("geometry", pa.string()),  # GeoJSON text
+    ("properties", pa.string()),  # full properties as JSON text
+    ("_synced_at", pa.string()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int32())]), flavor="hive")
+
+
+def feature_row(feature, collection_id, synced_at):
+    """Flattens a STAC item into one replica row."""
+    props = feature.get("properties") or {}
+    geometry = feature.get("geometry")
+    return {
+        "id": feature.get("id"),
+        "collection": feature.get("collection") or collection_id,
+        "datetime": props.get("datetime"),
+        "start_datetime": props.get("start_datetime"),
+        "end_datetime": props.get("end_datetime"),
+        "updated": props.get("updated"),
+        "title": props.get("title"),
+        "roles": props.get("roles"),
+        "monty:country_codes": props.get("monty:country_codes"),
+        "monty:hazard_codes": props.get("monty:hazard_codes"),
+        "monty:corr_id": props.get("monty:corr_id"),
+        "bbox": feature.get("bbox"),
+        "geometry": json.dumps(geometry) if geometry is not None else None,
+        "properties": json.dumps(props, ensure_ascii=False),
+        "_synced_at": synced_at,
+    }
+
+
+def row_year(row):
+    """Partition year of a row; -1 when the item has no parseable datetime."""
+    dt = parse_datetime(row["datetime"] or row["start_datetime"])
+    return dt.year if dt else -1
+
+
+def load_state(root):
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(root, state):
+    path = os.path.join(root, STATE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class PartitionWriter:
+    """Buffers rows per year and writes them out as Parquet parts of ``BATCH_ROWS`` rows at most."""
+
+    def __init__(self, root, collection_id, synced_at, batch_rows=BATCH_ROWS):
+        self.directory = os.path.join(root, collection_id)
+        self.tag = synced_at.replace(":", "").replace("-", "")
+        self.batch_rows = batch_rows
+        self.buffers = {}
+        self.parts = 0
+        self.rows = 0
+
+    def add(self, row):
+        year = row_year(row)
+        buffer = self.buffers.setdefault(year, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_rows:
+            self.flush(year)
+
+    def flush(self, year=None):
+        for y in ([year] if year is not None else list(self.buffers)):
+            rows = self.buffers.pop(y, [])
+            if not rows:
+                continue
+            directory = os.path.join(self.directory, f"year={y}")
+            os.makedirs(directory, exist_ok=True)
+            table = pa.Table.from_pylist(rows, schema=SCHEMA)
+            pq.write_table(table, os.path.join(directory, f"part-{self.tag}-{self.parts:05d}.parquet"))
+            self.parts += 1
+            self.rows += len(rows)
+
+
+async def sync_collection(engine, root, collection_id, collection_doc, state, full=False, slices=SYNC_SLICES):
+    """
+    Mirrors one collection into the replica and returns its updated state
+    entry. Only items newer than the stored high-water mark are requested
+    unless ``full`` is set.
+    """
+    entry = {} if full else dict(state.get(collection_id, {}))
+    now = datetime.now(timezone.utc)
+    synced_at = format_datetime(now)
+    writer = PartitionWriter(root, collection_id, synced_at)
+    high_water = parse_datetime(entry.get("high_water"))
+    field = entry.get("field")
+
+    if high_water and field == "updated":
+        print(f"  {collection_id}: incremental sync of items updated after {entry['high_water']}")
+        pages = engine.iter_pages(collection_id, filter={"op": ">", "args": [
+            {"property": "updated"}, {"timestamp": entry["high_water"]}]})
+    elif high_water:
+        print(f"  {collection_id}: incremental sync of items dated from {entry['high_water']}")
+        pages = engine.iter_pages(collection_id, datetime=f"{entry['high_water']}/..")
+    else:
+        print(f"  {collection_id}: full sync")
+        windows = plan_windows(*temporal_extent(collection_doc), slices)
+        pages = iter_sliced_pages(engine, collection_id, windows)
+
+    # Bogus future dates must not move the mark past items that are still to come
+    latest_plausible = now + timedelta(days=1)
+    async for page in pages:
+        for feature in page.features:
+            props = feature.get("properties") or {}
+            if field is None:
+                # Prefer ``updated`` when the collection's items carry it
+                field = "updated" if props.get("updated") else "datetime"
+            value = parse_datetime(props.get(field))
+            if value and value <= latest_plausible and (high_water is None or value > high_water):
+                high_water = value
+            writer.add(feature_row(feature, collection_id, synced_at))
+    writer.flush()
+
+    entry["high_water"] = format_datetime(high_water) if high_water else None
+    entry["field"] = field
+    entry["synced_at"] = synced_at
+    entry["rows_written"] = entry.get("rows_written", 0) + writer.rows
+    print(f"  {collection_id}: wrote {writer.rows} rows in {writer.parts} parts")
+    return entry
+
+
+async def sync(collection_ids=None, root=DEFAULT_ROOT, full=False, max_concurrency=16, cache=None):
+    """
+    Syncs ``collection_ids`` (default: every collection in the catalog)
+    concurrently and saves the state file.
+    """
+    os.makedirs(root, exist_ok=True)
+    state = load_state(root)
+    async with FetchEngine(max_concurrency=max_concurrency, per_host=max_concurrency, cache=cache) as engine:
+        catalog = await load_catalog(engine)
+        collection_ids = collection_ids or catalog.ids()
+        tasks = {cid: sync_collection(engine, root, cid, catalog.get(cid), state, full)
+                 for cid in collection_ids}
+        async for collection_id, entry, exc in run_all(tasks):
+            if exc is not None:
+                # Keep the old high-water mark so the next run retries from there
+                print(f"  {collection_id}: sync failed ({exc}); state left unchanged")
+                continue
+            state[collection_id] = entry
+            save_state(root, state)
+    return state
+
+
+def read_replica(collections=None, columns=None, root=DEFAULT_ROOT, filter=None):
+    """
+    Reads replica rows into a pandas DataFrame, keeping the most recently
+    synced copy of each item. ``filter`` is a ``pyarrow.dataset`` expression,
+    e.g. ``ds.field("year") >= 2000``.
+    """
+    collections = collections or sorted(
+        name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))
+    )
+    paths = [os.path.join(root, c) for c in collections if os.path.isdir(os.path.join(root, c))]
+    if not paths:
+        return pa.Table.from_pylist([], schema=SCHEMA).to_pandas()
+    schema = SCHEMA.append(pa.field("year", pa.int32()))
+    dataset = ds.dataset([ds.dataset(path, format="parquet", schema=schema, partitioning=PARTITIONING)
+                          for path in paths])
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + ["id", "collection", "_synced_at"]))
+    df = dataset.to_table(columns=columns, filter=filter).to_pandas()
+    df = df.sort_values("_synced_at").drop_duplicates(["collection", "id"], keep="last")
+    return df.reset_index(drop=True)
+
+
+def query_replica(filter, collections=None, columns=None, root=DEFAULT_ROOT):
+    """
+    The replica rows passing a CQL2-JSON ``filter``, evaluated locally with
+    ``montandon.cql2.compile_predicate``. Only the columns the filter reads
+    are loaded on top of ``columns`` (all columns when None); properties
+    without a column of their own are read from ``properties``.
+    """
+    from montandon.cql2 import compile_predicate, frame_columns
+
+    if columns is not None:
+        needed = frame_columns(filter)
+        columns = list(columns) + sorted(name for name in needed if name in SCHEMA.names)
+        if any(name not in SCHEMA.names for name in needed):
+            columns.append("properties")
+    df = read_replica(collections, columns=columns, root=root)
+    return df[compile_predicate(filter)(df)].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mirror Montandon collections into local Parquet files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_parser = sub.add_parser("sync", help="fetch new items into the replica")
+    sync_parser.add_argument("collections", nargs="*", help="collection ids (default: every catalog collection)")
+    sync_parser.add_argument("--root", default=DEFAULT_ROOT, help="replica directory")
+    sync_parser.add_argument("--full", action="store_true", help="ignore high-water marks and resync everything")
+    args = parser.parse_args(argv)
+    if args.command == "sync":
+        state = asyncio.run(sync(args.collections, args.root, args.full))
+        for collection_id in args.collections or sorted(state):
+            entry = state.get(collection_id, {})
+            print(f"{collection_id}: {entry.get('rows_written', 0)} rows written, high-water {entry.get('high_water')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+One retry policy for every Montandon request.
+
+Each script used to retry in its own way: some gave up on the first error,
+others slept ``2 ** attempt`` seconds up to ten times per page, all workers
+backing off in lockstep. ``RetryPolicy`` is shared by the sync paginator and
+the async engine and combines:
+
+- Capped exponential backoff with full jitter, so workers that failed
+  together do not retry together.
+- ``Retry-After`` support for 429/503 responses (seconds or HTTP date).
+- Only transient failures are retried: network errors, undecodable bodies and
+  408/425/429/5xx. Other 4xx responses fail at once.
+- A per-host circuit breaker: after ``failure_threshold`` consecutive failures
+  the host is left alone for ``reset_timeout`` seconds, then a single probe
+  request decides whether it is healthy again.
+- A retry budget shared by all workers: every request earns ``ratio`` of a
+  retry, so under a broad outage retries stay a small fraction of the
+  traffic instead of multiplying it.
+
+The budget and breakers are thread-safe, so one policy can be shared by
+worker threads as well as by the tasks of an event loop. ``RequestAttempts``
+is the attempt loop of one request under a policy; the sync paginator and the
+async engine both drive it and only differ in how they send and sleep.
+"""
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is refused because the host's circuit is open."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"Circuit open for {host}, retry in {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class PageFetchError(Exception):
+    """Raised when a page could not be fetched after all retries."""
+
+    def __init__(self, url, page, cause, status=None):
+        super().__init__(f"Page {page} failed: {cause}")
+        self.url = url
+        self.page = page
+        self.cause = cause
+        self.status = status
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a ``Retry-After`` header (delta seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+class RetryBudget:
+    """
+    Token bucket of retries: each first attempt deposits ``ratio`` tokens and
+    each retry withdraws one. Whatever the balance, ``min_retries`` retries
+    are allowed per ``window`` seconds, so a quiet client (or one in a long
+    outage that drained the bucket) can still retry.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, max_tokens=100, window=60.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.max_tokens = max_tokens
+        self.window = window
+        self.tokens = float(min_retries)
+        self.exhausted = 0
+        self._window_start = time.monotonic()
+        self._window_spent = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Takes one retry from the budget; False when none is left."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._window_spent = 0
+            if self.tokens >= 1:
+                self.tokens -= 1
+            elif self._window_spent >= self.min_retries:
+                self.exhausted += 1
+                return False
+            self._window_spent += 1
+            return True
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker, one circuit per host."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = {}  # host -> consecutive failures
+        self._opened_at = {}  # host -> monotonic time the circuit opened
+        self._probing = {}  # host -> monotonic start of the half-open probe in flight
+
+    def check(self, host):
+        """
+        Returns 0 when a request to ``host`` may go ahead, otherwise the number
+        of seconds until the circuit half-opens. Once the timeout has passed a
+        single caller is let through as the probe.
+        """
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return 0
+            remaining = opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            probe_started = self._probing.get(host)
+            # A probe that never reported back (e.g. a cancelled task) is replaced after a timeout
+            if probe_started is not None and time.monotonic() - probe_started < self.reset_timeout:
+                return min(1.0, self.reset_timeout)
+            self._probing[host] = time.monotonic()
+            return 0
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._probing.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if host in self._probing or failures >= self.failure_threshold:
+                if host not in self._opened_at or host in self._probing:
+                    print(f"  Circuit opened for {host} after {failures} consecutive failures; "
+                          f"pausing requests for {self.reset_timeout:.0f}s.")
+                self._opened_at[host] = time.monotonic()
+                self._probing.pop(host, None)
+
+    def is_open(self, host):
+        with self._lock:
+            return host in self._opened_at
+
+
+class RetryPolicy:
+    """
+    How often and how long to retry. ``retry`` tells a caller whether to try
+    again after a failure; ``delay`` how long to sleep first.
+    """
+
+    def __init__(self, max_retries=5, base_delay=0.5, max_delay=30.0, max_retry_after=120.0,
+                 retry_statuses=RETRY_STATUSES, budget=None, breaker=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget if budget is not None else RetryBudget()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    def is_retryable(self, status):
+        """Network and decode failures (no status) and transient statuses can be retried."""
+        return status is None or status in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Full-jitter backoff for the given 0-based attempt, honouring ``Retry-After``."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_retry_after))
+        return backoff
+
+    def retry(self, attempt, status=None, max_retries=None, no_retry_statuses=()):
+        """
+        True if a request that failed on ``attempt`` (0-based) with ``status``
+        should be tried again. Takes a token from the shared budget.
+        """
+        max_retries = max_retries or self.max_retries
+        if attempt >= max_retries - 1 or status in no_retry_statuses or not self.is_retryable(status):
+            return False
+        return self.budget.withdraw()
+
+    def stats(self):
+        return {"retry_tokens": round(self.budget.tokens, 1), "budget_exhausted": self.budget.exhausted}
+
+
+# Shared by every request that does not bring its own policy
+DEFAULT_POLICY = RetryPolicy()
+
+
+class RequestAttempts:
+    """
+    Attempts of one request under a ``RetryPolicy``: circuit checks,
+    failure classification, budget and backoff. The caller sends and sleeps::
+
+        attempts = RequestAttempts(policy, url, page, max_retries)
+        for attempt in attempts:
+            wait = attempts.circuit_wait()
+            if wait:
+                time.sleep(wait)
+                continue
+            try:
+                data = send()
+            except (TransportError, ValueError) as ex:
+                time.sleep(attempts.failed(ex, status, retry_after))
+                continue
+            attempts.succeeded()
+            return data
+
+    ``circuit_wait`` and ``failed`` raise ``PageFetchError`` once the request
+    has to be given up.
+    """
+
+    def __init__(self, policy, url, page, max_retries=None, no_retry_statuses=(), label=""):
+        self.policy = policy
+        self.url = url
+        self.page = page
+        self.max_retries = max_retries or policy.max_retries
+        self.no_retry_statuses = no_retry_statuses
+        self.label = label
+        self.host = urlsplit(url).netloc
+        self.attempt = 0
+        policy.budget.deposit()
+
+    def __iter__(self):
+        for self.attempt in range(self.max_retries):
+            yield self.attempt
+
+    def circuit_wait(self):
+        """
+        Seconds to wait before sending while the host's circuit is open (0
+        to go ahead). The host is failing, so the caller waits instead of
+        adding to the load; on the last attempt the request is given up.
+        """
+        closed_in = self.policy.breaker.check(self.host)
+        if closed_in and self.attempt == self.max_retries - 1:
+            raise PageFetchError(self.url, self.page, CircuitOpenError(self.host, closed_in))
+        return closed_in
+
+    def failed(self, ex, status=None, retry_after=None):
+        """
+        Records a failed attempt and returns the seconds to back off before
+        the next one; raises ``PageFetchError`` (from ``ex``) if there is none.
+        """
+        # Network and decode errors have no failing status and are always transient
+        failed_status = status if status is not None and status >= 400 else None
+        if self.policy.is_retryable(failed_status):
+            self.policy.breaker.record_failure(self.host)
+        else:
+            self.policy.breaker.record_success(self.host)
+        if not self.policy.retry(self.attempt, failed_status, self.max_retries, self.no_retry_statuses):
+            raise PageFetchError(self.url, self.page, ex, status) from ex
+        wait_time = self.policy.delay(self.attempt, retry_after)
+        print(f"  Error on {self.label or self.url} page {self.page}, attempt {self.attempt + 1} -- {ex}. "
+              f"Retrying in {wait_time:.2f}s.")
+        return wait_time
+
+    def succeeded(self):
+        self.policy.breaker.record_success(self.host)
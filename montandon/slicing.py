@@ -0,0 +1,164 @@
+"""
+Parallel pagination by splitting a collection scan into datetime windows.
+
+STAC ``next`` tokens make every page wait for the previous one, so a single
+large collection is scanned serially. This module splits a full-collection
+scan into adjacent datetime windows based on the collection's
+``extent.temporal`` and pages through all windows concurrently on a
+``montandon.engine.FetchEngine``.
+
+Windows share their boundary instants (STAC datetime intervals are closed),
+and items with a start/end range can match more than one window. Each item is
+therefore only kept by the window that owns its datetime, so the merged stream
+contains every item exactly once.
+
+Requires:
+    - httpx (pip install httpx)
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from montandon.paginator import Page
+
+DEFAULT_SLICES = 8
+# Fields every sliced scan needs to assign items to windows
+WINDOW_FIELDS = ["id", "properties.datetime", "properties.start_datetime"]
+
+
+def parse_datetime(value):
+    """Parses a STAC datetime string into an aware UTC datetime, or returns None."""
+    if not value or value == "..":
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def format_datetime(dt):
+    """Formats a datetime the way the Montandon API expects (``YYYY-MM-DDTHH:MM:SSZ``)."""
+    dt = dt.astimezone(timezone.utc)
+    # strftime("%Y") does not zero-pad years before 1000 on every platform
+    return f"{dt.year:04d}" + dt.strftime("-%m-%dT%H:%M:%SZ")
+
+
+def temporal_extent(collection):
+    """
+    Returns ``(start, end)`` from a collection's ``extent.temporal``. An open
+    end (``null``) is taken to be now.
+    """
+    interval = collection.get("extent", {}).get("temporal", {}).get("interval") or [[None, None]]
+    start, end = (interval[0] + [None, None])[:2]
+    return parse_datetime(start), parse_datetime(end) or datetime.now(timezone.utc)
+
+
+def plan_windows(start, end, slices=DEFAULT_SLICES):
+    """
+    Splits ``start``..``end`` into ``slices`` adjacent windows of equal length.
+    Edges are rounded to whole seconds because the API only takes seconds.
+
+    Returns a list of ``(start, end)`` datetimes. The first window has no lower
+    bound and the last no upper bound (``None``), so items dated outside the
+    advertised extent are still covered.
+    """
+    if start is None or end is None or end <= start or slices <= 1:
+        return [(None, None)]
+    step = (end - start) / slices
+    edges = sorted({(start + step * i).replace(microsecond=0) for i in range(1, slices)})
+    bounds = [None] + edges + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def window_param(window):
+    """Formats a window as a STAC ``datetime`` parameter (``..`` for open ends)."""
+    start, end = window
+    if start is None and end is None:
+        return None
+    return f"{format_datetime(start) if start else '..'}/{format_datetime(end) if end else '..'}"
+
+
+def item_datetime(feature):
+    """Returns the datetime that decides which window owns an item."""
+    props = feature.get("properties", {})
+    return parse_datetime(props.get("datetime") or props.get("start_datetime"))
+
+
+def owns(window, dt):
+    """True if ``dt`` falls in the half-open window ``[start, end)``."""
+    start, end = window
+    return (start is None or dt >= start) and (end is None or dt < end)
+
+
+async def iter_sliced_pages(engine, collection_id, windows, queue_size=8, resume=None, **query):
+    """
+    Pages through all ``windows`` of a collection concurrently and yields the
+    merged pages as they arrive. Page numbers are per window and
+    ``Page.window`` is the index of the page's window. ``query`` takes the
+    same arguments as ``FetchEngine.iter_pages`` (except ``datetime``).
+
+    ``resume`` maps window indexes to saved ``next`` links to continue from,
+    or to None for windows that are already finished (see
+    ``montandon.checkpoint``).
+
+    The queue between window tasks and the consumer is bounded, so at most
+    ``queue_size`` pages are buffered regardless of the number of windows.
+    A failing window re-raises its error (usually ``PageFetchError``) after
+    the other windows have been cancelled.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    done = object()
+    if query.get("fields"):
+        fields = query["fields"].split(",") if isinstance(query["fields"], str) else list(query["fields"])
+        query["fields"] = fields + [f for f in WINDOW_FIELDS if f not in fields]
+
+    resume = resume or {}
+
+    async def scan(index, window):
+        try:
+            if index in resume and resume[index] is None:
+                await queue.put(done)
+                return
+            pages = engine.iter_pages(collection_id, datetime=window_param(window), resume_url=resume.get(index),
+                                      **query)
+            async for page in pages:
+                kept = []
+                for feature in page.features:
+                    dt = item_datetime(feature)
+                    if dt is None or owns(window, dt):
+                        kept.append(feature)
+                await queue.put(Page(page.number, page.url, kept, page.next_url, page.data, index))
+            await queue.put(done)
+        except Exception as ex:
+            # Hand every failure to the consumer; a silently dead task would stall it
+            await queue.put(ex)
+
+    tasks = [asyncio.ensure_future(scan(index, window)) for index, window in enumerate(windows)]
+    # Items without a usable datetime cannot be assigned to a window, so they
+    # are de-duplicated by id instead; there are normally very few of them.
+    undated_ids = set()
+    remaining = len(tasks)
+    try:
+        while remaining:
+            entry = await queue.get()
+            if entry is done:
+                remaining -= 1
+                continue
+            if isinstance(entry, Exception):
+                raise entry
+            features = []
+            for feature in entry.features:
+                feature_id = feature.get("id")
+                if item_datetime(feature) is None and feature_id is not None:
+                    if feature_id in undated_ids:
+                        continue
+                    undated_ids.add(feature_id)
+                features.append(feature)
+            yield Page(entry.number, entry.url, features, entry.next_url, entry.data, entry.window)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
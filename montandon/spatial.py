@@ -0,0 +1,264 @@
+"""
+In-memory spatial index over item footprints.
+
+Asking "which hazards touch this country?" used to mean a new API request
+or a scan over every MultiPolygon. ``SpatialIndex`` keeps the bounding box
+of each item in STR-packed R-trees (shapely's ``STRtree``) and only parses
+and tests the exact geometry of the items whose box hits the query, so a
+bbox, point or polygon query over a few hundred thousand footprints takes
+milliseconds.
+
+Items can be added at any time, page by page while fetching or from the
+Parquet replica (``from_replica``). New items go to a small buffer that is
+scanned linearly; once it is full it is packed into a tree, and trees of
+similar size are merged, so building the index as items arrive costs
+O(n log n) overall. Re-adding an item (same collection and id) replaces the
+earlier copy.
+
+Bounding boxes with ``west > east`` cross the antimeridian and are indexed as
+two boxes; items without a ``bbox`` get one from their geometry.
+
+Usage::
+
+    index = SpatialIndex()
+    for page in iter_pages("gdacs-hazards", datetime="2024-01-01T00:00:00Z/2024-12-31T23:59:59Z"):
+        index.add(page.features)
+    index.query(EUROPE_POLYGON)          # [(collection, id), ...]
+    index.query_point(12.5, 41.9)
+    index.query_bbox([5, 45, 10, 48], predicate="contains")
+
+Requires:
+    - shapely (pip install shapely)
+    - numpy (pip install numpy)
+"""
+
+import json
+
+import numpy as np
+import shapely
+
+DEFAULT_BUFFER_SIZE = 2048
+DEFAULT_NODE_CAPACITY = 16
+
+
+class SpatialIndex:
+    """
+    Footprints of items keyed by ``(collection, id)``. ``keep_features``
+    also keeps each added feature, for ``features``.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, node_capacity=DEFAULT_NODE_CAPACITY, keep_features=False):
+        self.buffer_size = buffer_size
+        self.node_capacity = node_capacity
+        self.keep_features = keep_features
+        self._keys = []  # row -> (collection, id)
+        self._bounds = np.empty((1024, 4))  # row -> [west, south, east, north], grown by doubling
+        self._geometries = []  # row -> GeoJSON (dict or text) until first needed, then a shapely geometry
+        self._features = []  # row -> feature, when keep_features
+        self._alive = bytearray()  # row -> 0 once replaced
+        self._rows = {}  # (collection, id) -> current row
+        self._segments = []  # [(box rows, STRtree)], largest first
+        self._pending = []  # rows not packed into a tree yet
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def add(self, features, collection_id=None):
+        """Adds (or replaces) STAC items; returns how many had a footprint."""
+        added = 0
+        for feature in features:
+            key = (feature.get("collection") or collection_id, feature.get("id"))
+            if self._add(key, feature.get("bbox"), feature.get("geometry"),
+                         feature if self.keep_features else None):
+                added += 1
+        self._maybe_pack()
+        return added
+
+    def add_rows(self, collections, ids, bboxes, geometries):
+        """Adds columns of the replica layout (``bbox`` lists, ``geometry`` GeoJSON text)."""
+        added = 0
+        for collection_id, item_id, bbox, geometry in zip(collections, ids, bboxes, geometries):
+            if self._add((collection_id, item_id), bbox, geometry, None):
+                added += 1
+        self._maybe_pack()
+        return added
+
+    @classmethod
+    def from_replica(cls, collections=None, root=None, **kwargs):
+        """An index over the items of the local Parquet replica (``montandon.replica``)."""
+        from montandon.replica import DEFAULT_ROOT, read_replica
+
+        df = read_replica(collections, columns=["bbox", "geometry"], root=root or DEFAULT_ROOT)
+        index = cls(**kwargs)
+        index.add_rows(df["collection"], df["id"], df["bbox"], df["geometry"])
+        return index
+
+    def _add(self, key, bbox, geometry, feature):
+        if geometry is not None and not isinstance(geometry, (str, dict)) and geometry != geometry:
+            geometry = None  # NaN from a pandas column
+        bbox = _as_bounds(bbox)
+        if bbox is None:
+            if geometry is None:
+                return False
+            geometry = _parse(geometry)
+            if geometry is None or geometry.is_empty:
+                return False
+            bbox = list(shapely.bounds(geometry))
+        previous = self._rows.get(key)
+        if previous is not None:
+            self._alive[previous] = 0
+        row = len(self._keys)
+        if row == len(self._bounds):
+            self._bounds = np.concatenate([self._bounds, np.empty_like(self._bounds)])
+        self._keys.append(key)
+        self._bounds[row] = bbox
+        self._geometries.append(geometry)
+        self._features.append(feature)
+        self._alive.append(1)
+        self._rows[key] = row
+        self._pending.append(row)
+        return True
+
+    def _maybe_pack(self):
+        if len(self._pending) < self.buffer_size:
+            return
+        rows = np.asarray(self._pending, dtype=np.int64)
+        self._pending = []
+        # Merge with every smaller-or-equal tree at the end, like carrying in a binary counter
+        while self._segments and len(self._segments[-1][0]) <= 2 * len(rows):
+            previous_rows, _ = self._segments.pop()
+            rows = np.concatenate([np.unique(previous_rows), rows])
+        self._segments.append(self._pack(rows))
+
+    def _pack(self, rows):
+        """An STR tree over the live rows' boxes; antimeridian boxes count twice."""
+        rows = rows[self._alive_mask()[rows]]
+        bounds = self._bounds[rows]
+        crossing = bounds[:, 0] > bounds[:, 2]
+        boxes = bounds.copy()
+        boxes[crossing, 2] = 180.0
+        extra = bounds[crossing].copy()
+        extra[:, 0] = -180.0
+        box_rows = np.concatenate([rows, rows[crossing]])
+        boxes = np.concatenate([boxes, extra])
+        tree = shapely.STRtree(shapely.box(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]),
+                               node_capacity=self.node_capacity)
+        return box_rows, tree
+
+    def pack(self):
+        """Packs the buffer and merges every tree into one, for the fastest queries."""
+        rows = [np.asarray(self._pending, dtype=np.int64)] + [np.unique(r) for r, _ in self._segments]
+        self._pending = []
+        self._segments = [self._pack(np.concatenate(rows))] if sum(len(r) for r in rows) else []
+
+    def candidates(self, bbox):
+        """Rows of the live items whose box intersects ``[west, south, east, north]``."""
+        found = []
+        for west, south, east, north in _spans(bbox):
+            query_box = shapely.box(west, south, east, north)
+            for box_rows, tree in self._segments:
+                found.append(box_rows[tree.query(query_box)])
+            if self._pending:
+                pending = np.asarray(self._pending, dtype=np.int64)
+                bounds = self._bounds[pending]
+                crossing = bounds[:, 0] > bounds[:, 2]
+                hit_x = (bounds[:, 0] <= east) & (bounds[:, 2] >= west) | \
+                    crossing & ((bounds[:, 0] <= east) | (bounds[:, 2] >= west))
+                hit = hit_x & (bounds[:, 1] <= north) & (bounds[:, 3] >= south)
+                found.append(pending[hit])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        rows = np.unique(np.concatenate(found))
+        return rows[self._alive_mask()[rows]] if len(rows) else rows
+
+    def _alive_mask(self):
+        # A view, not a copy; it must not outlive the call (the bytearray cannot grow while viewed)
+        return np.frombuffer(self._alive, dtype=bool)
+
+    def geometry(self, row):
+        """The shapely geometry of a row, parsed on first use."""
+        geometry = self._geometries[row]
+        if geometry is not None and not isinstance(geometry, shapely.Geometry):
+            geometry = self._geometries[row] = _parse(geometry)
+        return geometry
+
+    def _parse_rows(self, rows):
+        # One from_geojson call for every candidate not parsed yet
+        todo = [row for row in rows
+                if self._geometries[row] is not None and not isinstance(self._geometries[row], shapely.Geometry)]
+        if not todo:
+            return
+        texts = [g if isinstance(g, str) else json.dumps(g) for g in (self._geometries[row] for row in todo)]
+        for row, shape in zip(todo, shapely.from_geojson(texts, on_invalid="ignore")):
+            self._geometries[row] = shape
+
+    def query(self, geometry, predicate="intersects"):
+        """
+        Keys of the items whose geometry satisfies ``predicate`` (a shapely
+        binary predicate: ``intersects``, ``within``, ``contains``, ...)
+        against ``geometry`` (GeoJSON dict or shapely geometry). Items
+        indexed from a bbox alone are tested with that box.
+        """
+        return [self._keys[row] for row in self._query_rows(geometry, predicate)]
+
+    def query_bbox(self, bbox, predicate="intersects"):
+        west, south, east, north = _as_bounds(bbox)
+        if west > east:
+            geometry = shapely.MultiPolygon([shapely.box(west, south, 180.0, north),
+                                             shapely.box(-180.0, south, east, north)])
+        else:
+            geometry = shapely.box(west, south, east, north)
+        return self.query(geometry, predicate)
+
+    def query_point(self, lon, lat, predicate="intersects"):
+        return self.query(shapely.Point(lon, lat), predicate)
+
+    def features(self, geometry, predicate="intersects"):
+        """The kept features matching ``query`` (requires ``keep_features``)."""
+        return [self._features[row] for row in self._query_rows(geometry, predicate)]
+
+    def count(self, geometry, predicate="intersects"):
+        return len(self._query_rows(geometry, predicate))
+
+    def _query_rows(self, geometry, predicate):
+        geometry = _parse(geometry) if not isinstance(geometry, shapely.Geometry) else geometry
+        shapely.prepare(geometry)
+        rows = self.candidates(list(shapely.bounds(geometry)))
+        if not len(rows):
+            return rows
+        self._parse_rows(rows)
+        shapes = np.empty(len(rows), dtype=object)
+        for i, row in enumerate(rows):
+            shape = self._geometries[row]
+            if shape is None:
+                west, south, east, north = self._bounds[row]
+                shape = shapely.box(west, south, east, north)
+            shapes[i] = shape
+        # The predicate reads "item <predicate> query", e.g. item within the query polygon
+        return rows[getattr(shapely, predicate)(shapes, geometry)]
+
+
+def _as_bounds(bbox):
+    if bbox is None or (not isinstance(bbox, (list, tuple, np.ndarray))) or len(bbox) not in (4, 6):
+        return None
+    bbox = [float(v) for v in bbox]
+    return bbox if len(bbox) == 4 else [bbox[0], bbox[1], bbox[3], bbox[4]]
+
+
+def _spans(bbox):
+    """A query box as one or two boxes that do not cross the antimeridian."""
+    west, south, east, north = bbox
+    if west <= east:
+        return [(west, south, east, north)]
+    return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+
+def _parse(geometry):
+    if geometry is None:
+        return None
+    if isinstance(geometry, dict):
+        geometry = json.dumps(geometry)
+    return shapely.from_geojson(geometry, on_invalid="ignore")
@@ -0,0 +1,233 @@
+"""
+Datetime validation for Montandon items.
+
+Some collections carry placeholder dates: ``desinventar-events`` stores
+unknown days as the 1st of the month and has records dated before the year
+1100. The rules live in one table, ``DATETIME_RULES``, and each collection's
+rule is compiled once into a small checker with its bounds bound as locals,
+so checking an item costs one ``datetime.fromisoformat`` call and a couple of
+comparisons.
+
+Features:
+- ``is_valid_datetime(value, collection_id)``: checks one datetime string.
+- ``valid_datetime_mask(values, collection_id)``: checks a whole column at
+  once. Strings of the fixed ``YYYY-MM-DDTHH:MM:SSZ`` shape are decoded and
+  checked in NumPy; only the other shapes go through the scalar checker.
+- ``parse_datetime_column(values)``: a column of datetime strings as
+  ``datetime64[s]`` (``NaT`` where invalid), covering years NumPy's
+  nanosecond pandas timestamps cannot hold.
+- ``DatetimeRule.skip`` / ``invalid_days`` used by ``montandon.extremes`` to
+  push the rules into queries.
+
+Requires:
+    - numpy (pip install numpy), for the column functions
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import sys
+
+SECOND = timedelta(seconds=1)
+DAY = timedelta(days=1)
+
+FIXED_SHAPE = "YYYY-MM-DDTHH:MM:SSZ"
+FIXED_LEN = len(FIXED_SHAPE)
+_SEPARATORS = {4: "-", 7: "-", 10: "T", 13: ":", 16: ":", 19: "Z"}
+_DAYS_IN_MONTH = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+if sys.version_info >= (3, 11):
+    # fromisoformat understands the trailing "Z" itself
+    _fromisoformat = datetime.fromisoformat
+else:
+    def _fromisoformat(value):
+        return datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+
+
+class DatetimeRule:
+    """
+    Which item datetimes count as real: the year must be above ``min_year``
+    and at most ``max_year`` (next year when None). With ``skip_first_day``
+    the 1st of every month is a placeholder for an unknown day.
+    """
+
+    def __init__(self, min_year=100, max_year=None, skip_first_day=False):
+        self.min_year = min_year
+        self._max_year = max_year
+        self.skip_first_day = skip_first_day
+
+    @property
+    def max_year(self):
+        return self._max_year or datetime.now(timezone.utc).year + 1
+
+    def bounds(self):
+        """The ``(start, end)`` datetimes that hold every valid year."""
+        return (datetime(self.min_year + 1, 1, 1, tzinfo=timezone.utc),
+                datetime(self.max_year, 12, 31, 23, 59, 59, tzinfo=timezone.utc))
+
+    def is_valid(self, dt):
+        """True if the (parsed) datetime passes the rule."""
+        if dt is None or not self.min_year < dt.year <= self.max_year:
+            return False
+        return not (self.skip_first_day and dt.day == 1)
+
+    def compile(self):
+        """Returns a fast ``check(value)`` for datetime strings, with this rule's bounds frozen in."""
+        min_year, max_year, skip_first_day = self.min_year, self.max_year, self.skip_first_day
+        fromisoformat = _fromisoformat
+
+        def check(value):
+            if value.__class__ is not str:
+                return False
+            try:
+                dt = fromisoformat(value)
+            except ValueError:
+                return False
+            return min_year < dt.year <= max_year and not (skip_first_day and dt.day == 1)
+        return check
+
+    def valid_mask(self, values):
+        """Boolean NumPy mask of the datetime strings in ``values`` that pass the rule."""
+        import numpy as np
+
+        values = _as_objects(values)
+        year, day, shaped, real = _fixed_fields(values)
+        mask = real & (year > self.min_year) & (year <= self.max_year)
+        if self.skip_first_day:
+            mask &= day != 1
+        others = np.flatnonzero(~shaped)
+        if len(others):
+            check = self.compile()
+            mask[others] = [check(values[i]) for i in others]
+        return mask
+
+    def skip(self, dt, ascending=True):
+        """
+        The nearest instant past the invalid ``dt``, in the search direction,
+        that could hold a valid datetime.
+        """
+        if self.skip_first_day and dt.day == 1:
+            day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+            return day + DAY if ascending else day - SECOND
+        return dt + SECOND if ascending else dt - SECOND
+
+    def invalid_days(self, start, end):
+        """The starts of the placeholder days between ``start`` and ``end`` (in either order)."""
+        if not self.skip_first_day:
+            return []
+        start, end = min(start, end), max(start, end)
+        day = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        days = []
+        while day <= end:
+            if day + DAY > start:
+                days.append(day)
+            day = day.replace(year=day.year + day.month // 12, month=day.month % 12 + 1)
+        return days
+
+
+DEFAULT_RULE = DatetimeRule(min_year=100)
+DATETIME_RULES = {
+    "desinventar-events": DatetimeRule(min_year=1100, skip_first_day=True),
+}
+
+
+def rule_for(collection_id):
+    """The ``DatetimeRule`` of a collection (``DEFAULT_RULE`` unless listed in ``DATETIME_RULES``)."""
+    return DATETIME_RULES.get(collection_id, DEFAULT_RULE)
+
+
+def validator(collection_id=None):
+    """
+    The compiled checker of a collection's rule, built once per collection
+    and ``max_year`` (which moves on with the clock when the rule leaves it
+    open), so long-running processes do not keep last year's bound.
+    """
+    rule = rule_for(collection_id)
+    return _compiled(rule, rule.max_year)
+
+
+@lru_cache(maxsize=None)
+def _compiled(rule, max_year):
+    return rule.compile()
+
+
+def is_valid_datetime(value, collection_id=None):
+    """True if the datetime string is a realistic date under the collection's rule."""
+    return validator(collection_id)(value)
+
+
+def valid_datetime_mask(values, collection_id=None):
+    """Vectorized ``is_valid_datetime`` over a column (list, array or pandas Series)."""
+    return rule_for(collection_id).valid_mask(values)
+
+
+def parse_datetime_column(values):
+    """
+    Parses a column of datetime strings into a ``datetime64[s]`` array (UTC),
+    with ``NaT`` for missing or unparseable values.
+    """
+    import numpy as np
+
+    values = _as_objects(values)
+    _, _, shaped, real = _fixed_fields(values)
+    parsed = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[s]")
+    if real.any():
+        text = np.asarray(values[real], dtype=f"U{FIXED_LEN - 1}")  # drops the trailing "Z"
+        parsed[real] = text.astype("datetime64[s]")
+    for i in np.flatnonzero(~shaped):
+        value = values[i]
+        if value.__class__ is not str:
+            continue
+        try:
+            dt = _fromisoformat(value)
+        except ValueError:
+            continue
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        parsed[i] = np.datetime64(dt.replace(microsecond=0), "s")
+    return parsed
+
+
+def _as_objects(values):
+    import numpy as np
+
+    if hasattr(values, "to_numpy"):  # pandas Series, pyarrow arrays
+        values = values.to_numpy(zero_copy_only=False) if "pyarrow" in type(values).__module__ \
+            else values.to_numpy()
+    return np.asarray(values, dtype=object)
+
+
+def _fixed_fields(values):
+    """
+    Decodes the values of the fixed ``YYYY-MM-DDTHH:MM:SSZ`` shape in NumPy.
+    Returns the year and day arrays, a mask of the rows that have the shape
+    and a mask of those that also hold a real calendar date and time.
+    """
+    import numpy as np
+
+    n = len(values)
+    # One spare character: a longer string keeps a non-zero code there and fails the shape check.
+    # Anything that is not a string becomes its repr-like text and fails it too.
+    codes = values.astype(f"U{FIXED_LEN + 1}").view(np.uint32).reshape(n, FIXED_LEN + 1)
+    codes = np.ascontiguousarray(codes.T)  # one row per character position
+    shaped = codes[FIXED_LEN] == 0
+    for position, separator in _SEPARATORS.items():
+        shaped &= codes[position] == ord(separator)
+    digits = {}
+    for position in range(FIXED_LEN):
+        if position not in _SEPARATORS:
+            digits[position] = codes[position] - ord("0")  # wraps around below "0"
+            shaped &= digits[position] <= 9
+
+    def number(first, last):
+        value = digits[first].astype(np.int64)
+        for position in range(first + 1, last + 1):
+            value = value * 10 + digits[position]
+        return value
+
+    year, month, day = number(0, 3), number(5, 6), number(8, 9)
+    hour, minute, second = number(11, 12), number(14, 15), number(17, 18)
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    days_in_month = np.asarray(_DAYS_IN_MONTH)[np.clip(month, 0, 12)] + (leap & (month == 2))
+    real = shaped & (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+    real &= (hour < 24) & (minute < 60) & (second < 60)
+    return year, day, shaped, real
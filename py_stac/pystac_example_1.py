@@ -1,27 +1,34 @@
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import sys
+
 from pystac_client import Client
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.catalog import get_catalog
+from montandon.filters import build_filter
+from montandon.pruning import QueryPruner, polygon_bbox
+from montandon.search import demux
+
 
 
 
 
 STAC_API_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
+MAX_WORKERS = 8  # Count requests in flight at once, one per collection
+# Directory of a local replica (python -m montandon.replica sync); when set, the filter
+# below runs on the Parquet files instead of the API.
+REPLICA_DIR = None
 
 
 
 
-collections = [
-    "desinventar-events", "desinventar-impacts", "emdat-events", "emdat-hazards", "emdat-impacts",
-    "gdacs-events", "gdacs-hazards", "gdacs-impacts",
-    "gfd-events", "gfd-hazards", "gfd-impacts",
-    "glide-events", "glide-hazards", "ibtracs-events", "ibtracs-hazards",
-    "idmc-gidd-events", "idmc-gidd-impacts", "idmc-idu-events", "idmc-idu-impacts",
-    "ifrcevent-events", "ifrcevent-hazards", "ifrcevent-impacts",
-    "pdc-events", "pdc-hazards", "pdc-impacts",
-    "reference-events",
-    "usgs-events", "usgs-hazards", "usgs-impacts"
-]
+# Every collection of the API, from the cached /collections catalog
+catalog = get_catalog()
+all_collections = catalog.ids()
 
 
 EUROPE_POLYGON = {
@@ -54,19 +61,74 @@ cql2_advanced = {
     ]
 }
 
-#headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
-client = Client.open(STAC_API_URL) # headers=headers)
-
-for collection in collections:
-    print(f"Searching in collection: {collection}")
-    try:
-        search = client.search(
-            collections=[collection],
-            filter=cql2_advanced,
+# Leave out collections whose extent in the catalog cannot overlap the Europe box or the window
+pruner = QueryPruner(catalog)
+collections = pruner.prune(all_collections, bbox=polygon_bbox(EUROPE_POLYGON), datetime=f"{start_date}/{end_date}")
+print(pruner.report())
+
+counts = Counter()
+if REPLICA_DIR:
+    # The same filter dict, evaluated on the local Parquet replica without any request
+    from montandon.replica import query_replica
+
+    print(f"Filtering {len(collections)} collections in the local replica {REPLICA_DIR}")
+    matched = query_replica(cql2_advanced, collections, columns=["id"], root=REPLICA_DIR)
+    counts.update(matched["collection"])
+# An empty list would mean every collection to /search, so send nothing in that case
+elif not collections:
+    print("No collection's extent overlaps the query; nothing to search")
+else:
+    # Check the filter against the API's queryables before sending it, and rewrite it into
+    # forms the server can index (array tests as a_contains, the Europe rectangle as bbox)
+    compiled = build_filter(cql2_advanced)
+    for note in compiled.notes:
+        print(f"Filter: {note}")
+
+    #headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
+    client = Client.open(STAC_API_URL) # headers=headers)
+
+    def search_matches(search_collections, **kwargs):
+        return client.search(
+            collections=search_collections,
+            filter=compiled.filter,
+            bbox=compiled.bbox,
+            datetime=compiled.datetime,
             filter_lang="cql2-json",
-            limit=100  # Batch size per page; you may adjust (docs say up to 10,000)
+            limit=100,  # Batch size per page; you may adjust (docs say up to 10,000)
+            **kwargs
         )
-        items = list(search.get_all_items())  # Collects ALL paginated results from API!
-        print(f"  Events found in Europe in last 2 months: {len(items)}")
-    except Exception as e:
-        print(f"  Error searching {collection}: {e}")
+
+    if compiled.local:
+        # Part of the filter is checked here, so the server's totals would be too high: count the
+        # items that pass in one /search over all collections, split by their "collection" field
+        print(f"Searching {len(collections)} collections in one request stream")
+        try:
+            items = (item for item in search_matches(collections).items_as_dicts() if compiled.matches(item))
+            for collection, item in demux(items):
+                counts[collection] += 1
+        except Exception as e:
+            print(f"  Error searching: {e}")
+    else:
+        def count_matches(collection):
+            search = search_matches([collection], fields=["id"])
+            # Server-side count (numberMatched) with a single limit=1 request;
+            # fall back to streaming the ids only if the server doesn't report it.
+            count = search.matched()
+            if count is None:
+                count = sum(1 for _ in search.items_as_dicts())
+            return count
+
+        # One count request per collection, MAX_WORKERS of them in flight at once
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(count_matches, collection): collection for collection in collections}
+            for future in as_completed(futures):
+                collection = futures[future]
+                try:
+                    counts[collection] = future.result()
+                except Exception as e:
+                    print(f"  Error searching {collection}: {e}")
+
+# Skipped collections are listed too, with their count of 0
+for collection in all_collections:
+    print(f"Collection: {collection}")
+    print(f"  Events found in Europe in last 2 months: {counts[collection]}")
@@ -1,17 +1,26 @@
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import sys
+
 from pystac_client import Client
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.catalog import get_catalog
+from montandon.filters import build_filter
+from montandon.pruning import QueryPruner, polygon_bbox
+from montandon.search import demux
+
 
 
 STAC_API_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
+MAX_WORKERS = 8  # Count requests in flight at once, one per collection
 
-# Use only collections ending with "-events"
-collections = [
-    "desinventar-events", "emdat-events", "gdacs-events", "gfd-events", 
-    "glide-events", "ibtracs-events", "idmc-gidd-events", "idmc-idu-events",
-    "ifrcevent-events", "pdc-events", "reference-events", "usgs-events"
-]
+# Use only the event collections (role "event" in the cached /collections catalog)
+catalog = get_catalog()
+all_collections = catalog.ids(role="event")
 
 # Europe bounding box for spatial filtering as a Polygon
 EUROPE_POLYGON = {
@@ -43,24 +52,82 @@ cql2_filter = {
     ]
 }
 
+# Leave out collections whose extent in the catalog cannot overlap the Europe box or the window
+pruner = QueryPruner(catalog)
+collections = pruner.prune(all_collections, bbox=polygon_bbox(EUROPE_POLYGON), datetime=f"{start_date}/{end_date}")
+print(pruner.report())
+
+# Check the filter against the API's queryables before sending it, and rewrite it into
+# forms the server can index (array tests as a_contains, the Europe rectangle as bbox)
+compiled = build_filter(cql2_filter)
+for note in compiled.notes:
+    print(f"Filter: {note}")
+
 #headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
 client = Client.open(STAC_API_URL)
 
-for collection in collections:
-    print(f"\nSearching in collection: {collection}")
+
+def search_matches(search_collections, **kwargs):
+    return client.search(
+        collections=search_collections,
+        filter=compiled.filter,
+        bbox=compiled.bbox,
+        datetime=compiled.datetime,
+        filter_lang="cql2-json",
+        limit=100,  # items per page, will paginate if more exist
+        **kwargs
+    )
+
+
+counts = Counter()
+samples = {}
+# An empty list would mean every collection to /search, so send nothing in that case
+if not collections:
+    print("No collection's extent overlaps the query; nothing to search")
+elif compiled.local:
+    # Part of the filter is checked here, so the server's totals would be too high: count the items
+    # that pass in one /search over all collections, split by their "collection" field
     try:
-        search = client.search(
-            collections=[collection],
-            filter=cql2_filter,
-            filter_lang="cql2-json",
-            limit=100  # items per page, will paginate if more exist
-        )
-        items = list(search.get_all_items())
-        print(f"  Events found in Europe in last 2 months: {len(items)}")
-        # Optionally show some details for the first event (if any found):
-        if items:
-            first = items[0]
-            props = first.properties
-            print(f"    Sample: ID={first.id}, Date={props.get('datetime')}, Roles={props.get('roles')}")
+        items = (item for item in search_matches(collections).items_as_dicts() if compiled.matches(item))
+        for collection, item in demux(items):
+            counts[collection] += 1
+            samples.setdefault(collection, item)
     except Exception as e:
-        print(f"  Error searching {collection}: {e}")
+        print(f"  Error searching: {e}")
+else:
+    def count_matches(collection):
+        search = search_matches([collection], fields=["id"])
+        # Ask the server for the total (numberMatched, one limit=1 request);
+        # only page through the ids when it doesn't report counts.
+        count = search.matched()
+        if count is None:
+            count = sum(1 for _ in search.items_as_dicts())
+        return count
+
+    # One count request per collection, MAX_WORKERS of them in flight at once
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(count_matches, collection): collection for collection in collections}
+        for future in as_completed(futures):
+            collection = futures[future]
+            try:
+                counts[collection] = future.result()
+            except Exception as e:
+                print(f"  Error searching {collection}: {e}")
+    # One sample per collection with matches, from a single /search that stops once each has one
+    sampled = [collection for collection in collections if counts[collection]]
+    if sampled:
+        try:
+            for collection, item in demux(search_matches(sampled).items_as_dicts(), 1, sampled):
+                samples[collection] = item
+        except Exception as e:
+            print(f"  Error fetching samples: {e}")
+
+# Skipped collections are listed too, with their count of 0
+for collection in all_collections:
+    print(f"\nCollection: {collection}")
+    print(f"  Events found in Europe in last 2 months: {counts[collection]}")
+    # Show some details for the first event (if any found):
+    first = samples.get(collection)
+    if first:
+        props = first.get("properties", {})
+        print(f"    Sample: ID={first.get('id')}, Date={props.get('datetime')}, Roles={props.get('roles')}")
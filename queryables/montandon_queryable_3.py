@@ -65,26 +65,25 @@
 from pystac_client import Client
 from datetime import datetime, timedelta
 import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.catalog import get_catalog
+from montandon.filters import build_filter
+from montandon.search import demux
 
 
 STAC_API_URL = "https://montandon-eoapi-stage.ifrc.org/stac"
 
-# Initialize client with authentication
-#headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
-client = Client.open(STAC_API_URL) # headers=headers)
-
-# Define collections
-collections = [
-    "desinventar-events", "desinventar-impacts", "emdat-events", "emdat-hazards", "emdat-impacts",
-    "gdacs-events", "gdacs-hazards", "gdacs-impacts",
-    "gfd-events", "gfd-hazards", "gfd-impacts",
-    "glide-events", "glide-hazards", "ibtracs-events", "ibtracs-hazards",
-    "idmc-gidd-events", "idmc-gidd-impacts", "idmc-idu-events", "idmc-idu-impacts",
-    "ifrcevent-events", "ifrcevent-hazards", "ifrcevent-impacts",
-    "pdc-events", "pdc-hazards", "pdc-impacts",
-    "reference-events",
-    "usgs-events", "usgs-hazards", "usgs-impacts"
-]
+# Directory of a local replica (python -m montandon.replica sync); when set, the filter
+# below runs on the Parquet files instead of the API.
+REPLICA_DIR = None
+
+# The filter keeps only items with the 'event' role, which live in the event collections
+# (from the cached /collections catalog). Searching hazard and impact collections as well
+# would cost pages only, and demux would wait for them to fill, which they never do.
+collections = get_catalog().ids(role="event")
 
 # Date range (last 180 days)
 today = datetime.utcnow()
@@ -101,27 +100,49 @@ cql2_filter = {
     ]
 }
 
-# Query each collection
-for collection in collections:
-    print(f"Querying collection: {collection}")
-    
+MAX_ITEMS_PER_COLLECTION = 10
+
+items_by_collection = {collection: [] for collection in collections}
+if REPLICA_DIR:
+    # The same filter dict, evaluated on the local Parquet replica without any request
+    from montandon.replica import query_replica
+
+    matched = query_replica(cql2_filter, collections, root=REPLICA_DIR)
+    for collection, group in matched.groupby("collection"):
+        items_by_collection[collection] = group.head(MAX_ITEMS_PER_COLLECTION).to_dict("records")
+else:
+    # Check the filter against the API's queryables before sending it, and rewrite it into
+    # forms the server can index ("event" in roles as a_contains)
+    compiled = build_filter(cql2_filter)
+    for note in compiled.notes:
+        print(f"Filter: {note}")
+
+    # Initialize client with authentication
+    #headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
+    client = Client.open(STAC_API_URL) # headers=headers)
+
+    # Query all collections with one search; the 10-item limit is applied per collection
+    # on the client, and the stream stops once every collection has its 10 items.
     try:
-        # Search with CQL2 filter
         search = client.search(
-            collections=[collection],
-            filter=cql2_filter,
+            collections=collections,
+            filter=compiled.filter,
+            bbox=compiled.bbox,
+            datetime=compiled.datetime,
             filter_lang="cql2-json",
-            max_items=10  # Limit to 10 items per collection
+            limit=100
         )
-        
-        # Get items
-        items = list(search.items())
-        print(f"  Found {len(items)} matching records")
-        
-        # Preview first item
-        if items:
-            first_item = items[0].to_dict()
-            print(json.dumps(first_item, indent=2))
-            
+        # Parts of the filter the server cannot run are checked here
+        items = (item for item in search.items_as_dicts() if compiled.matches(item))
+        for collection, item in demux(items, MAX_ITEMS_PER_COLLECTION, collections):
+            items_by_collection[collection].append(item)
     except Exception as e:
         print(f"  Error: {str(e)}")
+
+for collection, items in items_by_collection.items():
+    print(f"Querying collection: {collection}")
+    print(f"  Found {len(items)} matching records")
+
+    # Preview first item
+    if items:
+        print(json.dumps(items[0], indent=2, default=str))  # replica rows hold NumPy arrays
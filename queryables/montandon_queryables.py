@@ -1,11 +1,16 @@
+import json
+import os
+import sys
 
-import requests
-import json 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.filters import get_queryables
 
 
-
-url = "https://montandon-eoapi-stage.ifrc.org/stac/collections/usgs-events/queryables"
-resp = requests.get(url) # headers={"Authorization": f"Bearer {BEARER_TOKEN}"})
-data = resp.json()
+# /collections/usgs-events/queryables, from the on-disk cache that montandon.filters
+# also checks filters against
+queryables = get_queryables("usgs-events")
 # Pretty print the JSON
-print(json.dumps(data, indent=2))
+print(json.dumps(queryables.schema if queryables else None, indent=2))
+if queryables:
+    for name in sorted(queryables.properties):
+        print(f"{name}: {queryables.kind(name)}")
@@ -1,26 +1,20 @@
-import requests
+import asyncio
 from datetime import datetime, timedelta
-import json
 import os
+import sys
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from montandon.catalog import get_catalog
+from montandon.engine import FetchEngine
+from montandon.probe import probe_collections, probe_status, write_probe_results
+from montandon.pruning import QueryPruner
 
 
-base_url = "https://montandon-eoapi-stage.ifrc.org/stac/collections"
 #headers = {"Authorization": f"Bearer {BEARER_TOKEN}"}
 
-collections = [
-    "desinventar-events", "desinventar-impacts", 
-    "emdat-events", "emdat-hazards", "emdat-impacts",
-    "gdacs-events", "gdacs-hazards", "gdacs-impacts",
-    "gfd-events", "gfd-hazards", "gfd-impacts",
-    "glide-events", "glide-hazards", 
-    "ibtracs-events", "ibtracs-hazards",
-    "idmc-gidd-events", "idmc-gidd-impacts", 
-    "idmc-idu-events", "idmc-idu-impacts",
-    "ifrcevent-events", "ifrcevent-hazards", "ifrcevent-impacts",
-    "pdc-events", "pdc-hazards", "pdc-impacts",
-    "usgs-events", "usgs-hazards", "usgs-impacts",
-]
+# All collections, from the cached /collections catalog
+catalog = get_catalog()
+collections = catalog.ids()
 
 today = datetime.utcnow()
 start_date = (today - timedelta(days=60)).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -30,42 +24,55 @@ datetime_range = f"{start_date}/{end_date}"
 bbox_europe = "-12,34,40,72"
 sortby = "-datetime"
 
-all_first_records = []
+# Health/freshness check: give up on collections that have not answered by then
+PROBE_DEADLINE = 30  # seconds
+PROBE_MAX_RETRIES = 2
 
-for collection in collections:
-    url = (
-        f"{base_url}/{collection}/items"
-        f"?limit=10"
-        f"&datetime={datetime_range}"
-        f"&bbox={bbox_europe}"
-        f"&sortby={sortby}"
-    )
-    print(f"\nTrying collection: {collection}")
-    response = requests.get(url) # headers=headers)
-    print("  Status:", response.status_code)
-    record = None
-    if response.status_code == 200:
-        data = response.json()
-        items = data.get("features", [])
-        print(f"  Found {len(items)} matching records")
-        if items:
-            record = items[0]  # Save first record
-            print("  Example record saved.")
-        else:
-            print("  No records found for this collection in the selected window.")
-    else:
-        print("  Response content:", response.text)
-    all_first_records.append({
-        "collection": collection,
-        "record": record
-    })
+output_folder = os.path.join(os.getcwd(), "all_collections")
+os.makedirs(output_folder, exist_ok=True)
 
+output_path = os.path.join(output_folder, "first_records_per_collection.json")
 
 
+async def probe_all():
+    """
+    Sends one limit=1 request per collection, all at once, and rewrites the
+    output file as each answer arrives. Collections whose spatial extent
+    cannot overlap the box are marked skipped without a request; the
+    temporal extent is not used, since finding fresh data past a stale
+    catalog extent is what the probe is for.
+    """
+    results = {}
+    pruner = QueryPruner(catalog)
+    skipped = {coll: reason for coll in collections
+               if (reason := pruner.reason(coll, bbox=bbox_europe))}
+    to_probe = [coll for coll in collections if coll not in skipped]
+    for coll, reason in skipped.items():
+        print(f"{coll}: skipped ({reason})")
+    write_probe_results(output_path, collections, results, skipped)
+    if not to_probe:
+        return results, skipped
+    async with FetchEngine(max_concurrency=len(to_probe), per_host=len(to_probe)) as engine:
+        async for collection, record, error in probe_collections(
+            engine,
+            to_probe,
+            deadline=PROBE_DEADLINE,
+            sortby=sortby,
+            datetime=datetime_range,
+            bbox=bbox_europe,
+            max_retries=PROBE_MAX_RETRIES,
+        ):
+            results[collection] = (record, error)
+            write_probe_results(output_path, collections, results, skipped)
+            print(f"{collection}: {probe_status(record, error)}")
+    return results, skipped
 
-output_folder = os.path.join(os.getcwd(), "all_collections")
-os.makedirs(output_folder, exist_ok=True)
 
-output_path = os.path.join(output_folder, "first_records_per_collection.json")
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(all_first_records, f, indent=2)
\ No newline at end of file
+started = datetime.utcnow()
+results, skipped = asyncio.run(probe_all())
+found = sum(1 for record, _ in results.values() if record is not None)
+print(f"\nProbed {len(collections) - len(skipped)} collections in {(datetime.utcnow() - started).total_seconds():.1f}s: "
+      f"{found} with records in the selected window")
+if skipped:
+    print(f"Skipped {len(skipped)} of {len(collections)} requests: their extent in the catalog misses the box")
+print(f"Saved to {output_path}")